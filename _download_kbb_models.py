@@ -2,12 +2,13 @@ import os
 import sys
 import pandas as pd
 from bs4 import BeautifulSoup
-import requests
+
+from transport import get_transport
   
 path = 'html.html'
 url = 'https://www.kbb.com/car-make-model-list/used/view-all/model/'
 
-with requests.get(url) as page:
+with get_transport().get(url) as page:
     # for getting the header from
     # the HTML file
     list_header = []
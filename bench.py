@@ -0,0 +1,436 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# recorded pages and the answers the stand-ins give, see bench_fixtures/scenario.json
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_fixtures')
+BASELINE_PATH = os.path.join(FIXTURES_DIR, 'baseline.json')
+
+# benchmarks by name, in the order they run
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark. The decorated function is given the loaded fixtures and returns the function to time.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def load_fixtures(path: str = FIXTURES_DIR) -> dict:
+    """
+    Load the benchmark scenario and the recorded pages it refers to.
+
+    Returns:
+    - dict: The scenario with the listing and description HTML added as `listing_html` and `description_html`.
+    """
+    with open(os.path.join(path, 'scenario.json')) as file:
+        fixtures = json.load(file)
+
+    listing = fixtures['listing']
+    with open(os.path.join(path, listing['listing_file']), encoding='utf-8') as file:
+        fixtures['listing_html'] = file.read()
+    with open(os.path.join(path, listing['description_file']), encoding='utf-8') as file:
+        fixtures['description_html'] = file.read()
+
+    return fixtures
+
+
+class EbayStandIn:
+    """
+    A local stand-in for eBay that serves the recorded listing at `/itm/<item id>` and its description frame at
+    `/desc/<item id>`, the path the listing's `desc_ifr` frame points at.
+    """
+
+    def __init__(self, listing_html: str, description_html: str, host: str = '127.0.0.1', port: int = 0):
+        pages = {'itm': listing_html.encode(), 'desc': description_html.encode()}
+        self.requests = 0
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(self.path.strip('/').split('/')[0])
+                standin.requests += 1
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def listing_url(self, item_id: str) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/itm/{item_id}'
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def seed_kbb_cache(fixtures: dict) -> None:
+    """
+    Put the recorded KBB styles and price ranges in the KBB cache under the keys `get_info` looks them up with, so
+    the end-to-end run never needs a browser.
+    """
+    from catalog import get_catalog
+    from kbb_scrape import _price_type, _ranges_key, get_kbb_cache
+    from utils import serialize
+
+    vin = next(iter(fixtures['vpic'].values()))
+    kbb = fixtures['kbb']
+    listing = fixtures['expected']
+    year, mileage = vin['ModelYear'], _listing_specs(fixtures)['Mileage']
+    make = vin['Make'].title()
+    model = get_catalog().match_model(make, [vin['Model']], year=year)[0][1]
+
+    cache = get_kbb_cache()
+    cache.set(cache.make_key('styles', serialize(make), serialize(model), serialize(year), serialize(vin['BodyClass'])), kbb['styles'])
+
+    # the same conditions and serialization get_info uses
+    for style in kbb['styles']:
+        for trade_in, condition, ranges in ((True, serialize('fair', replace_with=''), kbb['trade_in']), (False, 'good', kbb['private_party'])):
+            key = _ranges_key(cache, serialize(make), serialize(model), serialize(year), serialize(style), condition, serialize(mileage), _price_type(trade_in)[0])
+            cache.set(key, ranges)
+
+    if listing['model'] != model:
+        raise RuntimeError(f"the catalog matched {model!r}, the scenario expects {listing['model']!r}")
+
+
+@contextmanager
+def offline_environment(fixtures: dict):
+    """
+    Point every outside service at a local stand-in: eBay at an EbayStandIn, vPIC at a `vpic_standin.VpicStandIn`
+    and KBB at a freshly seeded cache in a temporary directory. The user's own caches, VIN index and catalog cache are
+    not touched, and the caches and catalog loaded before are back in place afterwards.
+
+    Yields:
+    - str: The URL of the recorded listing.
+    """
+    import catalog
+    import kbb_scrape
+    import vin_decoder
+    from vpic_standin import VpicStandIn
+
+    overrides = {}
+    def override(name, value):
+        overrides.setdefault(name, getattr(config, name))
+        setattr(config, name, value)
+
+    # the process wide caches and catalog are loaded again from the overridden paths, and put back afterwards
+    singletons = {}
+    def reset(module, name):
+        singletons.setdefault((module, name), getattr(module, name))
+        setattr(module, name, None)
+
+    with tempfile.TemporaryDirectory() as directory, VpicStandIn(fixtures['vpic']) as vpic:
+        ebay = EbayStandIn(fixtures['listing_html'], fixtures['description_html'])
+        try:
+            override('KBB_CACHE_PATH', os.path.join(directory, 'kbb.sqlite3'))
+            override('VIN_CACHE_PATH', '')
+            override('VIN_INDEX_PATH', '')
+            override('VPIC_URL', vpic.url)
+            override('CATALOG_CACHE_PATH', os.path.join(directory, 'catalog.pickle'))
+
+            reset(kbb_scrape, '_cache')
+            reset(vin_decoder, '_pattern_cache')
+            reset(vin_decoder, '_offline_index')
+            reset(catalog, '_catalog')
+
+            seed_kbb_cache(fixtures)
+            yield ebay.listing_url(fixtures['listing']['item_id'])
+
+        finally:
+            ebay.stop()
+            for name, value in overrides.items():
+                setattr(config, name, value)
+            for (module, name), value in singletons.items():
+                setattr(module, name, value)
+
+
+def _listing_specs(fixtures: dict) -> dict:
+    from ebay_scrape import ListingDocument
+    return ListingDocument('http://127.0.0.1/itm/0', html=fixtures['listing_html']).item_specs()
+
+def _valuation_args(fixtures: dict) -> dict:
+    # the arguments of the briefing generators, from the recorded listing and KBB ranges
+    from ebay_scrape import parse_description
+    from bs4 import BeautifulSoup
+
+    specs = _listing_specs(fixtures)
+    expected = fixtures['expected']
+    return {
+        'year': specs['Year'],
+        'make': expected['make'],
+        'style': expected['style'],
+        'model': expected['model'],
+        'mileage': int(specs['Mileage']),
+        'desc': parse_description(BeautifulSoup(fixtures['description_html'], 'html.parser')),
+        'listing_price': expected['listing_price'],
+        'private_party_ranges': fixtures['kbb']['private_party'],
+        'trade_in_ranges': fixtures['kbb']['trade_in'],
+    }
+
+
+@benchmark('ebay.item_specs')
+def _bench_item_specs(fixtures):
+    from ebay_scrape import ListingDocument
+    html = fixtures['listing_html']
+    return lambda: ListingDocument('http://127.0.0.1/itm/0', html=html).item_specs()
+
+@benchmark('ebay.parse_description')
+def _bench_parse_description(fixtures):
+    from bs4 import BeautifulSoup
+    from ebay_scrape import parse_description
+    html = fixtures['description_html']
+    return lambda: parse_description(BeautifulSoup(html, 'html.parser'))
+
+@benchmark('scrubber.scrub')
+def _bench_scrub(fixtures):
+    from ebay_scrubber import Scrubber
+    raw = {
+        'Condition': 'Used: A vehicle that has been registered and issued a title.',
+        'VIN (Vehicle Identification Number)': 'YV1622FS5C2087421',
+        'Options': 'Leather Seats, Sunroof, Bluetooth, Heated Seats',
+        'Power Options': 'Power Locks, Power Windows, Power Seats, Cruise Control',
+        'Year': '2012',
+        'Trim': 'T5',
+    }
+    return lambda: Scrubber().scrub(dict(raw))
+
+@benchmark('utils.get_best_pair')
+def _bench_get_best_pair(fixtures):
+    from catalog import get_catalog
+    from utils import get_best_pair
+    specs = _listing_specs(fixtures)
+    vin = next(iter(fixtures['vpic'].values()))
+    models = get_catalog().models(fixtures['expected']['make'])
+    return lambda: get_best_pair([vin['Model'], specs['Trim']], models)
+
+@benchmark('catalog.match_model')
+def _bench_match_model(fixtures):
+    from catalog import get_catalog
+    specs = _listing_specs(fixtures)
+    vin = next(iter(fixtures['vpic'].values()))
+    catalog = get_catalog()
+    return lambda: catalog.match_model(fixtures['expected']['make'], [vin['Model'], specs['Trim']], year=specs['Year'])
+
+@benchmark('helpers.style_from_description')
+def _bench_style_from_description(fixtures):
+    from get_info_helpers import style_from_description
+    styles, desc = fixtures['kbb']['styles'], _valuation_args(fixtures)['desc']
+    return lambda: style_from_description(styles, desc)
+
+@benchmark('helpers.style_from_specs')
+def _bench_style_from_specs(fixtures):
+    from get_info_helpers import style_from_specs
+    styles, specs = fixtures['kbb']['styles'], _listing_specs(fixtures)
+    return lambda: style_from_specs(styles, specs)
+
+@benchmark('helpers.generate_str_breifing')
+def _bench_str_breifing(fixtures):
+    from get_info_helpers import generate_str_breifing
+    args = _valuation_args(fixtures)
+    return lambda: generate_str_breifing(**args)
+
+@benchmark('helpers.generate_styled_breifing')
+def _bench_styled_breifing(fixtures):
+    from get_info_helpers import generate_styled_breifing
+    args = _valuation_args(fixtures)
+    args['listing_url'] = 'http://127.0.0.1/itm/0'
+    return lambda: generate_styled_breifing(**args)
+
+@benchmark('end_to_end.analyze_car')
+def _bench_analyze_car(fixtures):
+    from get_info import analyze_listing
+    url = fixtures['listing_url']
+
+    # make sure the offline run gives the recorded answer before timing it
+    valuation = analyze_listing(url)['valuation']
+    expected = fixtures['expected']
+    for name in ('make', 'model', 'style', 'listing_price', 'listing_avg_delta'):
+        if getattr(valuation, name) != expected[name]:
+            raise RuntimeError(f'end-to-end {name} is {getattr(valuation, name)!r}, the scenario expects {expected[name]!r}')
+
+    return lambda: analyze_listing(url)
+
+
+# modules whose cold start is timed: the command line and what its commands load. Each import runs in a fresh
+# interpreter, so the time includes the interpreter's own startup, which `startup.python` times on its own.
+STARTUP_MODULES = ('flipper', 'vin_decoder', 'kbb_scrape', 'get_info', 'service')
+
+def _start_python(*args) -> None:
+    subprocess.run([sys.executable, *args], cwd=os.path.dirname(os.path.abspath(__file__)), check=True, stdout=subprocess.DEVNULL)
+
+@benchmark('startup.python')
+def _bench_start_python(fixtures):
+    return lambda: _start_python('-c', 'pass')
+
+def _startup_benchmark(module: str):
+    @benchmark(f'startup.{module}')
+    def setup(fixtures):
+        return lambda: _start_python('-c', f'import {module}')
+    return setup
+
+for _module in STARTUP_MODULES:
+    _startup_benchmark(_module)
+
+
+def measure(func, rounds: int = 5, min_time: float = 0.05) -> dict:
+    """
+    Time a function. The number of calls per round is raised until a round takes at least `min_time` seconds.
+
+    Returns:
+    - dict: The seconds per call of the fastest, median and mean round, with the `rounds` and `number` of calls
+      per round.
+    """
+    func()  # warm up caches and lazy imports
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number): func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= max(2, min(10, int(min_time / max(elapsed, 1e-9))))
+
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number): func()
+        times.append((time.perf_counter() - start) / number)
+
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'rounds': rounds,
+        'number': number,
+    }
+
+
+def run_benchmarks(names: list = None, rounds: int = 5, min_time: float = 0.05) -> dict:
+    """
+    Run the benchmarks offline against the recorded fixtures.
+
+    Args:
+    - names (list): The benchmarks to run (optional). Every benchmark runs by default.
+    - rounds (int): Timed rounds per benchmark. Defaults to 5.
+    - min_time (float): The shortest a round may take, in seconds. Defaults to 0.05.
+
+    Returns:
+    - dict: The machine the run was made on and the timings of every benchmark (see `measure`).
+    """
+    fixtures = load_fixtures()
+    unknown = set(names or ()) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with offline_environment(fixtures) as listing_url:
+        fixtures['listing_url'] = listing_url
+        for name, setup in BENCHMARKS.items():
+            if names and name not in names: continue
+            results[name] = measure(setup(fixtures), rounds=rounds, min_time=min_time)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.25) -> dict:
+    """
+    Compare the median of every benchmark with a baseline report.
+
+    Args:
+    - report (dict): A report from `run_benchmarks`.
+    - baseline (dict): An earlier report.
+    - tolerance (float): How much slower or faster than the baseline, as a fraction, still counts as unchanged.
+      Defaults to 0.25.
+
+    Returns:
+    - dict: For every benchmark the `baseline` and `current` medians, their `ratio` and a `status` of 'ok',
+      'slower', 'faster' or 'new'.
+    """
+    comparison = {}
+    for name, result in report['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            comparison[name] = {'baseline': None, 'current': result['median'], 'ratio': None, 'status': 'new'}
+            continue
+
+        ratio = result['median'] / before['median']
+        status = 'slower' if ratio > 1 + tolerance else 'faster' if ratio < 1 - tolerance else 'ok'
+        comparison[name] = {'baseline': before['median'], 'current': result['median'], 'ratio': ratio, 'status': status}
+    return comparison
+
+
+def format_report(report: dict, comparison: dict = None) -> str:
+    """Returns the timings, and how they compare with the baseline, as a text table."""
+    lines = [f"{'benchmark':<34} {'median':>12} {'min':>12} {'vs baseline':>14}"]
+    for name, result in report['results'].items():
+        versus = ''
+        if comparison is not None:
+            entry = comparison[name]
+            versus = 'new' if entry['ratio'] is None else f"{entry['ratio']:.2f}x {entry['status']}"
+        lines.append(f"{name:<34} {result['median'] * 1e3:>10.3f}ms {result['min'] * 1e3:>10.3f}ms {versus:>14}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths offline against recorded fixtures.')
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='shortest a timed round may take, in seconds')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='report to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='fraction slower than the baseline that still passes')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 when a benchmark is slower than the baseline')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.names, rounds=args.rounds, min_time=args.min_time)
+
+    comparison = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            comparison = compare(report, json.load(file), args.tolerance)
+        report['comparison'] = comparison
+
+    print(format_report(report, comparison))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    if args.check and comparison and any(entry['status'] == 'slower' for entry in comparison.values()):
+        sys.exit(1)
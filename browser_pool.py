@@ -0,0 +1,262 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import config
+from thread_class import check_cancelled
+from tracing import traced
+
+
+class BrowserPoolTimeout(Exception):
+    pass
+
+
+# seconds between checks for cancellation while waiting for a free browser
+_CANCEL_POLL = 1.0
+
+
+@lru_cache(maxsize=None)
+def _driver_path() -> str:
+    # resolving (and possibly downloading) chromedriver is slow, do it once per process
+    from webdriver_manager.chrome import ChromeDriverManager
+    return ChromeDriverManager().install()
+
+
+def _webdriver_exception():
+    # selenium is only imported once a browser is needed, see `BrowserPool._launch`
+    from selenium.common.exceptions import WebDriverException
+    return WebDriverException
+
+
+class BrowserPool:
+    """
+    A bounded pool of warm headless Chrome browsers.
+
+    Browsers are launched lazily up to `size`, handed out with `checkout` and given back with `checkin`. A browser
+    is health checked before it is handed out and is quit and replaced once it has served `max_pages` checkouts, so
+    a long running batch never works with a stale or crashed browser.
+
+    Methods:
+        checkout(self, timeout)
+            Returns an idle browser, launching one if the pool is not full yet.
+
+        checkin(self, browser, broken)
+            Gives a browser back to the pool, or quits it if it is broken or worn out.
+
+        browser(self, timeout)
+            Context manager around checkout and checkin.
+
+        stats(self)
+            Returns how many browsers are open and idle.
+
+        close(self)
+            Quits every idle browser.
+    """
+
+    def __init__(self, size: int = None, max_pages: int = None, user_agent: str = None):
+        """
+        Initialize an empty BrowserPool.
+
+        Parameters:
+        - size (int): The most browsers that can be open at once. Defaults to `config.BROWSER_POOL_SIZE`.
+        - max_pages (int): The number of checkouts after which a browser is recycled. Defaults to `config.BROWSER_MAX_PAGES`.
+        - user_agent (str): The user agent the browsers send. Defaults to `config.CUSTOM_USER_AGENT`.
+        """
+        self.size = size or config.BROWSER_POOL_SIZE
+        self.max_pages = max_pages or config.BROWSER_MAX_PAGES
+        self.user_agent = user_agent or config.CUSTOM_USER_AGENT
+
+        self._idle = []
+        self._pages = {}
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _launch(self):
+        # selenium and webdriver_manager are imported here rather than with this module, so commands that never
+        # open a browser do not pay for them
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless=new')
+        options.add_argument(f'user-agent={self.user_agent}')
+        return webdriver.Chrome(service=Service(_driver_path()), options=options)
+
+    def _quit(self, browser) -> None:
+        with self._cond:
+            self._pages.pop(id(browser), None)
+        try:
+            browser.quit()
+        except _webdriver_exception():
+            pass
+
+    def _retire(self, browser) -> None:
+        # quitting a browser can take seconds, so it happens outside of the lock and frees its place afterwards
+        self._quit(browser)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _healthy(browser) -> bool:
+        # a crashed browser or a dead chromedriver raises on any command
+        try:
+            browser.current_url
+            return True
+        except _webdriver_exception():
+            return False
+
+    @traced('browser.checkout')
+    def checkout(self, timeout: float = None):
+        """
+        Take a browser out of the pool.
+
+        Parameters:
+        - timeout (float): Seconds to wait for a free browser. Defaults to `config.BROWSER_CHECKOUT_TIMEOUT`.
+
+        Returns:
+        - WebDriver: A browser that is ready to navigate.
+
+        Raises:
+        - BrowserPoolTimeout: If no browser became free in time.
+        - thread_class.Cancelled: If the work asking for the browser was cancelled while it waited.
+        """
+        if timeout is None:
+            timeout = config.BROWSER_CHECKOUT_TIMEOUT
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError('browser pool is closed')
+
+                    # a listing that already failed should not take a browser from one that can still succeed
+                    check_cancelled()
+
+                    # the most recently used idle browser, or a place to launch a new one
+                    if self._idle:
+                        browser = self._idle.pop()
+                        break
+
+                    if self._open < self.size:
+                        self._open += 1
+                        browser = None
+                        break
+
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise BrowserPoolTimeout(f'no browser became free within {timeout} seconds')
+
+                    # wake up now and then to notice if the waiting work was cancelled
+                    self._cond.wait(_CANCEL_POLL if remaining is None else min(remaining, _CANCEL_POLL))
+
+            if browser is None:
+                break
+
+            # health check outside of the lock, a hung browser must not block every other checkout and checkin
+            if self._healthy(browser):
+                with self._cond:
+                    self._pages[id(browser)] += 1
+                return browser
+
+            self._retire(browser)
+
+        # launch outside of the lock so other threads can keep checking browsers in and out
+        try:
+            browser = self._launch()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._pages[id(browser)] = 1
+        return browser
+
+    def checkin(self, browser, broken: bool = False) -> None:
+        """
+        Give a browser back to the pool.
+
+        Parameters:
+        - browser (WebDriver): A browser that came from `checkout`.
+        - broken (bool): Whether the browser failed while it was checked out. Broken browsers are quit.
+        """
+        if not broken:
+            # leave the browser the way it was handed out: one tab, top level frame
+            try:
+                handles = browser.window_handles
+                for handle in handles[1:]:
+                    browser.switch_to.window(handle)
+                    browser.close()
+                browser.switch_to.window(handles[0])
+                browser.switch_to.default_content()
+            except _webdriver_exception():
+                broken = True
+
+        with self._cond:
+            if not (broken or self._closed or self._pages.get(id(browser), 0) >= self.max_pages):
+                self._idle.append(browser)
+                self._cond.notify()
+                return
+
+        self._retire(browser)
+
+    @contextmanager
+    def browser(self, timeout: float = None):
+        """
+        Check a browser out for the duration of a `with` block.
+
+        Parameters:
+        - timeout (float): Seconds to wait for a free browser. Defaults to `config.BROWSER_CHECKOUT_TIMEOUT`.
+
+        Yields:
+        - WebDriver: A browser that is checked back in when the block exits.
+        """
+        browser = self.checkout(timeout)
+        broken = False
+        try:
+            yield browser
+        except Exception:
+            # a scrape can fail on a perfectly good browser (e.g. a timeout waiting for an element),
+            # only throw the browser away if it stopped responding
+            broken = not self._healthy(browser)
+            raise
+        finally:
+            self.checkin(browser, broken=broken)
+
+    def stats(self) -> dict:
+        """Returns a dictionary with the `size` of the pool and how many of its browsers are `open` and `idle`."""
+        with self._cond:
+            return {'size': self.size, 'open': self._open, 'idle': len(self._idle)}
+
+    def close(self) -> None:
+        """Quit every idle browser. Browsers that are still checked out are quit when they are checked in."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+
+        for browser in idle:
+            self._retire(browser)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> BrowserPool:
+    """
+    Returns the process wide BrowserPool that every scraper shares, creating it on first use.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            atexit.register(_pool.close)
+
+    return _pool
@@ -0,0 +1,155 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# the share of `max_entries` evicted at once when a namespace is over its limit, so the least recently used entries
+# are looked for once every so many writes rather than on every write
+EVICT_FRACTION = 0.1
+
+
+class SQLiteCache:
+    """
+    A small persistent key/value cache stored in a SQLite file.
+
+    Values are stored as JSON, so anything made of dicts, lists, strings and numbers can be cached. Entries expire
+    `ttl` seconds after they were written and the least recently used entries are evicted once a namespace holds
+    more than `max_entries`. Several caches can share one file by using different namespaces.
+
+    Methods:
+        get(self, key)
+            Returns the cached value for a key, or None on a miss.
+
+        set(self, key, value)
+            Stores a value under a key.
+
+        stats(self)
+            Returns the hit and miss counters and the number of stored entries.
+
+        clear(self)
+            Removes every entry of the namespace.
+    """
+
+    def __init__(self, path: str, namespace: str, ttl: float = None, max_entries: int = None):
+        """
+        Initialize a SQLiteCache.
+
+        Parameters:
+        - path (str): The SQLite file to store the cache in. ':memory:' keeps the cache in memory only.
+        - namespace (str): The name that separates this cache from other caches in the same file.
+        - ttl (float): Seconds an entry stays valid. None keeps entries until they are evicted.
+        - max_entries (int): The most entries kept in the namespace. None never evicts.
+        """
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # one connection shared by every thread, guarded by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (namespace, key))''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed)')
+
+        # the number of entries in the namespace, kept up to date by this cache and recounted before evicting
+        # in case another process shares the file
+        self._size = self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM cache WHERE namespace = ?', (self.namespace,)).fetchone()[0]
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Join the parts of a key into the string the cache is indexed on."""
+        return '|'.join(str(part) for part in parts)
+
+    def get(self, key: str):
+        """
+        Look a key up in the cache.
+
+        Parameters:
+        - key (str): The key to look up.
+
+        Returns:
+        - The cached value, or None if the key is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created FROM cache WHERE namespace = ? AND key = ?',
+                (self.namespace, key)).fetchone()
+
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self._conn.execute('DELETE FROM cache WHERE namespace = ? AND key = ?', (self.namespace, key))
+                    self._size -= 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                'UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?',
+                (now, self.namespace, key))
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        """
+        Store a value in the cache. Once the namespace holds more than `max_entries`, the least recently used
+        entries are evicted down to `EVICT_FRACTION` below the limit.
+
+        Parameters:
+        - key (str): The key to store the value under.
+        - value: A JSON serializable value.
+        """
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM cache WHERE namespace = ? AND key = ?', (self.namespace, key)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (namespace, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (self.namespace, key, json.dumps(value), now, now))
+            if exists is None:
+                self._size += 1
+
+            if self.max_entries is not None and self._size > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        # recount first, another process may have written to or evicted from the same namespace
+        self._size = self._count()
+        if self._size <= self.max_entries:
+            return
+
+        # make room for a batch of writes, taking the oldest entries off the (namespace, accessed) index
+        target = max(self.max_entries - max(1, int(self.max_entries * EVICT_FRACTION)), 0)
+        self._conn.execute(
+            '''DELETE FROM cache WHERE namespace = ? AND key IN (
+                SELECT key FROM cache WHERE namespace = ? ORDER BY accessed ASC LIMIT ?)''',
+            (self.namespace, self.namespace, self._size - target))
+        self._size = target
+
+    def stats(self) -> dict:
+        """Returns a dictionary with the `hits`, `misses` and `size` of the cache."""
+        with self._lock:
+            size = self._count()
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
+
+    def clear(self) -> None:
+        """Remove every entry of this namespace."""
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+            self._size = 0
@@ -0,0 +1,153 @@
+import csv
+import os
+import pickle
+import threading
+
+import config
+from fuzzy_index import TrigramIndex
+
+
+class ModelCatalog:
+    """
+    The makes, models and model years KBB knows about (models_years_db.csv), loaded once and indexed by make.
+
+    Methods:
+        load(cls, csv_path, cache_path)
+            Loads the catalog from the CSV, or from its binary cache when that is up to date.
+
+        makes(self)
+            Returns every make in the catalog.
+
+        models(self, make)
+            Returns the models of a make.
+
+        years(self, make, model)
+            Returns the model years of a model.
+
+        match_model(self, make, candidates, year, k)
+            Returns the catalog models of a make that best match the candidate names.
+    """
+
+    def __init__(self, catalog: dict):
+        """
+        Initialize a ModelCatalog.
+
+        Parameters:
+        - catalog (dict): A dictionary mapping each make to a dictionary of its models and their model years.
+        """
+        self.catalog = catalog
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_years(years: str) -> frozenset:
+        return frozenset(int(year) for year in years.split(',') if year.strip().isdigit())
+
+    @classmethod
+    def from_csv(cls, csv_path: str) -> 'ModelCatalog':
+        """Build a catalog by parsing the CSV written by _download_kbb_models.py."""
+        catalog = {}
+        with open(csv_path, newline='') as file:
+            for row in csv.DictReader(file):
+                catalog.setdefault(row['Make'], {})[row['Model']] = cls._parse_years(row['Years'])
+
+        return cls(catalog)
+
+    @classmethod
+    def load(cls, csv_path: str = None, cache_path: str = None) -> 'ModelCatalog':
+        """
+        Load the catalog, using the binary cache next to the CSV when it was written from the current CSV.
+
+        Parameters:
+        - csv_path (str): The catalog CSV. Defaults to `config.CATALOG_PATH`.
+        - cache_path (str): The binary cache file. Defaults to `config.CATALOG_CACHE_PATH`, an empty path never caches.
+
+        Returns:
+        - ModelCatalog: The loaded catalog.
+        """
+        csv_path = csv_path or config.CATALOG_PATH
+        cache_path = config.CATALOG_CACHE_PATH if cache_path is None else cache_path
+
+        # the cache is only valid for the exact CSV it was built from
+        stat = os.stat(csv_path)
+        source = (os.path.abspath(csv_path), stat.st_size, stat.st_mtime_ns)
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as file:
+                    cached_source, catalog = pickle.load(file)
+                if cached_source == source:
+                    return cls(catalog)
+
+            except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+                pass
+
+        loaded = cls.from_csv(csv_path)
+
+        if cache_path:
+            try:
+                with open(cache_path, 'wb') as file:
+                    pickle.dump((source, loaded.catalog), file, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                pass
+
+        return loaded
+
+    def makes(self) -> list:
+        """Returns every make in the catalog."""
+        return list(self.catalog)
+
+    def models(self, make: str) -> list:
+        """Returns the models of a make in catalog order, or an empty list for an unknown make."""
+        return list(self.catalog.get(make, ()))
+
+    def years(self, make: str, model: str) -> frozenset:
+        """Returns the model years of a model, or an empty set for an unknown model."""
+        return self.catalog.get(make, {}).get(model, frozenset())
+
+    def model_index(self, make: str) -> TrigramIndex:
+        """Returns the trigram index over the models of a make, building it on first use."""
+        with self._lock:
+            if make not in self._indexes:
+                self._indexes[make] = TrigramIndex(self.models(make))
+            return self._indexes[make]
+
+    def match_model(self, make: str, candidates: list, year=None, k: int = 1) -> list:
+        """
+        Resolve a vehicle to catalog models by fuzzy matching candidate names against the models of its make.
+
+        Parameters:
+        - make (str): The make of the vehicle.
+        - candidates (list): Names the model might go by, e.g. the model vPIC decoded and the listing's trim.
+        - year (int): The model year (optional). Models that were not built that year are skipped, unless none was.
+        - k (int): The number of results. Defaults to 1.
+
+        Returns:
+        - list: Up to k (candidate, model, score) tuples, best first, like the rows `utils.get_best_pair` returns.
+        """
+        index = self.model_index(make)
+
+        allowed = None
+        try:
+            year = int(year)
+            allowed = {i for i, model in enumerate(index.names) if year in self.years(make, model)} or None
+        except (TypeError, ValueError):
+            pass
+
+        return index.best_pairs(candidates, k=k, allowed=allowed)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog() -> ModelCatalog:
+    """
+    Returns the process wide ModelCatalog, loading it on first use.
+    """
+    global _catalog
+
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog.load()
+
+    return _catalog
@@ -0,0 +1,116 @@
+import os
+
+# Settings shared by the scrapers. Every value can be overridden with the environment variable of the same name
+# prefixed with `FLIPPER_`, e.g. `FLIPPER_BROWSER_POOL_SIZE=4`.
+
+def _env(name: str, default, cast=str):
+    value = os.environ.get(f'FLIPPER_{name}')
+    if value is None:
+        return default
+    return cast(value)
+
+# user agent sent by every headless browser
+CUSTOM_USER_AGENT = _env('CUSTOM_USER_AGENT', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36')
+
+# number of headless browsers kept warm in the pool
+BROWSER_POOL_SIZE = _env('BROWSER_POOL_SIZE', 2, int)
+
+# a browser is quit and replaced after it has been checked out this many times
+BROWSER_MAX_PAGES = _env('BROWSER_MAX_PAGES', 50, int)
+
+# seconds to wait for a free browser before giving up (None waits forever)
+BROWSER_CHECKOUT_TIMEOUT = _env('BROWSER_CHECKOUT_TIMEOUT', None, float)
+
+# SQLite file that holds the KBB style and valuation cache (an empty value turns the cache off)
+KBB_CACHE_PATH = _env('KBB_CACHE_PATH', 'flipper_cache.sqlite3')
+
+# seconds a cached KBB result stays valid
+KBB_CACHE_TTL = _env('KBB_CACHE_TTL', 24 * 60 * 60, float)
+
+# the most KBB results kept in the cache before the least recently used are evicted
+KBB_CACHE_MAX_ENTRIES = _env('KBB_CACHE_MAX_ENTRIES', 50000, int)
+
+# listings whose mileage falls in the same bucket of this many miles share a cached valuation
+KBB_MILEAGE_BUCKET = _env('KBB_MILEAGE_BUCKET', 2500, int)
+
+# how get_info values a listing on KBB: 'direct' looks up the listing's own mileage, 'curve' interpolates between
+# lookups at the anchor mileages below so every listing of the same car shares the same few lookups
+KBB_VALUATION_MODE = _env('KBB_VALUATION_MODE', 'direct')
+
+# mileages the KBB price curve of a car is sampled at
+KBB_CURVE_ANCHORS = _env('KBB_CURVE_ANCHORS', (10000, 40000, 80000, 120000, 160000, 220000), lambda value: tuple(int(m) for m in value.split(',')))
+
+# base URL of the NHTSA vPIC API, point it at a local stand-in (see vpic_standin.py) to run without the network
+VPIC_URL = _env('VPIC_URL', 'https://vpic.nhtsa.dot.gov/api/vehicles')
+
+# the most VINs sent in one DecodeVINValuesBatch request (vPIC accepts up to 50)
+VPIC_BATCH_SIZE = _env('VPIC_BATCH_SIZE', 50, int)
+
+# offline VIN index built with vin_index.py, VINs are only sent to vPIC when the index cannot decode them
+VIN_INDEX_PATH = _env('VIN_INDEX_PATH', 'vin_index.sqlite3')
+
+# SQLite file that holds decoded VIN patterns (an empty value keeps the cache in memory only)
+VIN_CACHE_PATH = _env('VIN_CACHE_PATH', 'flipper_cache.sqlite3')
+
+# seconds a cached VIN decode stays valid
+VIN_CACHE_TTL = _env('VIN_CACHE_TTL', 30 * 24 * 60 * 60, float)
+
+# the most VIN patterns kept on disk and in memory before the least recently used are evicted
+VIN_CACHE_MAX_ENTRIES = _env('VIN_CACHE_MAX_ENTRIES', 100000, int)
+VIN_CACHE_MEMORY_ENTRIES = _env('VIN_CACHE_MEMORY_ENTRIES', 2048, int)
+
+# catalog of the makes, models and years KBB knows about, and the binary copy it is loaded from when up to date
+# (an empty cache path always parses the CSV)
+CATALOG_PATH = _env('CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models_years_db.csv'))
+CATALOG_CACHE_PATH = _env('CATALOG_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models_years_db.pickle'))
+
+# worker pools of the batch pipeline (see pipeline.py): how many listings may be downloading, using a browser, and
+# being parsed or matched at the same time
+PIPELINE_HTTP_WORKERS = _env('PIPELINE_HTTP_WORKERS', 8, int)
+PIPELINE_BROWSER_WORKERS = _env('PIPELINE_BROWSER_WORKERS', BROWSER_POOL_SIZE, int)
+PIPELINE_CPU_WORKERS = _env('PIPELINE_CPU_WORKERS', 2, int)
+
+# worker processes the parsing and matching stages of the pipeline run in, so they do not share the GIL with the
+# download and browser threads (0 keeps them on threads). Worker processes read the config from the environment.
+PIPELINE_PROCESSES = _env('PIPELINE_PROCESSES', 0, int)
+
+# listings that may wait between two stages of the pipeline, and in the pipeline as a whole, before the next
+# listing is held back
+PIPELINE_QUEUE_SIZE = _env('PIPELINE_QUEUE_SIZE', 8, int)
+PIPELINE_MAX_IN_FLIGHT = _env('PIPELINE_MAX_IN_FLIGHT', 32, int)
+
+# seconds a step of analyzing a listing may take before the listing is given up on: plain HTTP steps, and browser
+# steps including the wait for a free browser (an empty value waits forever)
+HTTP_STEP_TIMEOUT = _env('HTTP_STEP_TIMEOUT', 60, lambda value: float(value) if value else None)
+BROWSER_STEP_TIMEOUT = _env('BROWSER_STEP_TIMEOUT', 300, lambda value: float(value) if value else None)
+
+# seconds the whole analysis of one listing may take, counted from when it enters the pipeline (None for no limit)
+LISTING_DEADLINE = _env('LISTING_DEADLINE', None, float)
+
+# time every stage with tracing.py (FLIPPER_TRACE=1), and where search.py writes the per-stage percentiles and the
+# Chrome trace (chrome://tracing or Perfetto) of a traced run
+TRACE = _env('TRACE', False, lambda value: value.lower() in ('1', 'true', 'yes'))
+TRACE_MAX_EVENTS = _env('TRACE_MAX_EVENTS', 200000, int)
+TRACE_STATS_PATH = _env('TRACE_STATS_PATH', 'trace_stats.json')
+TRACE_EVENTS_PATH = _env('TRACE_EVENTS_PATH', 'trace_events.json')
+
+# durations of each span name kept for its percentiles, a long running service samples them beyond that
+TRACE_MAX_SAMPLES = _env('TRACE_MAX_SAMPLES', 10000, int)
+
+# how the scrapers reach eBay, KBB and vPIC (see transport.py): 'live' goes to the sites, 'record' also saves every
+# response and browser page to the store, 'replay' serves them from the store without the network
+TRANSPORT_MODE = _env('TRANSPORT_MODE', 'live')
+TRANSPORT_STORE = _env('TRANSPORT_STORE', 'transport_store')
+
+# base URL of a running replay server (`python transport.py`) to share between processes, one is started for the
+# store when it is not set
+TRANSPORT_REPLAY_URL = _env('TRANSPORT_REPLAY_URL', None)
+
+# the flipper service (service.py): the address it listens on, how many listings it analyzes at once, how many may
+# wait for a turn before new ones are turned away, and whether browsers are launched at startup rather than on the
+# first listing
+SERVICE_HOST = _env('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = _env('SERVICE_PORT', 8765, int)
+SERVICE_MAX_CONCURRENCY = _env('SERVICE_MAX_CONCURRENCY', 4, int)
+SERVICE_MAX_QUEUE = _env('SERVICE_MAX_QUEUE', 64, int)
+SERVICE_WARM_BROWSERS = _env('SERVICE_WARM_BROWSERS', False, lambda value: value.lower() in ('1', 'true', 'yes'))
@@ -0,0 +1,266 @@
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from thread_class import Cancelled, StageTimeout, TaskGroup
+from tracing import span
+
+# one step of a task graph: `func` is called with the values of `inputs` as keyword arguments once they are all
+# ready. Each of the `lazy` inputs is passed as a function that waits for that value instead, so the step can start
+# before it is ready and only waits for it if it turns out to need it. A step that runs longer than its `timeout`
+# in seconds fails the run with a StageTimeout.
+Node = namedtuple('Node', ['name', 'func', 'inputs', 'lazy', 'timeout'], defaults=((), None))
+
+
+class TaskGraph():
+    """
+    A set of steps with declared inputs, run concurrently with every step starting as soon as its inputs are ready.
+
+    Inputs that are not the name of a step are values given to `run`, like the URL of a listing.
+
+    Methods:
+        run(self, values, targets=None)
+            Runs the steps needed for the targets and returns a GraphRun.
+
+        stage(self, *names)
+            Returns a function that runs the given steps on a dictionary of values, for a `pipeline.Stage`.
+    """
+
+    def __init__(self, nodes: list):
+        """
+        Initialize a TaskGraph.
+
+        Parameters:
+        - nodes (list): The Node objects of the graph.
+
+        Raises:
+        - ValueError: If two nodes share a name or the nodes depend on each other in a cycle.
+        """
+        self.nodes = {}
+        for node in nodes:
+            if node.name in self.nodes:
+                raise ValueError(f'Duplicate node {node.name!r}')
+            self.nodes[node.name] = node
+
+        self.order = self._topological_order()
+
+    def _dependencies(self, name: str) -> tuple:
+        node = self.nodes[name]
+        return tuple(node.inputs) + tuple(node.lazy)
+
+    def _topological_order(self) -> list:
+        order, visiting, visited = [], set(), set()
+
+        def visit(name, path):
+            if name in visited or name not in self.nodes: return
+            if name in visiting:
+                raise ValueError(f"Cycle in task graph: {' -> '.join(path + [name])}")
+            visiting.add(name)
+            for dependency in self._dependencies(name):
+                visit(dependency, path + [name])
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.nodes:
+            visit(name, [])
+        return order
+
+    def _needed(self, targets, values: dict) -> list:
+        # the steps the targets depend on that do not have a value yet, in an order where inputs come first
+        needed = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in needed or name in values: continue
+            if name not in self.nodes:
+                raise ValueError(f'Missing input {name!r}')
+            needed.add(name)
+            stack.extend(self._dependencies(name))
+
+        return [name for name in self.order if name in needed]
+
+    def run(self, values: dict, targets=None, max_workers: int = None, deadline: float = None) -> 'GraphRun':
+        """
+        Run the steps of the graph.
+
+        Parameters:
+        - values (dict): The values the graph starts from. Steps that already have a value are not run again.
+        - targets (iterable): The names of the steps to compute along with everything they depend on (optional).
+          Every step is run by default.
+        - max_workers (int): How many steps may run at once (optional). Defaults to one thread per step, so a step
+          waiting on a lazy input never holds up the step it waits for.
+        - deadline (float): The `time.monotonic()` time the whole run has to be done by (optional, see
+          `thread_class.deadline_in`).
+
+        Returns:
+        - GraphRun: The values of every step and when each one ran.
+
+        Raises:
+        - Exception: The first exception a step raised, as soon as it is raised. No new steps are started and the
+          running ones are cancelled (see `thread_class.TaskGroup`).
+        - StageTimeout: If a step ran longer than its timeout.
+        - DeadlineExceeded: If the deadline passed.
+        """
+        values = dict(values)
+        order = self._needed(self.nodes if targets is None else targets, values)
+        run = GraphRun(self, values, targets if targets is not None else order)
+
+        if not order:
+            run.end = time.perf_counter()
+            return run
+
+        # lazy inputs are waited on through these, they are settled as soon as their step is
+        settled = {name: Future() for name in order}
+
+        pending = list(order)
+        running = {}
+        expires = {}
+        # the group is cancelled here as soon as a step fails, see below
+        group = TaskGroup(deadline=deadline, max_workers=max_workers or len(order), fail_fast=False)
+
+        try:
+            while pending or running:
+                # start everything whose inputs are all ready
+                for name in list(pending):
+                    node = self.nodes[name]
+                    if any(key not in values for key in node.inputs):
+                        continue
+
+                    kwargs = {key: values[key] for key in node.inputs}
+                    for key in node.lazy:
+                        kwargs[key] = run._waiter(name, key, settled)
+
+                    pending.remove(name)
+                    future = group.submit(run._call, node, kwargs)
+                    running[future] = name
+                    if node.timeout is not None:
+                        expires[future] = time.monotonic() + node.timeout
+
+                # wait for the next step to finish, or for the first running step to run out of time
+                timeout = None
+                if expires:
+                    timeout = max(min(expires.values()) - time.monotonic(), 0)
+
+                finished = group.wait_any(running, timeout)
+                if not finished:
+                    future = min(expires, key=expires.get)
+                    name = running[future]
+                    error = StageTimeout(f'{name} took longer than {self.nodes[name].timeout}s')
+                    group.cancel(error)
+                    raise error
+
+                for future in finished:
+                    name = running.pop(future)
+                    expires.pop(future, None)
+                    try:
+                        values[name] = future.result()
+                    except Exception as exc:
+                        # fail right away, the other steps of the run are of no use anymore
+                        group.cancel(exc)
+                        raise
+                    settled[name].set_result(values[name])
+
+        finally:
+            run.end = time.perf_counter()
+
+            # release steps still waiting on a lazy input that will never come
+            for future in settled.values():
+                if not future.done():
+                    future.set_exception(group.error or Cancelled('cancelled'))
+            group.close(wait=False)
+
+        return run
+
+    def stage(self, *names, deadline_key: str = None):
+        """
+        Returns a function that runs the given steps, and whatever they need that is missing, on a dictionary of
+        values and adds their results to it. Used to run a graph a few steps at a time, e.g. as `pipeline.Stage`s.
+
+        Parameters:
+        - *names (str): The steps to run.
+        - deadline_key (str): The name of the value that holds the deadline of the run, if there is one (optional).
+        """
+        def run_stage(values: dict) -> dict:
+            deadline = values.get(deadline_key) if deadline_key else None
+            values.update(self.run(values, targets=names, deadline=deadline).values)
+            return values
+
+        run_stage.__name__ = '_'.join(names)
+        return run_stage
+
+
+class GraphRun():
+    """
+    The result of running a TaskGraph: the value of every step, when each one started and finished, and which
+    chain of steps the run had to wait on.
+    """
+
+    def __init__(self, graph: TaskGraph, values: dict, targets):
+        self.graph = graph
+        self.values = values
+        self.targets = tuple(targets)
+        self.timings = {}
+        self.waited = {}
+        self.start = time.perf_counter()
+        self.end = None
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def _call(self, node: Node, kwargs: dict):
+        started = time.perf_counter()
+        try:
+            with span(f'step.{node.name}'):
+                return node.func(**kwargs)
+        finally:
+            self.timings[node.name] = (started, time.perf_counter())
+
+    def _waiter(self, name: str, key: str, settled: dict):
+        # a value that was given to the run is ready right away
+        if key not in settled:
+            value = self.values[key]
+            return lambda: value
+
+        def wait_for():
+            self.waited.setdefault(name, set()).add(key)
+            return settled[key].result()
+
+        return wait_for
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from the start of the run until its last step finished."""
+        return (self.end or time.perf_counter()) - self.start
+
+    def critical_path(self) -> list:
+        """
+        Returns the chain of steps that decided how long the run took, as `(name, seconds)` pairs from the first
+        step to the last. Each step on it is the input that finished last before the next one could start.
+        """
+        if not self.timings:
+            return []
+
+        # walk back from the step that finished last
+        name = max(self.timings, key=lambda name: self.timings[name][1])
+        path = []
+        while name is not None:
+            started, ended = self.timings[name]
+            path.append((name, ended - started))
+
+            inputs = list(self.graph.nodes[name].inputs) + sorted(self.waited.get(name, ()))
+            inputs = [key for key in inputs if key in self.timings]
+            name = max(inputs, key=lambda key: self.timings[key][1]) if inputs else None
+
+        return path[::-1]
+
+    def report(self) -> str:
+        """
+        Returns a short text report of the run: the critical path with the time of each step, and how long each
+        step took and when it started.
+        """
+        lines = [f'total {self.elapsed:.3f}s']
+        lines.append('critical path: ' + ' -> '.join(f'{name} ({seconds:.3f}s)' for name, seconds in self.critical_path()))
+        for name, (started, ended) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            lines.append(f'  {name:<12} start {started - self.start:7.3f}s  took {ended - started:7.3f}s')
+        return '\n'.join(lines)
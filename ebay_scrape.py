@@ -1,112 +1,207 @@
 import json
 import re
+import threading
 import time
 from datetime import datetime
+from urllib.parse import urljoin
 
-import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
-
+from browser_pool import get_pool
 from ebay_scrubber import Scrubber
-from thread_class import ReturnValueThread
+from tracing import span, traced
 from utils import (DescriptionError, clean_strings, dollar_to_int, remove_items_between_strings, search_a_in_b)
 
 
-def get_item_specs(url):
+class ListingDocument:
     """
-    Get item specifications from a given URL.
+    A single eBay listing page that is downloaded once and parsed on demand.
 
-    Parameters:
-    url (str): A string representing the URL of the webpage containing the item specifications.
+    The specs, price and description of a listing all come from the same page, so
+    instead of requesting the listing once per field, a ListingDocument fetches the
+    HTML the first time any field is asked for and serves every later lookup from
+    that one parsed document. Parsed values are kept so repeated calls are free.
 
-    Returns:
-    dict: A dictionary containing the cleaned and scrubbed specifications of the item, such as the condition, VIN, options, and power options.
+    Methods:
+        fetch(self)
+            Downloads the HTML of the listing without parsing it.
 
-    Note:
-    This function uses the requests library to send an HTTP request to the given URL, and then uses the BeautifulSoup library to parse the HTML content of the response. It then extracts the relevant specifications from the HTML using certain HTML tags and classes.
+        item_specs(self)
+            Returns the cleaned and scrubbed specifications of the listing.
+
+        listing_price(self)
+            Returns the listing price in dollars.
 
-    This function also makes use of the Scrubber class to clean and scrub the extracted specifications before returning them in a dictionary format.
+        description(self)
+            Returns the seller's description of the vehicle.
+
+    A ListingDocument can be pickled, e.g. to be parsed in a worker process. It travels with its HTML and the
+    values parsed so far, but without the parsed document, which is rebuilt from the HTML if it is needed again.
     """
 
-    # Sends an HTTP request to the URL and obtains the response
-    with requests.get(url) as page:
+    def __init__(self, url: str, html: str = None):
+        """
+        Initialize a ListingDocument for the given listing URL.
+
+        Parameters:
+        - url (str): The URL of the eBay listing.
+        - html (str): The already downloaded HTML of the listing (optional). When it is not given the page is
+          fetched the first time it is needed.
+        """
+        self.url = url
+        self.html = html
+        self._soup = None
+        self._parsed = {}
+
+        # several threads may ask for fields of the same listing at once, only one of them should fetch it
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock cannot be pickled and the soup is far bigger than the HTML it is rebuilt from
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_soup'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def fetch(self) -> str:
+        """Downloads the HTML of the listing if it has not been yet, without parsing it."""
+        with self._lock:
+            if self.html is None:
+                from transport import get_transport
+
+                # Sends the one HTTP request for this listing and keeps the response text
+                with span('ebay.fetch'), get_transport().get(self.url) as page:
+                    self.html = page.text
+
+        return self.html
+
+    @property
+    def soup(self):
+        """The parsed HTML of the listing (a BeautifulSoup), fetched on first access."""
+        # bs4 is imported when a listing is first parsed, so importing this module stays cheap
+        from bs4 import BeautifulSoup
+
+        html = self.fetch()
+        with self._lock:
+            if self._soup is None:
+                with span('ebay.parse_html'):
+                    self._soup = BeautifulSoup(html, 'html.parser')
+
+        return self._soup
+
+    def _get(self, field: str, parser):
+        # parse a field once and hand back the stored value afterwards
+        if field not in self._parsed:
+            self._parsed[field] = parser()
+        return self._parsed[field]
+
+    def item_specs(self) -> dict:
+        """Returns the cleaned and scrubbed specifications of the listing (see `get_item_specs`)."""
+        return self._get('specs', lambda: parse_item_specs(self.soup))
+
+    def listing_price(self) -> int:
+        """Returns the listing price in dollars (see `get_listing_price`)."""
+        return self._get('price', lambda: parse_listing_price(self.soup))
+
+    def frame_url(self) -> str:
+        """Returns the URL of the description frame of the listing (see `description_frame_url`)."""
+        return self._get('frame_url', lambda: description_frame_url(self.soup, self.url))
+
+    def description_frame(self) -> str:
+        """Returns the HTML of the description frame fetched without a browser (see `fetch_description_frame`)."""
+        return self._get('description_frame', lambda: fetch_description_frame(self))
+
+    def description_html(self) -> str:
+        """Returns the HTML of the description frame of the listing (see `fetch_description_html`)."""
+        return self._get('description_html', lambda: fetch_description_html(self))
+
+    def description(self) -> str:
+        """Returns the seller's description of the vehicle (see `get_description`)."""
+        return self._get('description', lambda: _load_description(self))
+
+
+@traced('ebay.parse_item_specs')
+def parse_item_specs(soup) -> dict:
+    """
+    Parse the item specifications out of an eBay listing page.
 
-        # Parses the HTML content of the response using BeautifulSoup
-        soup = BeautifulSoup(page.text, 'html.parser')
+    Parameters:
+    soup (BeautifulSoup): The parsed HTML of the listing.
+
+    Returns:
+    dict: A dictionary containing the cleaned and scrubbed specifications of the item, such as the condition, VIN, options, and power options.
+    """
 
-        # Extracts the HTML content for the item's specifications
-        stats = soup.find_all(class_='vim x-about-this-item')[0]
+    # Extracts the HTML content for the item's specifications
+    stats = soup.find_all(class_='vim x-about-this-item')[0]
 
-        # Creates an empty list to store the extracted data
-        data = []
+    # Creates an empty list to store the extracted data
+    data = []
 
-        # Iterates through each span tag with the 'ux-textspans' class in the HTML content of the item's specifications
-        for stat in stats.find_all('span', 'ux-textspans'):
-            # Appends the text content of the span tag to the data list
-            data.append(stat.text)
-        
-        # Removes duplicate 'Used' strings
-        caught_values = []
-        for i, string in enumerate(data):
-            if 'Used' in string:
-                if 'Used' in caught_values: del data[i]
-                else: caught_values.append('Used')
-
-        # Extracts the range of data between the 'Year' or 'Seller Notes' and 'Used' keys
-        prev_string = data[0]
-        range_start = data[0]
-        range_end = data[-1]
-        data = data[1:]
-
-        for i, string in enumerate(data):
-            if 'used' in string: range_start = data[i+1]
-            if 'Seller Notes' in string: range_end = prev_string
-            elif 'Year' in string: range_end = prev_string
-
-            prev_string = string
-
-        data = remove_items_between_strings(data, range_start, range_end)
-        
-        # Removes the final unwanted strings from the data
-        new_data = []
-        search_list = ['definitionsopens']
-        for string in data:
-            catches = 0
-            for search in search_list:
-                if search in string: 
-                    catches += 1
-
-            if catches == 0: new_data.append(string)
-
-        data = new_data
-
-        # Initializes an empty dictionary to store the extracted and cleaned specifications
-        parsed_stats = {}
-
-        # Iterates through the data list and extracts the key-value pairs for the specifications
-        for i in range(1, len(data)):
-            value = data[i-1]
-            # Extracts the key as the string before the last character in the previous element of the data list
-            if value[-1] == ':': key = value[:-1]
-            else: key = value
-
-            # Extracts the value as the cleaned string from the current element of the data list
-            value = clean_strings(data[i])
-
-            # Checks if the current element is a value and its index in the data list is odd
-            if (i+1) % 2 == 0.0 and value != '':
-                # Adds the key-value pair to the parsed_stats dictionary
-                parsed_stats[key] = value
-        
-        # Initializes a Scrubber object to clean and scrub the parsed specifications
-        s = Scrubber()
-        # Cleans and scrubs the parsed specifications using the Scrubber object and stores the cleaned specifications and cleaning log
-        cleaned_stats, cleaning_log = s.scrub(parsed_stats)
+    # Iterates through each span tag with the 'ux-textspans' class in the HTML content of the item's specifications
+    for stat in stats.find_all('span', 'ux-textspans'):
+        # Appends the text content of the span tag to the data list
+        data.append(stat.text)
+    
+    # Removes duplicate 'Used' strings
+    caught_values = []
+    for i, string in enumerate(data):
+        if 'Used' in string:
+            if 'Used' in caught_values: del data[i]
+            else: caught_values.append('Used')
+
+    # Extracts the range of data between the 'Year' or 'Seller Notes' and 'Used' keys
+    prev_string = data[0]
+    range_start = data[0]
+    range_end = data[-1]
+    data = data[1:]
+
+    for i, string in enumerate(data):
+        if 'used' in string: range_start = data[i+1]
+        if 'Seller Notes' in string: range_end = prev_string
+        elif 'Year' in string: range_end = prev_string
+
+        prev_string = string
+
+    data = remove_items_between_strings(data, range_start, range_end)
+    
+    # Removes the final unwanted strings from the data
+    new_data = []
+    search_list = ['definitionsopens']
+    for string in data:
+        catches = 0
+        for search in search_list:
+            if search in string: 
+                catches += 1
+
+        if catches == 0: new_data.append(string)
+
+    data = new_data
+
+    # Initializes an empty dictionary to store the extracted and cleaned specifications
+    parsed_stats = {}
+
+    # Iterates through the data list and extracts the key-value pairs for the specifications
+    for i in range(1, len(data)):
+        value = data[i-1]
+        # Extracts the key as the string before the last character in the previous element of the data list
+        if value[-1] == ':': key = value[:-1]
+        else: key = value
+
+        # Extracts the value as the cleaned string from the current element of the data list
+        value = clean_strings(data[i])
+
+        # Checks if the current element is a value and its index in the data list is odd
+        if (i+1) % 2 == 0.0 and value != '':
+            # Adds the key-value pair to the parsed_stats dictionary
+            parsed_stats[key] = value
+    
+    # Initializes a Scrubber object to clean and scrub the parsed specifications
+    s = Scrubber()
+    # Cleans and scrubs the parsed specifications using the Scrubber object and stores the cleaned specifications and cleaning log
+    cleaned_stats, cleaning_log = s.scrub(parsed_stats)
 
     # make sure that there is a body type option=
     if 'Body Type' not in cleaned_stats:
@@ -116,64 +211,42 @@ def get_item_specs(url):
     return cleaned_stats
 
 
-def get_listing_price(url):
+@traced('ebay.parse_listing_price')
+def parse_listing_price(soup) -> int:
     """
-    Get the listing price of an item from a given URL.
+    Parse the listing price out of an eBay listing page.
 
     Parameters:
-    url (str): A string representing the URL of the webpage containing the listing price.
+    soup (BeautifulSoup): The parsed HTML of the listing.
 
     Returns:
     int: An integer representing the listing price in dollars, converted from the string format.
-
-    Note:
-    This function uses the requests library to send an HTTP request to the given URL, and then uses the BeautifulSoup library to parse the HTML content of the response. It then extracts the relevant listing price from the HTML using the find method with the attrs parameter to search for the HTML tag with the specified attributes.
-
-    This function also makes use of the dollar_to_int function to convert the extracted listing price from a string format to an integer representing the number of dollars.
     """
-    
-    # Sends an HTTP request to the URL and obtains the response
-    with requests.get(url) as page:
-
-        # Parses the HTML content of the response using BeautifulSoup
-        soup = BeautifulSoup(page.text, 'html.parser')
 
-        # Extract the HTML tag containing the item price using the 'soup.find()' method, and pass in the 'attrs' parameter
-        # to search for the HTML tag with the 'itemprop' attribute set to 'price'.
-        price = soup.find('span', attrs={'itemprop':'price'})
+    # Extract the HTML tag containing the item price using the 'soup.find()' method, and pass in the 'attrs' parameter
+    # to search for the HTML tag with the 'itemprop' attribute set to 'price'.
+    price = soup.find('span', attrs={'itemprop':'price'})
 
-        # Extract the text content of the price tag, and split it by whitespace to obtain the price value in a string format.
-        price = price.text.split(' ')[-1]
+    # Extract the text content of the price tag, and split it by whitespace to obtain the price value in a string format.
+    price = price.text.split(' ')[-1]
 
     # Return the extracted price value as an integer by passing it to the 'dollar_to_int()' function.
     return dollar_to_int(price)
 
 
-# get description
-def get_description(url):
-    
-    def _agent(url):
-        custom_user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36'
-        
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless=new')
-        options.add_argument(f'user-agent={custom_user_agent}')
-        browser = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-
-        browser.get(url)  # navigate to URL
-        browser.switch_to.frame('desc_ifr')
-        html = browser.page_source
-
-        browser.quit()
-        return html
+def parse_description(soup) -> str:
+    """
+    Parse the seller's description out of the HTML of an eBay description frame.
 
-    # using threads to save time waiting for browser to quit
-    load_thread = ReturnValueThread(target=_agent, args=(url,))
-    load_thread.start()
-    html = load_thread.join()
+    Parameters:
+    soup (BeautifulSoup): The parsed HTML of the description frame.
 
-    soup = BeautifulSoup(html, 'html.parser')
+    Returns:
+    str: The description with its whitespace collapsed.
 
+    Raises:
+    DescriptionError: If neither of the known description containers is on the page.
+    """
     try:
         desc = soup.find('div', id='vehicleDescription')
         desc_parsed = re.sub('\s+',' ',desc.text).strip()
@@ -190,6 +263,153 @@ def get_description(url):
         
     return desc_parsed
 
+
+def description_frame_url(soup, url: str = None) -> str:
+    """
+    Find the URL of the description frame of an eBay listing.
+
+    Parameters:
+    soup (BeautifulSoup): The parsed HTML of the listing.
+    url (str): The URL of the listing, used to build the frame URL from the item number when the page has no frame (optional).
+
+    Returns:
+    str: The URL of the description frame, or None if it could not be found.
+    """
+
+    # the description is served from its own page which the listing embeds as the 'desc_ifr' frame
+    frame = soup.find('iframe', id='desc_ifr')
+    if frame is not None and frame.get('src'):
+        return urljoin(url or '', frame['src'])
+
+    # fall back on the item number in the listing URL
+    if url is not None:
+        item_id = re.search(r'/itm/(?:[^/?]+/)?(\d+)', url)
+        if item_id is not None:
+            return f'https://vi.vipr.ebaydesc.com/ws/eBayISAPI.dll?ViewItemDescV4&item={item_id.group(1)}'
+
+    return None
+
+
+# the ids of the elements `parse_description` reads the description from
+_DESCRIPTION_CONTAINERS = ('vehicleDescription', 'ds_div')
+
+@traced('ebay.fetch_description')
+def fetch_description_frame(listing: ListingDocument) -> str:
+    """
+    Download the HTML of the description frame of an eBay listing with a plain HTTP request, without parsing it.
+
+    Parameters:
+    listing (ListingDocument): The listing.
+
+    Returns:
+    str: The HTML of the frame, or None when it could not be fetched or has none of the known description containers.
+
+    Raises:
+    transport.ReplayMiss: In replay mode, if the frame was never recorded.
+    """
+    import requests
+    from transport import ReplayMiss, get_transport
+
+    frame_url = listing.frame_url()
+    if frame_url is None:
+        return None
+
+    try:
+        with get_transport().get(frame_url) as page:
+            page.raise_for_status()
+            html = page.text
+    except ReplayMiss:
+        # a replay that misses the frame should fail here, not fall back on a browser that cannot replay it either
+        raise
+    except requests.RequestException:
+        return None
+
+    # a cheap check for the containers, so the frame is parsed only once, by whoever parses it
+    return html if any(container in html for container in _DESCRIPTION_CONTAINERS) else None
+
+@traced('ebay.render_description')
+def render_description_html(listing: ListingDocument) -> str:
+    """
+    Render an eBay listing in a pooled browser and return the HTML of its description frame.
+
+    Parameters:
+    listing (ListingDocument): The listing.
+
+    Returns:
+    str: The HTML of the frame.
+    """
+    from transport import get_transport
+
+    transport = get_transport()
+    frame_page = f'{listing.url}#desc_ifr'
+    with get_pool().browser() as browser:
+        if transport.mode == 'replay':
+            # the frame was recorded on its own, there is no listing around it to switch into
+            browser.get(transport.browser_url(frame_page))
+        else:
+            browser.get(listing.url)  # navigate to URL
+            browser.switch_to.frame('desc_ifr')
+            transport.save_page(browser, frame_page)
+        return browser.page_source
+
+def fetch_description_html(listing: ListingDocument) -> str:
+    """
+    Download the HTML of the description frame of an eBay listing, without parsing it.
+
+    Parameters:
+    listing (ListingDocument): The listing.
+
+    Returns:
+    str: The HTML of the frame. It is fetched with a plain HTTP request (see `fetch_description_frame`), and the
+    listing is only rendered in a browser when that fails (see `render_description_html`).
+    """
+    return listing.description_frame() or render_description_html(listing)
+
+
+@traced('ebay.description')
+def _load_description(listing: ListingDocument) -> str:
+    from bs4 import BeautifulSoup
+    return parse_description(BeautifulSoup(listing.description_html(), 'html.parser'))
+
+
+def get_item_specs(url):
+    """
+    Get item specifications from a given URL.
+
+    Parameters:
+    url (str): A string representing the URL of the webpage containing the item specifications.
+
+    Returns:
+    dict: A dictionary containing the cleaned and scrubbed specifications of the item, such as the condition, VIN, options, and power options.
+
+    Note:
+    This function fetches the listing into a ListingDocument. When more than one field of the same listing is
+    needed, create a ListingDocument directly so the page is only downloaded once.
+    """
+    return ListingDocument(url).item_specs()
+
+
+def get_listing_price(url):
+    """
+    Get the listing price of an item from a given URL.
+
+    Parameters:
+    url (str): A string representing the URL of the webpage containing the listing price.
+
+    Returns:
+    int: An integer representing the listing price in dollars, converted from the string format.
+
+    Note:
+    This function fetches the listing into a ListingDocument. When more than one field of the same listing is
+    needed, create a ListingDocument directly so the page is only downloaded once.
+    """
+    return ListingDocument(url).listing_price()
+
+
+# get description
+def get_description(url):
+    return ListingDocument(url).description()
+
 if __name__ == '__main__':
     urls = [
         'https://www.ebay.com/itm/225513444321?hash=item3481a613e1%3Ag%3A9g4AAOSwmgJkLb6m&mkevt=1&mkcid=1&mkrid=711-53200-19255-0&campid=5337650957&customid=&toolid=10049',
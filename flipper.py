@@ -0,0 +1,157 @@
+# The flipper command line:
+#
+#     python flipper.py analyze URL             analyze one eBay listing and print its briefing
+#     python flipper.py batch URL... [-f FILE]  analyze many listings, one JSON line each as they finish
+#     python flipper.py valuate MAKE MODEL STYLE YEAR MILEAGE [--price PRICE]
+#                                               get the KBB ranges of a car, and the profit metrics at a price
+#     python flipper.py decode-vin VIN...       decode VINs
+#     python flipper.py serve                   run the HTTP/JSON service (see service.py)
+#
+# Every command imports what it needs when it runs, and the scrapers load pandas, NumPy, selenium and requests only
+# once a step needs them, so a decode from the VIN cache or a cached valuation starts in milliseconds.
+import argparse
+import json
+import sys
+
+import config
+
+
+def _print_json(value) -> None:
+    print(json.dumps(value, indent=4, default=str))
+
+def _read_urls(urls: list, path: str) -> list:
+    # URLs from the command line followed by those in the file, one per line ('-' reads them from stdin)
+    urls = list(urls)
+    if path:
+        file = sys.stdin if path == '-' else open(path)
+        with file:
+            urls.extend(line.strip() for line in file if line.strip() and not line.startswith('#'))
+    return urls
+
+
+def cmd_analyze(args) -> int:
+    from get_info import analyze_listing
+
+    record = analyze_listing(args.url, verbose=args.verbose, render=not args.no_render)
+    if args.json:
+        from service import record_to_json
+        _print_json({'url': args.url, **record_to_json(record)})
+    else:
+        print(record['briefing'])
+    return 0
+
+def cmd_batch(args) -> int:
+    from get_info import analyze_many
+    from service import error_to_json, record_to_json
+
+    urls = _read_urls(args.urls, args.file)
+    if not urls:
+        print('no listing URLs given', file=sys.stderr)
+        return 2
+
+    # one JSON line per listing as soon as it is done, a failed listing is reported and the batch carries on
+    failed = 0
+    for result in analyze_many(urls, render=not args.no_render, ordered=args.ordered, processes=args.processes):
+        if result.ok:
+            line = {'url': result.item, 'ok': True, **record_to_json(result.value)}
+        else:
+            failed += 1
+            line = {'url': result.item, 'ok': False, **error_to_json(result.error, result.stage)}
+        print(json.dumps(line, default=str), flush=True)
+
+    if failed:
+        print(f'{failed} of {len(urls)} listings failed', file=sys.stderr)
+    return 1 if failed else 0
+
+def cmd_valuate(args) -> int:
+    from kbb_scrape import get_valuations
+    from utils import serialize
+
+    trade_in_ranges, private_party_ranges = get_valuations(
+        serialize(args.make),
+        serialize(args.model),
+        serialize(args.style),
+        serialize(str(args.year)),
+        serialize(str(args.mileage)),
+        trade_in_condition=serialize(args.trade_in_condition, replace_with=''),
+        private_party_condition=args.private_party_condition,
+        mode=args.mode)
+
+    result = {'trade_in': trade_in_ranges, 'private_party': private_party_ranges}
+
+    # with a price, the same profit metrics a listing's briefing is made from
+    if args.price is not None:
+        from valuation import ListingValuation
+
+        valuation = ListingValuation.from_ranges(str(args.year), args.make, args.style, args.model, args.mileage, args.price, None, private_party_ranges, trade_in_ranges)
+        result['valuation'] = valuation.to_dict()
+        result['deal_tier'] = valuation.deal_tier
+
+    _print_json(result)
+    return 0
+
+def cmd_decode_vin(args) -> int:
+    from vin_decoder import vin_lookup
+
+    results = [vin_lookup(VIN, args.year) for VIN in args.vins]
+    _print_json(results[0] if len(results) == 1 else results)
+    return 0
+
+def cmd_serve(args) -> int:
+    from service import serve
+
+    serve(args.host, args.port, args.warm_browsers)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='flipper', description='Research used car listings for flipping.')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    analyze = commands.add_parser('analyze', help='analyze one eBay listing')
+    analyze.add_argument('url', help='URL of the eBay listing')
+    analyze.add_argument('-v', '--verbose', action='count', default=0)
+    analyze.add_argument('--json', action='store_true', help='print the valuation, description and briefing as JSON')
+    analyze.add_argument('--no-render', action='store_true', help='skip rendering the briefing')
+    analyze.set_defaults(func=cmd_analyze)
+
+    batch = commands.add_parser('batch', help='analyze many eBay listings, printing a JSON line for each')
+    batch.add_argument('urls', nargs='*', help='URLs of the eBay listings')
+    batch.add_argument('-f', '--file', help="file with one URL per line ('-' for stdin)")
+    batch.add_argument('--ordered', action='store_true', help='print the listings in the order they were given')
+    batch.add_argument('--processes', type=int, default=None, help='worker processes for parsing and matching (default: FLIPPER_PIPELINE_PROCESSES)')
+    batch.add_argument('--no-render', action='store_true', help='skip rendering the briefings')
+    batch.set_defaults(func=cmd_batch)
+
+    valuate = commands.add_parser('valuate', help='get the KBB trade-in and private party ranges of a car')
+    valuate.add_argument('make')
+    valuate.add_argument('model')
+    valuate.add_argument('style')
+    valuate.add_argument('year', type=int)
+    valuate.add_argument('mileage', type=int)
+    valuate.add_argument('--price', type=int, help='listing price to compute the profit metrics at')
+    valuate.add_argument('--trade-in-condition', default='fair')
+    valuate.add_argument('--private-party-condition', default='good')
+    valuate.add_argument('--mode', choices=('direct', 'curve'), help='default: FLIPPER_KBB_VALUATION_MODE')
+    valuate.set_defaults(func=cmd_valuate)
+
+    decode_vin = commands.add_parser('decode-vin', help='decode VINs from the offline index, the cache or vPIC')
+    decode_vin.add_argument('vins', nargs='+', metavar='VIN')
+    decode_vin.add_argument('--year', default='', help='model year of the cars')
+    decode_vin.set_defaults(func=cmd_decode_vin)
+
+    serve = commands.add_parser('serve', help='run the HTTP/JSON service')
+    serve.add_argument('--host', default=config.SERVICE_HOST)
+    serve.add_argument('--port', type=int, default=config.SERVICE_PORT)
+    serve.add_argument('--warm-browsers', action='store_true', default=None, help='launch every browser of the pool at startup')
+    serve.set_defaults(func=cmd_serve)
+
+    return parser
+
+def main(argv: list = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+from utils import calc_simalarity
+
+
+def trigrams(text: str) -> set:
+    """
+    Returns the set of character trigrams of a string, lowercased and padded so short names like 'A4' still
+    have trigrams of their own.
+    """
+    padded = f'  {text.lower()} '
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    A trigram index over a fixed list of names for fast fuzzy lookups.
+
+    Instead of scoring a query against every name, the index only looks at names that share trigrams with it,
+    keeps the best `shortlist` of those by trigram overlap (20 by default, at least k) and ranks that shortlist
+    with the same SequenceMatcher ratio `calc_simalarity` uses. This approximates an all-pairs search: a name that
+    shares few trigrams with the query but has a high ratio can fall off the shortlist and be missed. A query that
+    shares no trigram with any allowed name is scored against all of them.
+
+    Methods:
+        search(self, query, k, allowed)
+            Returns the k names closest to a query with their scores.
+
+        best_pairs(self, queries, k, allowed)
+            Returns the k best (query, name, score) triples over several queries.
+    """
+
+    def __init__(self, names: list, shortlist: int = 20):
+        """
+        Initialize a TrigramIndex.
+
+        Parameters:
+        - names (list): The names to index.
+        - shortlist (int): How many names with the most shared trigrams are scored exactly per query. Defaults to 20.
+        """
+        self.names = list(names)
+        self.shortlist = shortlist
+        self._sizes = []
+        self._postings = defaultdict(list)
+
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+
+    def search(self, query: str, k: int = 5, allowed: set = None) -> list:
+        """
+        Find the names closest to a query.
+
+        Parameters:
+        - query (str): The string to look up.
+        - k (int): The number of results. Defaults to 5.
+        - allowed (set): Indexes into `names` that may be returned (optional). All names are allowed by default.
+
+        Returns:
+        - list: Up to k (name, score) tuples, best first. Equal scores keep the order of `names`.
+        """
+        grams = trigrams(query)
+
+        # count shared trigrams through the postings lists
+        overlap = defaultdict(int)
+        for gram in grams:
+            for i in self._postings.get(gram, ()):
+                overlap[i] += 1
+
+        if allowed is not None:
+            overlap = {i: count for i, count in overlap.items() if i in allowed}
+
+        # nothing in common: fall back on scoring every allowed name
+        if overlap:
+            dice = {i: 2 * count / (len(grams) + self._sizes[i]) for i, count in overlap.items()}
+            shortlist = sorted(dice, key=lambda i: (-dice[i], i))[:max(self.shortlist, k)]
+        else:
+            shortlist = range(len(self.names)) if allowed is None else sorted(allowed)
+
+        scored = sorted(((calc_simalarity(query, self.names[i]), i) for i in shortlist), key=lambda pair: (-pair[0], pair[1]))
+        return [(self.names[i], score) for score, i in scored[:k]]
+
+    def best_pairs(self, queries: list, k: int = 1, allowed: set = None) -> list:
+        """
+        Find the best matches over several queries, e.g. the model vPIC decoded and the listing's trim.
+
+        Parameters:
+        - queries (list): The strings to look up. Empty queries are skipped.
+        - k (int): The number of results. Defaults to 1.
+        - allowed (set): Indexes into `names` that may be returned (optional).
+
+        Returns:
+        - list: Up to k (query, name, score) tuples, best first. Equal scores keep the order of `queries`, then of `names`.
+        """
+        results = []
+        for q, query in enumerate(queries):
+            if not query: continue
+            for rank, (name, score) in enumerate(self.search(query, k, allowed)):
+                results.append((score, q, rank, query, name))
+
+        results.sort(key=lambda result: (-result[0], result[1], result[2]))
+        return [(query, name, score) for score, _, _, query, name in results[:k]]
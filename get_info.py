@@ -1,14 +1,18 @@
 import sys
-
-import pandas as pd
-
-from ebay_scrape import get_description, get_item_specs, get_listing_price
-from get_info_helpers import generate_styled_breifing, generate_str_breifing, style_from_description, style_from_specs
-from kbb_scrape import get_ranges, get_styles
-from utils import get_best_pair, serialize, thousands
-from vin_decoder import vin_decode
-from thread_class import ReturnValueThread
-from datetime import datetime
+from functools import partial
+
+import config
+from catalog import get_catalog
+from dag import Node, TaskGraph
+from ebay_scrape import ListingDocument
+from get_info_helpers import render_styled_breifing, style_from_description, style_from_specs
+from kbb_scrape import get_styles, get_valuations
+from pipeline import Stage, run_pipeline
+from utils import serialize, thousands
+from valuation import ListingValuation
+from thread_class import deadline_in
+from tracing import traced
+from vin_decoder import vin_lookup
 
 
 def pick_style(available_styles: list, specs: dict, desc: str) -> str:
@@ -18,7 +22,8 @@ def pick_style(available_styles: list, specs: dict, desc: str) -> str:
     Args:
     - available_styles (list): List of available style names
     - specs (dict): Dictionary containing style specifications
-    - desc (str): Description of the desired style
+    - desc (str): Description of the desired style, or a function that returns it. The function is only called
+      when the specifications cannot settle the style.
 
     Returns:
     - str: The best style name that matches the specifications or description.
@@ -30,9 +35,9 @@ def pick_style(available_styles: list, specs: dict, desc: str) -> str:
     # If that fails, match based on description
     else:
         try: return style_from_specs(available_styles, specs)
-        except: return style_from_description(available_styles, desc)
+        except: return style_from_description(available_styles, desc() if callable(desc) else desc)
 
-def analyze_car(url: str, verbose=0) -> None:
+def analyze_car(url: str, verbose=0) -> str:
     """
     Analyzes a car listing on eBay by decoding the VIN number, determining the make and model, and getting price ranges
     from Kelley Blue Book. Outputs a briefing with relevant information.
@@ -42,111 +47,177 @@ def analyze_car(url: str, verbose=0) -> None:
     - verbose (int): The level of verboseness. 0 is the default (no stout)
 
     Returns:
-    - None
+    - str: The styled briefing of the listing
     """
+    return analyze_listing(url, verbose=verbose)['briefing']
 
-    # get info from ebay listing
-    start = datetime.now()
-    if verbose > 0: print('Getting info from ebay...')
+@traced('analyze_listing')
+def analyze_listing(url: str, verbose=0, render: bool = True) -> dict:
+    """
+    Analyzes a car listing like `analyze_car`, but returns everything the briefing was made from along with it.
 
-    descr_thread = ReturnValueThread(target=get_description, args=(url,)) 
-    specs_thread = ReturnValueThread(target=get_item_specs, args=(url,))
-    price_thread = ReturnValueThread(target=get_listing_price, args=(url,)) 
-    descr_thread.start()
-    specs_thread.start()
-    price_thread.start()
-    
-    specs = specs_thread.join()
+    Args:
+    - url (str): The URL of the eBay listing to analyze
+    - verbose (int): The level of verboseness. 0 is the default (no stout)
+    - render (bool): Whether to render the briefing. Ranked batches leave it to `ranking.render_winners`. Defaults to True.
 
-    # vin lookup
-    print(f'vin lookup at {datetime.now() - start}')
-    if verbose > 0: print('Decoding VIN number...')
-    vin_decode_thread = ReturnValueThread(target=vin_decode, args=(specs['VIN'], specs['Year']))
-    vin_decode_thread.start()
+    Returns:
+    - dict: A dictionary with the listing's `valuation` (a ListingValuation), its `description` and the styled `briefing`
+      (None when `render` is False)
 
-    # load in dataset of makes and models
-    available_models = pd.read_csv('models_years_db.csv')
+    Raises:
+    - Exception: The error of the first step that failed. The other steps are cancelled right away.
+    - thread_class.StageTimeout: If a download or browser step ran past its timeout (see `config.*_STEP_TIMEOUT`).
+    - thread_class.DeadlineExceeded: If the listing took longer than `config.LISTING_DEADLINE`.
+    """
+    if verbose > 0: print('Getting info from ebay...')
 
-    # get data from threads
-    print(f'get data from threads at {datetime.now() - start}')
-    listing_price = price_thread.join()
-    vin_decoded = vin_decode_thread.join()
+    # every step starts as soon as what it needs is ready (see LISTING_GRAPH)
+    state = new_listing_state(url, verbose=verbose, render=render)
+    run = LISTING_GRAPH.run(state, targets=('record',), deadline=state['deadline'])
 
-    # Vehicle Variables
-    make = vin_decoded['Make'].title()
-    year = specs['Year']
-    condition = 'fair'
-    mileage = specs['Mileage']
+    if verbose > 0: print(run.report())
+    return run['record']
 
-    # get model
-    print(f'get model at {datetime.now() - start}')
+def analyze_many(urls, verbose=0, render: bool = True, ordered: bool = True, **kwargs):
+    """
+    Analyzes many car listings at once with a `pipeline.BatchPipeline`, so one listing can be downloading while
+    another is on KBB and a third is being matched.
 
-    if verbose > 0: print('Analyzing listing for model ...')
-    available_models = available_models.loc[available_models['Make'] == make]
-    available_models = available_models['Model'].to_list()
+    Args:
+    - urls (iterable): The URLs of the eBay listings to analyze
+    - verbose (int): The level of verboseness. 0 is the default (no stout)
+    - render (bool): Whether to render the briefings. Defaults to True.
+    - ordered (bool): Yield the listings in the order of `urls`. Otherwise each one is yielded as soon as it is done.
+      Defaults to True.
+    - **kwargs: The `limits`, `queue_size`, `max_in_flight` and `processes` options of BatchPipeline. With
+      `processes` (or `config.PIPELINE_PROCESSES`) the parsing and matching stages run in worker processes.
+
+    Returns:
+    - generator: A `pipeline.PipelineResult` per listing. The `value` of a listing that went through is the
+      dictionary `analyze_listing` returns, the `error` of one that did not is the exception that stopped it.
+    """
+    states = (new_listing_state(url, verbose=verbose, render=render) for url in urls)
+    for result in run_pipeline(LISTING_STAGES, states, ordered=ordered, initializer=warm_worker, **kwargs):
+        # hand back the URL the caller gave rather than the state it was wrapped in, and the record the last stage made
+        result.item = result.item['url']
+        if result.ok:
+            result.value = result.value['record']
+        yield result
+
+def new_listing_state(url: str, verbose=0, render: bool = True) -> dict:
+    """
+    Returns the values LISTING_GRAPH starts from for a listing. The listing has `config.LISTING_DEADLINE` seconds
+    from now to be analyzed.
+    """
+    return {'url': url, 'verbose': verbose, 'render': render, 'deadline': deadline_in(config.LISTING_DEADLINE)}
 
-    model = get_best_pair([vin_decoded['Model'], specs['Trim']], available_models)
-    model = model.values[0][1]
+def run_listing_steps(names: tuple, state: dict) -> dict:
+    """
+    Runs the given steps of LISTING_GRAPH on the state of a listing and returns it with their results. A module
+    level function rather than a `TaskGraph.stage`, so a stage made from it can be sent to a worker process.
+    """
+    return LISTING_GRAPH.stage(*names, deadline_key='deadline')(state)
 
-    # Get KBB styles
-    print(f'get styles at {datetime.now() - start}')
-    if verbose > 0: print('Analyzing listing for style ...')
-    body = vin_decoded['BodyClass']
-    available_styles = get_styles(
-        serialize(make), 
-        serialize(model), 
-        serialize(year),
-        serialize(body))
-    
-    print(f'pick styles at {datetime.now() - start}')
-    desc = descr_thread.join() # load in data from descr_thread
+def warm_worker() -> None:
+    """
+    Loads the model catalog in a worker process of the pipeline as it starts. Style matchers are kept by every
+    process for the styles it has seen (see `style_matcher.get_style_matcher`).
+    """
+    get_catalog()
 
-    style = pick_style(available_styles, specs, desc)
+def _fetch_listing(url: str) -> ListingDocument:
+    # download the listing once, every field is parsed from that copy
+    listing = ListingDocument(url)
+    listing.fetch()
+    return listing
 
-    if verbose > 1:  print(f'\n[INFO] Vehicle Information:\nMake: {make}, model: {model}, style: {style}, year: {year}, mileage: {thousands(mileage)}, listing price: ${thousands(listing_price)}\n')
+def _vin_lookup(specs: dict, verbose: int) -> dict:
+    if verbose > 0: print('Decoding VIN number...')
+    return vin_lookup(specs['VIN'], specs['Year'])
 
-    if verbose > 0: print('Getting Trade-In ranges from KBB...')
+def _match_model(make: str, vin: dict, specs: dict, verbose: int) -> str:
+    if verbose > 0: print('Analyzing listing for model ...')
+    return get_catalog().match_model(make, [vin['Model'], specs['Trim']], year=specs['Year'])[0][1]
 
-    print(f'get ranges at {datetime.now() - start}')
-    trade_in_ranges = get_ranges(
+def _get_styles(make: str, model: str, specs: dict, vin: dict, verbose: int) -> list:
+    # Get KBB styles
+    if verbose > 0: print('Analyzing listing for style ...')
+    return get_styles(
         serialize(make), 
         serialize(model), 
-        serialize(style), 
-        serialize(year), 
-        serialize(condition, replace_with=''), 
-        serialize(mileage),
-        trade_in=True)
+        serialize(specs['Year']),
+        serialize(vin['BodyClass']))
 
-    if verbose > 0: print('Getting private party ranges from KBB...')
+def _get_valuations(make: str, model: str, style: str, specs: dict, price: int, verbose: int) -> tuple:
+    if verbose > 1:  print(f"\n[INFO] Vehicle Information:\nMake: {make}, model: {model}, style: {style}, year: {specs['Year']}, mileage: {thousands(specs['Mileage'])}, listing price: ${thousands(price)}\n")
+    if verbose > 0: print('Getting trade-in and private party ranges from KBB...')
 
-    private_party_ranges = get_ranges(
+    # both price types are fetched together in one browser (see config.KBB_VALUATION_MODE for the curve mode)
+    condition = 'fair'
+    return get_valuations(
         serialize(make), 
         serialize(model), 
         serialize(style), 
-        serialize(year), 
-        'good', 
-        serialize(mileage),
-        trade_in=False)
+        serialize(specs['Year']), 
+        serialize(specs['Mileage']),
+        trade_in_condition=serialize(condition, replace_with=''),
+        private_party_condition='good')
 
-    mileage = int(mileage)
+def _valuation(url: str, specs: dict, price: int, make: str, model: str, style: str, valuations: tuple) -> ListingValuation:
+    # parse the ranges and compute every profit metric once
+    trade_in_ranges, private_party_ranges = valuations
+    return ListingValuation.from_ranges(specs['Year'], make, style, model, int(specs['Mileage']), price, url, private_party_ranges, trade_in_ranges)
 
+def _briefing(valuation: ListingValuation, description: str, render: bool, verbose: int) -> str:
     # Generate Breifing
     if verbose > 0: print('\n\n##### Breifing #####')
-
-    breifing_styled = generate_styled_breifing(
-        year,
-        make,
-        style,
-        model,
-        mileage,
-        desc,
-        listing_price,
-        url,
-        private_party_ranges,
-        trade_in_ranges
-    )
-
-    return breifing_styled
+    return render_styled_breifing(valuation, description) if render else None
+
+# the steps of analyzing a listing and what each one needs. The style is picked as soon as the KBB styles are in
+# and only waits for the description when the specs cannot settle it.
+LISTING_GRAPH = TaskGraph([
+    Node('listing', _fetch_listing, ('url',), timeout=config.HTTP_STEP_TIMEOUT),
+    Node('specs', lambda listing: listing.item_specs(), ('listing',)),
+    Node('price', lambda listing: listing.listing_price(), ('listing',)),
+    Node('frame_url', lambda listing: listing.frame_url(), ('listing',)),
+    Node('description_frame', lambda listing, frame_url: listing.description_frame(), ('listing', 'frame_url'), timeout=config.HTTP_STEP_TIMEOUT),
+    # the description falls back on a browser when the frame cannot be fetched directly
+    Node('description_html', lambda listing, description_frame: listing.description_html(), ('listing', 'description_frame'), timeout=config.BROWSER_STEP_TIMEOUT),
+    Node('description', lambda listing, description_html: listing.description(), ('listing', 'description_html')),
+    Node('vin', _vin_lookup, ('specs', 'verbose'), timeout=config.HTTP_STEP_TIMEOUT),
+    Node('make', lambda vin: vin['Make'].title(), ('vin',)),
+    Node('model', _match_model, ('make', 'vin', 'specs', 'verbose')),
+    Node('styles', _get_styles, ('make', 'model', 'specs', 'vin', 'verbose'), timeout=config.BROWSER_STEP_TIMEOUT),
+    Node('style', lambda styles, specs, description: pick_style(styles, specs, description), ('styles', 'specs'), lazy=('description',)),
+    Node('valuations', _get_valuations, ('make', 'model', 'style', 'specs', 'price', 'verbose'), timeout=config.BROWSER_STEP_TIMEOUT),
+    Node('valuation', _valuation, ('url', 'specs', 'price', 'make', 'model', 'style', 'valuations')),
+    Node('briefing', _briefing, ('valuation', 'description', 'render', 'verbose')),
+    Node('record', lambda valuation, description, briefing: {
+        'valuation': valuation,
+        'description': description,
+        'briefing': briefing,
+    }, ('valuation', 'description', 'briefing')),
+])
+
+# the same steps grouped for `analyze_many`, with the worker pool each group runs in. Downloads and vPIC go over
+# plain HTTP, KBB needs a browser, and the rest is parsing and matching, which may run in worker processes. The
+# deadline of a listing carries over from one group to the next.
+def _steps(*names):
+    return partial(run_listing_steps, names)
+
+LISTING_STAGES = (
+    Stage('fetch', 'http', _steps('listing')),
+    Stage('parse', 'cpu', _steps('specs', 'price', 'frame_url')),
+    Stage('lookup', 'http', _steps('description_frame', 'vin')),
+    # a listing only opens a browser here when its description frame could not be fetched
+    Stage('description', 'browser', _steps('description_html')),
+    Stage('model', 'cpu', _steps('description', 'make', 'model')),
+    Stage('styles', 'browser', _steps('styles')),
+    Stage('pick style', 'cpu', _steps('style')),
+    Stage('valuations', 'browser', _steps('valuations')),
+    Stage('briefing', 'cpu', _steps('valuation', 'briefing', 'record')),
+)
     
 if __name__ == '__main__':
     LISTING_URL = 'https://www.ebay.com/itm/385540746588?hash=item59c404ed5c%3Ag%3APtQAAOSwzgBkNWTH&mkevt=1&mkcid=1&mkrid=711-53200-19255-0&campid=5337650957&customid=&toolid=10049'
@@ -1,10 +1,9 @@
-from difflib import SequenceMatcher, get_close_matches
+from difflib import get_close_matches
 from typing import List
 
-import numpy as np
-
 from page import Page, StyledPage
-from utils import dollar_to_int, thousands
+from utils import thousands
+from valuation import ListingValuation
 
 
 def mileage_level(mileage:int) -> str:
@@ -35,41 +34,23 @@ def style_from_description(available_styles: List[str], description: str, verbos
     Returns:
     - str: A string representing the closest style option from the available_styles list based on the description.
     """
-    try:
-        if verbose > 1: print("[INFO] Extrapolating style from description")
-
-        # Remove all non-alphanumeric and non-whitespace characters from description
-        description = ''.join([ c if (c.isalnum() or c.isspace()) else '' for c in description ])
-        words = description.split(' ')
-
-        # Calculate the average length of a style option
-        average_len_of_style = int(np.floor(np.mean([len(style.split(' ')) for style in available_styles])))
-
-        # Generate pairs of words from the description
-        pairs = []
-        for i in range(len(words)-average_len_of_style):
-            pair = ' '.join(words[i:i+average_len_of_style])
-            pairs.append(pair)
-
-        # Score each pair of words against each style option
-        scored_pairs = {}
-        for style in available_styles:
-            pair_scores = []
-            for pair in pairs:
-                pair_scores.append(SequenceMatcher(None, style, pair).ratio())
-            
-            scored_pairs[style] = np.max(pair_scores)
-
-        # Return the style option with the highest score
-        return max(scored_pairs, key=scored_pairs.get)
-
-    except:
-        # If no matching style option is found, return the middle option
+    if verbose > 1: print("[INFO] Extrapolating style from description")
+
+    # score every window of the description against every style in one pass (see StyleMatcher), NumPy is only
+    # loaded once a style has to be matched
+    from style_matcher import get_style_matcher
+    style = get_style_matcher(tuple(available_styles)).match(description)
+
+    if style is None:
+        # If the description gives nothing to match on, return the middle option
         if verbose > 1: print("[INFO] Couldn't extrapolate style level from listing. Picking middle option (median expense)")
         
         size = len(available_styles)
         middle_index = size//2
         return available_styles[middle_index]
+
+    # Return the style option with the highest score
+    return style
     
     
 def style_from_specs(available_styles: List[str], listing_specs: dict) -> str:
@@ -94,6 +75,12 @@ def style_from_specs(available_styles: List[str], listing_specs: dict) -> str:
     # Return the closest matching style
     return matches[0]
 
+def dollars(value: float) -> str:
+    """
+    Format a dollar amount the way KBB shows it, e.g. $12,345.
+    """
+    return f'${thousands(value)}'
+
 def generate_str_breifing(year:int, make:str, style:str, model:str, mileage:int, desc:str, listing_price:int, private_party_ranges:dict, trade_in_ranges:dict) -> str:
     """
     Generates a briefing for a car listing with information about the car, pricing, and potential profits.
@@ -112,42 +99,48 @@ def generate_str_breifing(year:int, make:str, style:str, model:str, mileage:int,
     Returns:
     - str: A string containing the generated briefing.
     """
+    valuation = ListingValuation.from_ranges(year, make, style, model, mileage, listing_price, None, private_party_ranges, trade_in_ranges)
+    return render_str_breifing(valuation, desc)
 
-    # Calculate important factors
-    best_delta = dollar_to_int(private_party_ranges['high']) - dollar_to_int(trade_in_ranges['low'])
-    worst_delta = dollar_to_int(private_party_ranges['low']) - dollar_to_int(trade_in_ranges['high'])
-    avg_delta = dollar_to_int(private_party_ranges['value']) - dollar_to_int(trade_in_ranges['value'])
+def render_str_breifing(valuation: ListingValuation, desc: str) -> str:
+    """
+    Renders the plain text briefing of a valuation (see `generate_str_breifing`).
 
-    listing_best_delta = dollar_to_int(private_party_ranges['high']) - listing_price
-    listing_worst_delta = dollar_to_int(private_party_ranges['low']) - listing_price
-    listing_avg_delta = dollar_to_int(private_party_ranges['value']) - listing_price
+    Args:
+    - valuation (ListingValuation): The listing and its precomputed profit metrics.
+    - desc (str): The listing description.
+
+    Returns:
+    - str: A string containing the generated briefing.
+    """
+    v = valuation
 
     # Generate Briefing
     breifing = Page()
 
     # Car information
-    breifing.press(f'\nThis car is a {year} {make} {style} {model} with {mileage_level(mileage)} ({thousands(mileage)}). It\'s listed at ${thousands(listing_price)}.')
+    breifing.press(f'\nThis car is a {v.year} {v.make} {v.style} {v.model} with {mileage_level(v.mileage)} ({thousands(v.mileage)}). It\'s listed at ${thousands(v.listing_price)}.')
 
     # Listing description
     breifing.press('\nListing Description:')
     breifing.press(f'\n{desc}\n')
 
     # Pricing information
-    breifing.press(f"Trade in prices range from {trade_in_ranges['low']} to {trade_in_ranges['high']}")
-    breifing.press(f"Private party prices range from {private_party_ranges['low']} to {private_party_ranges['high']}")
-    breifing.press(f"The potential profit ranges from ${thousands(worst_delta)} to ${thousands(best_delta)} and averages around ${thousands(avg_delta)}")
-    breifing.press(f"The profit at listing price ranges from ${thousands(listing_worst_delta)} to ${thousands(listing_best_delta)} and averages around ${thousands(listing_avg_delta)}")
+    breifing.press(f"Trade in prices range from {dollars(v.trade_in_low)} to {dollars(v.trade_in_high)}")
+    breifing.press(f"Private party prices range from {dollars(v.private_party_low)} to {dollars(v.private_party_high)}")
+    breifing.press(f"The potential profit ranges from ${thousands(v.worst_delta)} to ${thousands(v.best_delta)} and averages around ${thousands(v.avg_delta)}")
+    breifing.press(f"The profit at listing price ranges from ${thousands(v.listing_worst_delta)} to ${thousands(v.listing_best_delta)} and averages around ${thousands(v.listing_avg_delta)}")
 
     # Additional car details
     breifing.press('\nDetails:')
-    breifing.press(f'{year}')
-    breifing.press(f'{make}')
-    breifing.press(f'{style}')
-    breifing.press(f'{model}')
-    breifing.press(thousands(mileage))
-    breifing.press(f'listed at ${listing_price}')
-    breifing.press(f'potential avg profit ${avg_delta}')
-    breifing.press(f'potential listing profit ${listing_avg_delta}')
+    breifing.press(f'{v.year}')
+    breifing.press(f'{v.make}')
+    breifing.press(f'{v.style}')
+    breifing.press(f'{v.model}')
+    breifing.press(thousands(v.mileage))
+    breifing.press(f'listed at ${v.listing_price}')
+    breifing.press(f'potential avg profit ${v.avg_delta}')
+    breifing.press(f'potential listing profit ${v.listing_avg_delta}')
 
 
     return breifing.body
@@ -170,63 +163,68 @@ def generate_styled_breifing(year:int, make:str, style:str, model:str, mileage:i
     Returns:
     - str: A string containing the styled briefing.
     """
+    valuation = ListingValuation.from_ranges(year, make, style, model, mileage, listing_price, listing_url, private_party_ranges, trade_in_ranges)
+    return render_styled_breifing(valuation, desc)
+
+def render_styled_breifing(valuation: ListingValuation, desc: str) -> str:
+    """
+    Renders the styled (markdown) briefing of a valuation (see `generate_styled_breifing`).
 
-    # Calculate important factors
-    best_delta = dollar_to_int(private_party_ranges['high']) - dollar_to_int(trade_in_ranges['low'])
-    worst_delta = dollar_to_int(private_party_ranges['low']) - dollar_to_int(trade_in_ranges['high'])
-    avg_delta = dollar_to_int(private_party_ranges['value']) - dollar_to_int(trade_in_ranges['value'])
-    range = (dollar_to_int(trade_in_ranges['high']) - dollar_to_int(trade_in_ranges['low']))/2
+    Args:
+    - valuation (ListingValuation): The listing and its precomputed profit metrics.
+    - desc (str): The listing description.
 
-    listing_best_delta = dollar_to_int(private_party_ranges['high']) - listing_price
-    listing_worst_delta = dollar_to_int(private_party_ranges['low']) - listing_price
-    listing_avg_delta = dollar_to_int(private_party_ranges['value']) - listing_price
+    Returns:
+    - str: A string containing the styled briefing.
+    """
+    v = valuation
 
     # Generate Briefing
     breifing = StyledPage()
 
-    breifing.h2(f'{year} {make} {style} {model}')
-    breifing.h3(f'Breifing about this {make}')
-    breifing.add_link(url=listing_url, title='Listing')
+    breifing.h2(f'{v.year} {v.make} {v.style} {v.model}')
+    breifing.h3(f'Breifing about this {v.make}')
+    breifing.add_link(url=v.url, title='Listing')
     breifing.divider()
 
     breifing.h3('Basic Information')
 
-    if listing_worst_delta <= -300:
+    if v.deal_tier == 'priced low':
         string = [
-            f"This car is a {year} {make} {style} {model} with {mileage_level(mileage)}",
-            f"({thousands(mileage)}). It\'s listed at ${thousands(listing_price)}.",
-            f"Too get a good deal you need pay at or less than {trade_in_ranges['value']} (+/- ${range}).",
+            f"This car is a {v.year} {v.make} {v.style} {v.model} with {mileage_level(v.mileage)}",
+            f"({thousands(v.mileage)}). It\'s listed at ${thousands(v.listing_price)}.",
+            f"Too get a good deal you need pay at or less than {dollars(v.trade_in_value)} (+/- ${v.trade_in_spread}).",
             f"It's currently listed pretty low. Find out why they priced it so low."
         ]
         breifing.add_paragraph(' '.join(string))
     
-    elif listing_worst_delta <= 100:
+    elif v.deal_tier == 'good price':
         string = [
-            f"This car is a {year} {make} {style} {model} with {mileage_level(mileage)}",
-            f"({thousands(mileage)}). It\'s listed at ${thousands(listing_price)}.",
-            f"Too get a good deal you need pay at or less than {trade_in_ranges['value']} (+/- ${range}).",
+            f"This car is a {v.year} {v.make} {v.style} {v.model} with {mileage_level(v.mileage)}",
+            f"({thousands(v.mileage)}). It\'s listed at ${thousands(v.listing_price)}.",
+            f"Too get a good deal you need pay at or less than {dollars(v.trade_in_value)} (+/- ${v.trade_in_spread}).",
             f"It's currently listed at a good price so you don't have much negotiating to do."
         ]
         breifing.add_paragraph(' '.join(string))
 
-    elif listing_worst_delta <= 2000:
+    elif v.deal_tier == 'negotiate':
         string = [
-            f"This car is a {year} {make} {style} {model} with {mileage_level(mileage)}",
-            f"({thousands(mileage)}). It\'s listed at ${thousands(listing_price)}.",
-            f"Too get a good deal you need to pay around {trade_in_ranges['value']} (+/- ${range})."
+            f"This car is a {v.year} {v.make} {v.style} {v.model} with {mileage_level(v.mileage)}",
+            f"({thousands(v.mileage)}). It\'s listed at ${thousands(v.listing_price)}.",
+            f"Too get a good deal you need to pay around {dollars(v.trade_in_value)} (+/- ${v.trade_in_spread})."
             f"For this car to make sense as a flip, you have to negotiate the price down about",
-            f"${thousands(listing_price - dollar_to_int(trade_in_ranges['low']))}."
+            f"${thousands(v.negotiation_amount)}."
         ]
         breifing.add_paragraph(' '.join(string))
 
     else:
         string = [
-            f"This car is a {year} {make} {style} {model} with {mileage_level(mileage)}",
-            f"({thousands(mileage)}). It\'s listed at ${thousands(listing_price)}.",
-            f"Too get a good deal you need to pay around {trade_in_ranges['value']} (+/- ${range})."
+            f"This car is a {v.year} {v.make} {v.style} {v.model} with {mileage_level(v.mileage)}",
+            f"({thousands(v.mileage)}). It\'s listed at ${thousands(v.listing_price)}.",
+            f"Too get a good deal you need to pay around {dollars(v.trade_in_value)} (+/- ${v.trade_in_spread})."
             f"This car is listed so high you have a long way to go. For this car to make sense as a",
             f"flip, you have to negotiate the price down about",
-            f"${thousands(listing_price - dollar_to_int(trade_in_ranges['low']))}."
+            f"${thousands(v.negotiation_amount)}."
         ]
         breifing.add_paragraph(' '.join(string))
     
@@ -236,23 +234,23 @@ def generate_styled_breifing(year:int, make:str, style:str, model:str, mileage:i
     breifing.h3('Pricing Information')
 
     pricing_string = [
-        f"Trade in prices range from {trade_in_ranges['low']} to {trade_in_ranges['high']}.",
-        f"Private party prices range from {private_party_ranges['low']} to {private_party_ranges['high']}.",
+        f"Trade in prices range from {dollars(v.trade_in_low)} to {dollars(v.trade_in_high)}.",
+        f"Private party prices range from {dollars(v.private_party_low)} to {dollars(v.private_party_high)}.",
         f"The potential profit after successful negotiating ranges from",
-        f"${thousands(worst_delta)} to ${thousands(best_delta)} and averages around ${thousands(avg_delta)}.",
-        f"The profit at listing price ranges from ${thousands(listing_worst_delta)} to ${thousands(listing_best_delta)}",
-        f"and averages around ${thousands(listing_avg_delta)}."
+        f"${thousands(v.worst_delta)} to ${thousands(v.best_delta)} and averages around ${thousands(v.avg_delta)}.",
+        f"The profit at listing price ranges from ${thousands(v.listing_worst_delta)} to ${thousands(v.listing_best_delta)}",
+        f"and averages around ${thousands(v.listing_avg_delta)}."
     ]
     breifing.add_paragraph(' '.join(pricing_string))
 
     # Additional car details
     dets = [
-        f'{year} {make} {style} {model}',
-        thousands(mileage), 
-        f'listed at ${listing_price}', 
-        f'potential avg profit ${avg_delta}', 
-        f'potential listing profit ${listing_avg_delta}',
-        f"needed negotiation ammount ${thousands(listing_price - dollar_to_int(trade_in_ranges['low']))}"]
+        f'{v.year} {v.make} {v.style} {v.model}',
+        thousands(v.mileage), 
+        f'listed at ${v.listing_price}', 
+        f'potential avg profit ${v.avg_delta}', 
+        f'potential listing profit ${v.listing_avg_delta}',
+        f"needed negotiation ammount ${thousands(v.negotiation_amount)}"]
         
     breifing.add_unordered_list(dets)
 
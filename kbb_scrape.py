@@ -1,19 +1,36 @@
+import threading
 import time
 from typing import List
 
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from webdriver_manager.chrome import ChromeDriverManager
+import config
+from browser_pool import get_pool
+from cache import SQLiteCache
+from thread_class import Cancelled, TaskGroup
+from tracing import traced
+from utils import StyleException, calc_simalarity, dollar_to_int, search_a_in_b, serialize, thousands
 
-from utils import StyleException, calc_simalarity, dollar_to_int, search_a_in_b, serialize
-from thread_class import ReturnValueThread
+_cache = None
+_cache_lock = threading.Lock()
 
-custom_user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36'
-        
+def get_kbb_cache() -> SQLiteCache:
+    """
+    Returns the cache that sits in front of `get_styles` and `get_ranges`, or None if caching is turned off.
+    """
+    global _cache
+
+    with _cache_lock:
+        if _cache is None and config.KBB_CACHE_PATH:
+            _cache = SQLiteCache(config.KBB_CACHE_PATH, 'kbb', ttl=config.KBB_CACHE_TTL, max_entries=config.KBB_CACHE_MAX_ENTRIES)
+
+    return _cache
+
+def mileage_bucket(mileage) -> int:
+    """
+    Returns the bucket a mileage falls in. Listings in the same bucket share a cached valuation.
+    """
+    return int(mileage) // config.KBB_MILEAGE_BUCKET
+
+@traced('kbb.get_styles')
 def get_styles(make: str, model: str, year: int, body_type: str = None, verbose=0) -> List[str]:
     """
     Get a list of styles for a given vehicle make, model, and year from kbb.com.
@@ -28,53 +45,65 @@ def get_styles(make: str, model: str, year: int, body_type: str = None, verbose=
     - List[str]: a list of styles for the given vehicle parameters
     """
     
-    # set Chrome driver options
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless=new')
-    options.add_argument(f'user-agent={custom_user_agent}')
-    
-    # initialize Chrome webdriver
-    browser = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-
-    # navigate to kbb.com styles page for the given vehicle parameters
-    browser.get(f'https://www.kbb.com/{make}/{model}/{year}/styles/?intent=buy-used')
-    
-    if verbose > 2: print(f'https://www.kbb.com/{make}/{model}/{year}/styles/?intent=buy-used')
-
-    styles = []
-    try:
-        # wait for the styles to load and extract them
-        styles_obj = WebDriverWait(browser, 5).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, 'toggle')))
-        for style in styles_obj:
-            style_str = style.text
-            split = style_str.split('\n')
-            styles.append(split[0])
-    
-    except:
-        # if styles do not load, try to find the closest matching category and extract its styles
-        cattegories = WebDriverWait(browser, 5).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, 'css-v9y0wd')))
-        catt_scores = {}
-
-        # calculate similarity scores between body_type and the available categories
-        for catt in cattegories:
-            catt_scores[catt.text] = [calc_simalarity(body_type, catt.text), catt]
+    # styles only change with new model years, serve them from the cache when we have them
+    cache = get_kbb_cache()
+    if cache is not None:
+        key = cache.make_key('styles', make, model, year, body_type)
+        styles = cache.get(key)
+        if styles is not None:
+            return styles
+
+    # selenium and requests are only loaded on a cache miss, cached lookups never touch a browser
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    from transport import ReplayMiss, get_transport
+
+    # check a warm browser out of the shared pool
+    transport = get_transport()
+    styles_url = f'https://www.kbb.com/{make}/{model}/{year}/styles/?intent=buy-used'
+    with get_pool().browser() as browser:
+
+        # navigate to kbb.com styles page for the given vehicle parameters
+        browser.get(transport.browser_url(styles_url))
+        
+        if verbose > 2: print(styles_url)
+
+        styles = []
+        try:
+            # wait for the styles to load and extract them
+            styles_obj = WebDriverWait(browser, 5).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, 'toggle')))
+            for style in styles_obj:
+                style_str = style.text
+                split = style_str.split('\n')
+                styles.append(split[0])
+
+            transport.save_page(browser, styles_url)
+        
+        except:
+            # the category fallback clicks through to a redirect on the live site, which is not recorded and cannot
+            # be replayed, so a replay fails here instead of reaching out to kbb.com
+            if transport.mode == 'replay':
+                raise ReplayMiss(f'the styles at {styles_url} were not recorded')
 
-        # select the category with the highest similarity score and click on it
-        cattegory = max(catt_scores, key=lambda dict: dict[0])
-        catt_scores[cattegory][1].click()
+            # if styles do not load, try to find the closest matching category and extract its styles
+            cattegories = WebDriverWait(browser, 5).until(EC.visibility_of_all_elements_located((By.CLASS_NAME, 'css-v9y0wd')))
+            catt_scores = {}
 
-        # get the URL for the selected category and navigate to it
-        new_url = browser.current_url
-        browser.quit()
-        del browser
+            # calculate similarity scores between body_type and the available categories
+            for catt in cattegories:
+                catt_scores[catt.text] = [calc_simalarity(body_type, catt.text), catt]
 
-        browser = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+            # select the category with the highest similarity score and click on it
+            cattegory = max(catt_scores, key=lambda dict: dict[0])
+            catt_scores[cattegory][1].click()
 
-        browser.get(new_url)
-        final_url = browser.current_url
-        browser.quit()
+            # get the URL for the selected category and load it again in the same browser to follow its redirect
+            new_url = browser.current_url
+            browser.get(new_url)
+            final_url = browser.current_url
 
-        styles.append(final_url.split('/')[6])
+            styles.append(final_url.split('/')[6])
 
     # check if styles list contains any invalid values and raise an exception if it does
     break_list = ['Price New/Used', 'Search by Price', 'Cars For Sale']
@@ -82,9 +111,39 @@ def get_styles(make: str, model: str, year: int, body_type: str = None, verbose=
         if verbose > 2: print(styles)
         raise StyleException('function was not supplied with real values.`make` `model` or `year` are invalid vehicle parameters')
     else:
+        if cache is not None: cache.set(key, styles)
         return styles
 
 
+def _trade_in_parser(str):
+    parsed_data = {}
+    split = str.split(' ')
+    parsed_data['low']= split[2]
+    parsed_data['high'] = split[4]
+    parsed_data['value'] = split[-1]
+    return parsed_data
+
+def _private_party_parser(str):
+    parsed_data = {}
+    split = str.split(' ')
+    parsed_data['low']= split[3]
+    parsed_data['high'] = split[5]
+    parsed_data['value'] = split[-1]
+    return parsed_data
+
+def _price_type(trade_in: bool) -> tuple:
+    # Select the pricetype slug and the parser of its aria-label
+    if trade_in: return 'trade-in', _trade_in_parser
+    else: return 'private-party', _private_party_parser
+
+def _ranges_url(make, model, year, style, condition, mileage, price_type) -> str:
+    return f'https://www.kbb.com/{make}/{model}/{year}/{style}/?condition={condition}&intent=trade-in-sell&mileage={mileage}&pricetype={price_type}'
+
+def _ranges_key(cache, make, model, year, style, condition, mileage, price_type) -> str:
+    return cache.make_key('ranges', make, model, year, style, condition, price_type, mileage_bucket(mileage))
+
+
+@traced('kbb.get_ranges')
 def get_ranges(make: str, model: str, style: str, year: int, condition: str, mileage: int, trade_in: bool = True) -> dict:
     """
     Get price ranges for a specified vehicle model based on various conditions.
@@ -101,54 +160,260 @@ def get_ranges(make: str, model: str, style: str, year: int, condition: str, mil
     Returns:
         - dict: A dictionary containing the low, high, and value of the price range.
     """
-    # Define parsers for different price types
-    def _trade_in_parser(str):
-        parsed_data = {}
-        split = str.split(' ')
-        parsed_data['low']= split[2]
-        parsed_data['high'] = split[4]
-        parsed_data['value'] = split[-1]
-        return parsed_data
-
-    def _private_party_parser(str):
-        parsed_data = {}
-        split = str.split(' ')
-        parsed_data['low']= split[3]
-        parsed_data['high'] = split[5]
-        parsed_data['value'] = split[-1]
-        return parsed_data
-
-    # Select parser based on price type
-    if trade_in:
-        price_type = 'trade-in'
-        parser = _trade_in_parser
-    else:
-        price_type = 'private-party'
-        parser = _private_party_parser
+    price_type, parser = _price_type(trade_in)
+
+    # Valuations of the same car at nearly the same mileage are served from the cache
+    cache = get_kbb_cache()
+    if cache is not None:
+        key = _ranges_key(cache, make, model, year, style, condition, mileage, price_type)
+        ranges = cache.get(key)
+        if ranges is not None:
+            return ranges
                         
-    def _agent(make, model, year, style, condition, mileage, price_type):
-        # Set up webdriver
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless=new')
-        options.add_argument(f'user-agent={custom_user_agent}')
-        browser = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    from selenium.webdriver.common.by import By
+    from transport import get_transport
 
-        # Navigate to URL
-        browser.get(f'https://www.kbb.com/{make}/{model}/{year}/{style}/?condition={condition}&intent=trade-in-sell&mileage={mileage}&pricetype={price_type}')
+    # Check a warm browser out of the shared pool and navigate to URL
+    transport = get_transport()
+    url = _ranges_url(make, model, year, style, condition, mileage, price_type)
+    with get_pool().browser() as browser:
+        browser.get(transport.browser_url(url))
 
         # Get price ranges
         ranges = browser.find_element(By.CLASS_NAME, 'css-je8g23')
         values = ranges.get_attribute("aria-label")
-
-        browser.quit()
-        return values
-    
-    value_thread = ReturnValueThread(target=_agent, args=(make, model, year, style, condition, mileage, price_type))
-    value_thread.start()
-    values = value_thread.join()
+        transport.save_page(browser, url)
 
     # Parse and return price range
-    return parser(values)
+    ranges = parser(values)
+    if cache is not None: cache.set(key, ranges)
+    return ranges
+
+
+@traced('kbb.get_valuations')
+def get_valuations(make: str, model: str, style: str, year: int, mileage: int, trade_in_condition: str = 'fair', private_party_condition: str = 'good', mode: str = None) -> tuple:
+    """
+    Get the trade-in and private-party price ranges of a vehicle together.
+
+    Both pages are loaded at the same time in two tabs of one pooled browser, so the pair costs about as long as a
+    single `get_ranges` call. Ranges that are already cached are not fetched again.
+
+    Args:
+        - make (str): The make of the vehicle.
+        - model (str): The model of the vehicle.
+        - style (str): The style of the vehicle.
+        - year (int): The year of the vehicle.
+        - mileage (int): The mileage of the vehicle.
+        - trade_in_condition (str, optional): The condition used for the trade-in range. Defaults to "fair".
+        - private_party_condition (str, optional): The condition used for the private-party range. Defaults to "good".
+        - mode (str, optional): 'direct' or 'curve' (see `config.KBB_VALUATION_MODE`). Defaults to the configured mode.
+
+    Returns:
+        - tuple: The trade-in ranges and the private-party ranges, as returned by `get_ranges`.
+    """
+    mode = mode or config.KBB_VALUATION_MODE
+
+    if mode == 'curve':
+        # the curves of the two price types are independent, sample them side by side
+        with TaskGroup() as group:
+            trade_in = group.submit(get_ranges_from_curve, make, model, style, year, trade_in_condition, mileage, True)
+            private_party_ranges = get_ranges_from_curve(make, model, style, year, private_party_condition, mileage, trade_in=False)
+            return group.wait(trade_in), private_party_ranges
+
+    conditions = {
+        True: trade_in_condition,
+        False: private_party_condition
+    }
+
+    # look both price types up in the cache first
+    results = {}
+    keys = {}
+    cache = get_kbb_cache()
+    for trade_in, condition in conditions.items():
+        if cache is not None:
+            keys[trade_in] = _ranges_key(cache, make, model, year, style, condition, mileage, _price_type(trade_in)[0])
+            ranges = cache.get(keys[trade_in])
+            if ranges is not None: results[trade_in] = ranges
+
+    missing = [trade_in for trade_in in conditions if trade_in not in results]
+    if len(missing) == 1:
+        results[missing[0]] = get_ranges(make, model, style, year, conditions[missing[0]], mileage, trade_in=missing[0])
+
+    elif len(missing) == 2:
+        trade_in_url = _ranges_url(make, model, year, style, trade_in_condition, mileage, 'trade-in')
+        private_party_url = _ranges_url(make, model, year, style, private_party_condition, mileage, 'private-party')
+
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+        from transport import get_transport
+
+        transport = get_transport()
+        with get_pool().browser() as browser:
+            # start the private-party page loading in a second tab, window.open does not wait for it
+            first_tab = browser.current_window_handle
+            browser.execute_script('window.open(arguments[0], "_blank");', transport.browser_url(private_party_url))
+            second_tab = [handle for handle in browser.window_handles if handle != first_tab][0]
+
+            # load the trade-in page in the first tab while the second one loads
+            browser.switch_to.window(first_tab)
+            browser.get(transport.browser_url(trade_in_url))
+            trade_in_values = browser.find_element(By.CLASS_NAME, 'css-je8g23').get_attribute('aria-label')
+            transport.save_page(browser, trade_in_url)
+
+            browser.switch_to.window(second_tab)
+            ranges = WebDriverWait(browser, 10).until(EC.presence_of_element_located((By.CLASS_NAME, 'css-je8g23')))
+            private_party_values = ranges.get_attribute('aria-label')
+            transport.save_page(browser, private_party_url)
+
+        results[True] = _trade_in_parser(trade_in_values)
+        results[False] = _private_party_parser(private_party_values)
+
+        if cache is not None:
+            cache.set(keys[True], results[True])
+            cache.set(keys[False], results[False])
+
+    return results[True], results[False]
+
+
+class MileageCurve:
+    """
+    The KBB price range of one car (make, model, year, style, condition and price type) sampled at a few anchor
+    mileages, used to estimate the range at any other mileage by linear interpolation.
+
+    Below the lowest and above the highest anchor the range of the closest anchor is used.
+
+    Methods:
+        at(self, mileage)
+            Returns the interpolated price range at a mileage.
+
+        anchor_error(self, mileage)
+            Returns how far off interpolation is at the anchor closest to a mileage.
+    """
+
+    fields = ('low', 'high', 'value')
+
+    def __init__(self, anchors: dict, missing: tuple = ()):
+        """
+        Initialize a MileageCurve.
+
+        Parameters:
+        - anchors (dict): A dictionary mapping each anchor mileage to the price range `get_ranges` returned for it.
+        - missing (tuple): The anchor mileages that were asked for but could not be looked up (optional).
+        """
+        import numpy as np
+
+        self.anchors = anchors
+        self.missing = tuple(missing)
+        self.mileages = np.array(sorted(int(m) for m in anchors), dtype=float)
+        self.values = {
+            field: np.array([dollar_to_int(anchors[m][field]) for m in sorted(anchors, key=int)])
+            for field in self.fields
+        }
+
+    def at(self, mileage) -> dict:
+        """
+        Estimate the price range at a mileage.
+
+        Parameters:
+        - mileage (int): The mileage of the vehicle.
+
+        Returns:
+        - dict: A dictionary with the same `low`, `high` and `value` dollar strings `get_ranges` returns, plus the
+          `nearest_anchor` mileage, the `anchor_error` in dollars (see `anchor_error`) and the `missing_anchors`
+          the curve was built without.
+        """
+        import numpy as np
+
+        mileage = float(mileage)
+        ranges = {field: f'${thousands(round(np.interp(mileage, self.mileages, self.values[field])))}' for field in self.fields}
+
+        nearest = int(np.argmin(np.abs(self.mileages - mileage)))
+        ranges['nearest_anchor'] = int(self.mileages[nearest])
+        ranges['anchor_error'] = self.anchor_error(mileage)
+        ranges['missing_anchors'] = list(self.missing)
+        return ranges
+
+    def anchor_error(self, mileage) -> float:
+        """
+        Estimate the interpolation error near a mileage.
+
+        The anchor closest to the mileage is left out and interpolated from the remaining anchors. The difference
+        between that estimate and the real KBB `value` at the anchor is returned.
+
+        Parameters:
+        - mileage (int): The mileage of the vehicle.
+
+        Returns:
+        - float: The absolute error in dollars, or 0 if the curve has a single anchor.
+        """
+        if len(self.mileages) < 2:
+            return 0.0
+
+        import numpy as np
+        nearest = int(np.argmin(np.abs(self.mileages - float(mileage))))
+        others = np.arange(len(self.mileages)) != nearest
+        estimate = np.interp(self.mileages[nearest], self.mileages[others], self.values['value'][others])
+        return float(abs(estimate - self.values['value'][nearest]))
+
+
+@traced('kbb.get_mileage_curve')
+def get_mileage_curve(make: str, model: str, style: str, year: int, condition: str, trade_in: bool = True, anchors: tuple = None, verbose=0) -> MileageCurve:
+    """
+    Get the KBB price curve of a vehicle, fetching the price range at every anchor mileage.
+
+    Args:
+        - make (str): The make of the vehicle.
+        - model (str): The model of the vehicle.
+        - style (str): The style of the vehicle.
+        - year (int): The year of the vehicle.
+        - condition (str): The condition of the vehicle (e.g., "fair", "good", "excellent").
+        - trade_in (bool, optional): Whether to get trade-in prices or private-party prices. Defaults to True.
+        - anchors (tuple, optional): The mileages to sample. Defaults to `config.KBB_CURVE_ANCHORS`.
+
+    Returns:
+        - MileageCurve: The price curve of the vehicle. Anchors that could not be looked up are left out of it and
+          listed in its `missing`.
+    """
+    anchors = tuple(anchors or config.KBB_CURVE_ANCHORS)
+
+    cache = get_kbb_cache()
+    if cache is not None:
+        key = cache.make_key('curve', make, model, year, style, condition, trade_in, *anchors)
+        points = cache.get(key)
+        if points is not None:
+            return MileageCurve(points)
+
+    # sample every anchor at once, the browser pool bounds how many actually load in parallel
+    # an anchor that cannot be looked up is left out of the curve rather than failing it
+    points = {}
+    missing = []
+    with TaskGroup(fail_fast=False) as group:
+        futures = [group.submit(get_ranges, make, model, style, year, condition, mileage, trade_in) for mileage in anchors]
+        for mileage, future in zip(anchors, futures):
+            try:
+                points[mileage] = group.wait(future)
+            except (Cancelled, TimeoutError):
+                raise
+            except Exception as exc:
+                missing.append(mileage)
+                if verbose > 0: print(f'no KBB range at {mileage} miles: {type(exc).__name__}: {exc}')
+
+    if not points:
+        raise ValueError(f'could not get a KBB price range at any anchor mileage for a {year} {make} {model} {style}')
+
+    if cache is not None and not missing: cache.set(key, points)
+    return MileageCurve(points, missing)
+
+
+def get_ranges_from_curve(make: str, model: str, style: str, year: int, condition: str, mileage: int, trade_in: bool = True, verbose=0) -> dict:
+    """
+    Get price ranges for a specified vehicle by interpolating its KBB price curve instead of looking up the
+    exact mileage. Takes the same arguments and returns the same keys as `get_ranges`, plus `nearest_anchor`,
+    `anchor_error` and `missing_anchors` (see `MileageCurve.at`).
+    """
+    curve = get_mileage_curve(make, model, style, year, condition, trade_in=trade_in, verbose=verbose)
+    return curve.at(mileage)
 
 if __name__ == '__main__':
     import json
@@ -1,20 +1,64 @@
 
-from typing import List
+from typing import List, TextIO
 
-class Page():
+# characters StyledPage escapes with a backslash, mapped once for str.translate
+_MARKDOWN_ESCAPES = str.maketrans({c: '\\' + c for c in ["_", "*", "`", "[", "]", "(", ")", "#", "+", "-", ".", "!", "$"]})
+
+class _Buffer():
+    """
+    Text that is built up piece by piece. Pieces are appended to a list and only joined when `body` is read,
+    or written straight through to a file-like `sink` so nothing is kept in memory.
+    """
+
+    def __init__(self, init_str: str = '', sink: TextIO = None):
+        self.sink = sink
+        self._parts = []
+        self._write(init_str)
+
+    def _write(self, text: str) -> None:
+        if not text:
+            return
+        if self.sink is not None:
+            self.sink.write(text)
+        else:
+            self._parts.append(text)
+
+    @property
+    def body(self) -> str:
+        """
+        The text of the page. A page that streams to a sink keeps nothing, so its body is empty.
+        """
+        # join once and keep the result as the only part, so reading body repeatedly stays cheap
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ''
+
+    @body.setter
+    def body(self, value: str) -> None:
+        self._parts = [value] if value else []
+
+    def write_to(self, file: TextIO) -> None:
+        """
+        Write the body of the page to a file-like object.
+        """
+        for part in self._parts:
+            file.write(part)
+
+class Page(_Buffer):
     """
     A class representing a simple text page.
     """
 
-    def __init__(self, init_str: str = ''):
+    def __init__(self, init_str: str = '', sink: TextIO = None):
         """
         Initialize a Page object with the given initial string as its body.
 
         Parameters:
         - init_str (str): The initial string to set as the body of the page. Defaults to an empty string.
+        - sink (TextIO): A file-like object to write the page to as it is built instead of keeping it in `body` (optional).
         """
 
-        self.body = init_str
+        super().__init__(init_str, sink)
 
     def press(self, string: str, end: str = '\n') -> None:
         """
@@ -27,71 +71,62 @@ class Page():
         Returns:
         - None
         """
-        self.body = self.body + string + end
+        self._write(string)
+        self._write(end)
 
-class StyledPage():
+class StyledPage(_Buffer):
     """
     A class representing a simple text page.
     """
-    def __init__(self):
-        self.body = ''
+    def __init__(self, sink: TextIO = None):
+        super().__init__('', sink)
 
     def _escape(self, text: str) -> str:
-        markdown_chars = ["_", "*", "`", "[", "]", "(", ")", "#", "+", "-", ".", "!", "$"]
-        for i in range(len(markdown_chars)):
-            text = text.replace(markdown_chars[i], '\\' + markdown_chars[i])
-        return text
+        return text.translate(_MARKDOWN_ESCAPES)
 
     def h1(self, string: str) -> None:
         string = self._escape(string)
-        self.body = self.body + f'\n# {string}\n\n'
-    
+        self._write(f'\n# {string}\n\n')
+
     def h2(self, string: str) -> None:
         string = self._escape(string)
-        self.body = self.body + f'\n## {string}\n\n'
+        self._write(f'\n## {string}\n\n')
 
     def h3(self, string: str) -> None:
         string = self._escape(string)
-        self.body = self.body + f'\n### {string}\n\n'
+        self._write(f'\n### {string}\n\n')
 
     def h4(self, string: str) -> None:
         string = self._escape(string)
-        self.body = self.body + f'\n#### {string}\n\n'
+        self._write(f'\n#### {string}\n\n')
 
     def add_heading(self, string: str, h_level: int, end='\n\n') -> None:
         string = self._escape(string)
-        self.body = self.body + f"{'#'*h_level} {string}{end}"
-    
+        self._write(f"{'#'*h_level} {string}{end}")
+
     def add_paragraph(self, string: str) -> None:
         string = self._escape(string)
-        self.body = self.body + string + '\n\n'
-    
+        self._write(string + '\n\n')
+
     def add_blockquote(self, string:str) -> None:
         string = self._escape(string)
-        self.body = self.body + '> ' + string + '\n\n'
-    
+        self._write('> ' + string + '\n\n')
+
     def add_link(self, url, title):
         title = self._escape(title)
-        self.body = self.body + f'[{title}]({url}) \n\n'
-    
+        self._write(f'[{title}]({url}) \n\n')
+
     def add_raw_text(self, string: str, end='') -> None:
-        self.body = self.body + string + end
-    
-    def add_unordered_list(self, list: list) -> None:
-        output = ''
-        for i, item in enumerate(list):
-            item = self._escape(str(item))
-            output = output + f'{i+1}. {item}\n'
+        self._write(string)
+        self._write(end)
 
-        self.body = self.body + output + '\n\n'
+    def add_unordered_list(self, list: list) -> None:
+        items = [f'{i+1}. {self._escape(str(item))}\n' for i, item in enumerate(list)]
+        self._write(''.join(items) + '\n\n')
 
     def add_ordered_list(self, list: list) -> None:
-        output = ''
-        for item in list:
-            item = self._escape(str(item))
-            output = output + f'- {item}\n'
+        items = [f'- {self._escape(str(item))}\n' for item in list]
+        self._write(''.join(items) + '\n\n')
 
-        self.body = self.body + output + '\n\n'
-    
     def divider(self):
-        self.body = self.body + '---\n\n'
+        self._write('---\n\n')
@@ -0,0 +1,278 @@
+import multiprocessing
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from tracing import span
+
+# one step of the pipeline: `func` takes what the previous stage returned and runs on a worker of `pool`
+Stage = namedtuple('Stage', ['name', 'pool', 'func'])
+
+# the worker pools stages run in and how many of their stages may run at once
+POOLS = ('http', 'browser', 'cpu')
+
+# the pool whose stages can be moved to worker processes
+PROCESS_POOL = 'cpu'
+
+# marks the end of the items on a queue
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """The caller stopped reading the results before the item went through every stage."""
+
+
+def default_limits() -> dict:
+    """Returns the concurrency limit of every pool from the config."""
+    return {
+        'http': config.PIPELINE_HTTP_WORKERS,
+        'browser': config.PIPELINE_BROWSER_WORKERS,
+        'cpu': config.PIPELINE_CPU_WORKERS,
+    }
+
+
+class PipelineResult():
+    """
+    One item that went through the pipeline.
+
+    Attributes:
+    - index (int): The position of the item in the input.
+    - item: The item as it was given to the pipeline.
+    - value: What the last stage returned, or None when a stage failed.
+    - error (Exception): The exception a stage raised, or None.
+    - stage (str): The name of the stage that raised `error`, or None.
+    """
+
+    __slots__ = ('index', 'item', 'value', 'error', 'stage')
+
+    def __init__(self, index: int, item):
+        self.index = index
+        self.item = item
+        self.value = item
+        self.error = None
+        self.stage = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'failed in {self.stage}: {self.error!r}'
+        return f'PipelineResult({self.index}, {status})'
+
+
+def _stopped(job: PipelineResult, stage: str) -> None:
+    job.value = None
+    job.error = PipelineStopped('the results were no longer read')
+    job.stage = stage
+
+
+class BatchPipeline():
+    """
+    Runs many items through a chain of stages with a separate worker pool per kind of work.
+
+    Every stage has its own workers and an input queue, so while one listing waits on a browser the next one can
+    already be downloading and another one being parsed. The workers of all stages in the same pool share that
+    pool's concurrency limit, so for example no more listings use a browser at once than there are browsers.
+
+    The queues between stages are bounded and only `max_in_flight` items are in the pipeline at once, so a slow
+    stage holds back the stages before it instead of letting work pile up in memory. An item whose stage raises is
+    not passed to the later stages, it comes out with the error instead.
+
+    Parsing and matching hold the GIL, so with `processes` the stages of the 'cpu' pool are handed to worker
+    processes instead, while the stages that wait on I/O keep running on threads of this process. The functions of
+    those stages, and what goes in and comes out of them, then have to be picklable.
+
+    Methods:
+        run(self, items)
+            Runs the items through the stages and yields a PipelineResult for each.
+    """
+
+    def __init__(self, stages: list, limits: dict = None, queue_size: int = None, max_in_flight: int = None, ordered: bool = True,
+                 processes: int = None, initializer=None, on_done=None):
+        """
+        Initialize a BatchPipeline.
+
+        Parameters:
+        - stages (list): The Stage objects to run every item through, in order.
+        - limits (dict): The concurrency limit of each pool (optional). Pools that are not given keep their
+          `default_limits`.
+        - queue_size (int): How many items may wait in front of each stage. Defaults to `config.PIPELINE_QUEUE_SIZE`.
+        - max_in_flight (int): How many items may be in the pipeline at once. Defaults to `config.PIPELINE_MAX_IN_FLIGHT`.
+        - ordered (bool): Yield the results in the order of the input. Otherwise each one is yielded as soon as it
+          is done. Defaults to True.
+        - processes (int): How many worker processes run the stages of the 'cpu' pool. Defaults to
+          `config.PIPELINE_PROCESSES`, 0 runs them on threads. Unless `limits` says otherwise, that many of them may
+          run at once.
+        - initializer (callable): Called once in every worker process as it starts, e.g. to load what the stages
+          need so the first item a process gets is not slower than the rest (optional).
+        - on_done (callable): Called with the PipelineResult of every item the pipeline took from the input as soon
+          as the pipeline is done with it, from a worker thread (optional). It is called exactly once per item,
+          also for items that were dropped because the caller stopped reading results (their error is
+          PipelineStopped), so it is the place to give back what was taken for an item.
+        """
+        self.stages = list(stages)
+        self.processes = config.PIPELINE_PROCESSES if processes is None else processes
+        self.initializer = initializer
+        self.on_done = on_done
+        self.limits = {**default_limits(), **({PROCESS_POOL: self.processes} if self.processes else {}), **(limits or {})}
+        self.queue_size = queue_size or config.PIPELINE_QUEUE_SIZE
+        self.max_in_flight = max_in_flight or config.PIPELINE_MAX_IN_FLIGHT
+        self.ordered = ordered
+
+        for stage in self.stages:
+            if self.limits.get(stage.pool, 0) < 1:
+                raise ValueError(f'Stage {stage.name!r} runs in pool {stage.pool!r} which has no workers')
+
+    def run(self, items):
+        """
+        Run every item through the stages.
+
+        Parameters:
+        - items (iterable): The inputs of the first stage. They are taken from the iterable as room frees up, so it
+          may be a generator.
+
+        Yields:
+        - PipelineResult: One per item, in input order when the pipeline is ordered.
+
+        Raises:
+        - Exception: What the `items` iterable raised, after the results of the items taken before it.
+        """
+        inboxes = [queue.Queue(self.queue_size) for _ in self.stages]
+        results = queue.Queue()
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        pools = {name: threading.BoundedSemaphore(limit) for name, limit in self.limits.items()}
+        stop = threading.Event()
+
+        # worker processes are spawned rather than forked, a fork would copy the running threads' locks and browsers
+        executor = None
+        if self.processes and any(stage.pool == PROCESS_POOL for stage in self.stages):
+            executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'), initializer=self.initializer)
+
+        # the number of workers of each stage, the last stage hands its results to the caller
+        workers = [self.limits[stage.pool] for stage in self.stages]
+
+        for i, stage in enumerate(self.stages):
+            if i + 1 < len(self.stages):
+                outbox, done_count = inboxes[i + 1], workers[i + 1]
+            else:
+                outbox, done_count = results, 1
+
+            # the last worker of a stage to see the end marker passes it on to the next stage
+            remaining = [workers[i]]
+            lock = threading.Lock()
+
+            for _ in range(workers[i]):
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, pools[stage.pool], executor if stage.pool == PROCESS_POOL else None, inboxes[i], outbox, done_count, i + 1 == len(self.stages), remaining, lock, stop),
+                    daemon=True).start()
+
+        # an error of the items iterable is raised to the caller once the items before it are through
+        feed_error = []
+        threading.Thread(target=self._feed, args=(items, inboxes[0], workers[0], in_flight, stop, feed_error), daemon=True).start()
+
+        pending = {}
+        next_index = 0
+        try:
+            while True:
+                job = results.get()
+                if job is _DONE:
+                    if feed_error: raise feed_error[0]
+                    break
+
+                if not self.ordered:
+                    in_flight.release()
+                    yield job
+                    continue
+
+                # hold results that finished early until every item before them is out
+                pending[job.index] = job
+                while next_index in pending:
+                    job = pending.pop(next_index)
+                    next_index += 1
+                    in_flight.release()
+                    yield job
+
+        finally:
+            # the caller stopped early, let the workers drain what is left without running it
+            stop.set()
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _feed(self, items, inbox: queue.Queue, done_count: int, in_flight: threading.Semaphore, stop: threading.Event, error: list) -> None:
+        try:
+            for index, item in enumerate(items):
+                job = PipelineResult(index, item)
+
+                # wait for room in the pipeline, checking now and then whether the caller is gone
+                while not in_flight.acquire(timeout=0.5):
+                    if stop.is_set(): return self._drop(job, None)
+                if stop.is_set(): return self._drop(job, None)
+
+                inbox.put(job)
+        except Exception as exc:
+            error.append(exc)
+        finally:
+            for _ in range(done_count):
+                inbox.put(_DONE)
+
+    def _work(self, stage: Stage, pool: threading.Semaphore, executor: ProcessPoolExecutor, inbox: queue.Queue, outbox: queue.Queue, done_count: int, last_stage: bool, remaining: list, lock: threading.Lock, stop: threading.Event) -> None:
+        while True:
+            job = inbox.get()
+
+            if job is _DONE:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    for _ in range(done_count):
+                        outbox.put(_DONE)
+                return
+
+            # items of a caller that is gone are dropped, failed items skip the rest of the stages
+            if job.error is None and stop.is_set():
+                _stopped(job, stage.name)
+
+            if job.error is None:
+                with pool:
+                    try:
+                        with span(f'stage.{stage.name}'):
+                            if executor is None:
+                                job.value = stage.func(job.value)
+                            else:
+                                # this thread only waits while a worker process does the work
+                                job.value = executor.submit(stage.func, job.value).result()
+                    except Exception as exc:
+                        job.value = None
+                        job.error = exc
+                        job.stage = stage.name
+
+            # the last stage hands the item back, the pipeline is done with it
+            if last_stage and self.on_done is not None:
+                self.on_done(job)
+            outbox.put(job)
+
+    def _drop(self, job: PipelineResult, stage: str) -> None:
+        # an item taken from the input that never went into the pipeline
+        _stopped(job, stage)
+        if self.on_done is not None:
+            self.on_done(job)
+
+
+def run_pipeline(stages: list, items, **kwargs):
+    """
+    Run items through the stages of a BatchPipeline.
+
+    Args:
+    - stages (list): The Stage objects to run every item through, in order.
+    - items (iterable): The inputs of the first stage.
+    - **kwargs: The `limits`, `queue_size`, `max_in_flight`, `ordered`, `processes`, `initializer` and `on_done`
+      options of BatchPipeline.
+
+    Returns:
+    - generator: A PipelineResult per item.
+    """
+    return BatchPipeline(stages, **kwargs).run(items)
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+
+from get_info_helpers import mileage_level, render_styled_breifing
+
+
+class DealRanker():
+    """
+    Keeps the N best deals out of a stream of analyzed listings.
+
+    Listings are added one at a time as they are analyzed and only the current top N are held, in a heap, so
+    ranking thousands of listings needs memory for N of them. Listings can be filtered on their deal tier, the
+    negotiation they need and their mileage level before they are ranked.
+
+    Methods:
+        add(self, record)
+            Offers an analyzed listing to the ranking.
+
+        winners(self)
+            Returns the kept listings, best first.
+    """
+
+    def __init__(self, n: int = 20, key: str = 'listing_avg_delta', tiers: tuple = None, max_negotiation: float = None, mileage_levels: tuple = None):
+        """
+        Initialize a DealRanker.
+
+        Parameters:
+        - n (int): How many listings to keep. Defaults to 20.
+        - key (str): The ListingValuation field to rank on, higher is better. Defaults to `listing_avg_delta`.
+        - tiers (tuple): Only keep listings in these `valuation.DEAL_TIERS` (optional).
+        - max_negotiation (float): Only keep listings that need at most this much negotiated off the price (optional).
+        - mileage_levels (tuple): Only keep listings with these `mileage_level` descriptions (optional).
+        """
+        self.n = n
+        self.key = key
+        self.tiers = tiers
+        self.max_negotiation = max_negotiation
+        self.mileage_levels = mileage_levels
+
+        self.seen = 0
+        self._heap = []
+        self._order = itertools.count()
+
+    def accepts(self, record: dict) -> bool:
+        """Returns whether a listing passes the filters of the ranking."""
+        valuation = record['valuation']
+        if self.tiers is not None and valuation.deal_tier not in self.tiers: return False
+        if self.max_negotiation is not None and valuation.negotiation_amount > self.max_negotiation: return False
+        if self.mileage_levels is not None and mileage_level(valuation.mileage) not in self.mileage_levels: return False
+        return True
+
+    def add(self, record: dict) -> None:
+        """
+        Offer an analyzed listing to the ranking.
+
+        Parameters:
+        - record (dict): The listing as returned by `get_info.analyze_listing`.
+        """
+        self.seen += 1
+        if not self.accepts(record):
+            return
+
+        # a min-heap of the best n, the earlier listing wins a tie
+        entry = (getattr(record['valuation'], self.key), -next(self._order), record)
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+
+    def winners(self) -> list:
+        """Returns the kept listings, best first."""
+        return [record for _, _, record in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
+
+
+def rank_deals(records, n: int = 20, **filters) -> list:
+    """
+    Select the N best deals out of analyzed listings.
+
+    Args:
+    - records (iterable): Listings as returned by `get_info.analyze_listing`.
+    - n (int): How many listings to return. Defaults to 20.
+    - **filters: The `key` and filters `DealRanker` takes.
+
+    Returns:
+    - list: The best listings, best first.
+    """
+    ranker = DealRanker(n, **filters)
+    for record in records:
+        ranker.add(record)
+    return ranker.winners()
+
+
+def top_n_indices(arrays: dict, n: int = 20, key: str = 'listing_avg_delta', mask=None):
+    """
+    Select the N best deals out of listings held as NumPy columns (see `valuation.valuations_to_arrays`) with a
+    partial sort, without touching the listings that are not selected.
+
+    Args:
+    - arrays (dict): A dictionary of equal length NumPy arrays, or a DataFrame.
+    - n (int): How many listings to return. Defaults to 20.
+    - key (str): The column to rank on, higher is better. Defaults to `listing_avg_delta`.
+    - mask (np.ndarray): A boolean array of the listings that may be selected (optional).
+
+    Returns:
+    - np.ndarray: The indexes of the best listings, best first.
+    """
+    import numpy as np
+
+    scores = np.asarray(arrays[key], dtype=float)
+    candidates = np.arange(len(scores)) if mask is None else np.flatnonzero(mask)
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+
+    # stable sort of the few winners, the earlier listing wins a tie
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def render_winners(records: list) -> list:
+    """
+    Render the styled briefing of every ranked listing that does not have one yet.
+
+    Args:
+    - records (list): Listings as returned by `get_info.analyze_listing(render=False)`.
+
+    Returns:
+    - list: The same records with their `briefing` filled in.
+    """
+    for record in records:
+        if record.get('briefing') is None:
+            record['briefing'] = render_styled_breifing(record['valuation'], record['description'])
+    return records
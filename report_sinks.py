@@ -0,0 +1,155 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+from typing import List
+
+from page import Page, StyledPage
+
+
+def flatten_record(record: dict) -> dict:
+    """
+    Flatten an analyzed listing (see `get_info.analyze_listing`) into one level of keys. The fields of the
+    valuation become top level keys, and nested range dictionaries like `trade_in_ranges` become `trade_in_low`,
+    `trade_in_high` and `trade_in_value`. Valuations from a mileage curve also carry `trade_in_nearest_anchor`,
+    `trade_in_anchor_error` and the same two `private_party_` fields, which are empty otherwise.
+    """
+    flat = {}
+    for key, value in record.items():
+        if hasattr(value, 'to_dict'):
+            flat.update(value.to_dict())
+        elif isinstance(value, dict):
+            prefix = key[:-len('_ranges')] if key.endswith('_ranges') else key
+            for sub_key, sub_value in value.items():
+                flat[f'{prefix}_{sub_key}'] = sub_value
+        else:
+            flat[key] = value
+    return flat
+
+
+class ReportSink(ABC):
+    """
+    Writes analyzed listings to a file one at a time, as soon as each one is ready.
+
+    Each record is written and flushed right away and nothing is kept afterwards, so memory use does not grow with
+    the size of a batch and the file can be followed while the batch is still running.
+    """
+
+    newline = None
+
+    def __init__(self, path: str):
+        """
+        Initialize a ReportSink.
+
+        Parameters:
+        - path (str): The file to write. An existing file is replaced.
+        """
+        self.path = path
+        self.file = open(path, 'w', newline=self.newline)
+        self.count = 0
+
+    def write(self, record: dict) -> None:
+        """
+        Write one analyzed listing and flush it to the file.
+
+        Parameters:
+        - record (dict): The listing as returned by `get_info.analyze_listing`.
+        """
+        self._write(record)
+        self.file.flush()
+        self.count += 1
+
+    @abstractmethod
+    def _write(self, record: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MarkdownSink(ReportSink):
+    """
+    Writes the styled briefing of every listing under one heading, like styled_breifing.md.
+    """
+
+    def __init__(self, path: str, title: str = 'Flipper Search Results'):
+        super().__init__(path)
+        self.page = StyledPage(sink=self.file)
+        self.page.h1(title)
+
+    def _write(self, record: dict) -> None:
+        self.page.add_raw_text(record['briefing'], end='\n')
+
+
+class TextSink(ReportSink):
+    """
+    Writes the briefing of every listing as plain text, like long_breifing.txt.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.page = Page(sink=self.file)
+
+    def _write(self, record: dict) -> None:
+        self.page.press(record['briefing'], end='\n\n')
+        self.page.press('Preparing for next car...', end='\n\n')
+
+
+class JsonLinesSink(ReportSink):
+    """
+    Writes every listing as one JSON object per line.
+    """
+
+    def _write(self, record: dict) -> None:
+        self.file.write(json.dumps(flatten_record(record), default=str) + '\n')
+
+
+class CsvSink(ReportSink):
+    """
+    Writes every listing as one CSV row with the flattened fields (see `flatten_record`). The briefing is left out,
+    the columns hold the data it was made from.
+    """
+
+    newline = ''
+
+    def __init__(self, path: str, exclude: tuple = ('briefing',)):
+        super().__init__(path)
+        self.exclude = exclude
+        self.writer = None
+
+    def _write(self, record: dict) -> None:
+        row = {key: value for key, value in flatten_record(record).items() if key not in self.exclude}
+
+        # the columns are fixed by the first record
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(row), extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerow(row)
+
+
+class MultiSink():
+    """
+    Writes every listing to several sinks at once.
+    """
+
+    def __init__(self, sinks: List[ReportSink]):
+        self.sinks = sinks
+
+    def write(self, record: dict) -> None:
+        for sink in self.sinks:
+            sink.write(record)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,41 +1,72 @@
-from get_info import analyze_car
+import sys
+
+import tracing
+
+from get_info import analyze_many
 from datetime import datetime
 from tqdm import tqdm
-from page import Page, StyledPage
+from ranking import DealRanker, render_winners
+from report_sinks import CsvSink, JsonLinesSink, MarkdownSink, MultiSink, TextSink
+
+def main(top_n: int = None, ordered: bool = False, limits: dict = None, processes: int = None):
+    """
+    Analyzes every listing in `urls` and writes the reports.
 
-def main():
+    Listings are analyzed concurrently by `get_info.analyze_many`, with separate limits on how many are downloading,
+    using a browser and being parsed at once (see `config.PIPELINE_*`).
+
+    Args:
+    - top_n (int): Only render and write the briefings of this many best deals (see `ranking.DealRanker`).
+      Every listing is written by default.
+    - ordered (bool): Write the listings in the order of `urls` rather than as soon as each one is done. Defaults to False.
+    - limits (dict): Concurrency limits of the `http`, `browser` and `cpu` pools (optional).
+    - processes (int): Worker processes to parse and match in (optional, see `config.PIPELINE_PROCESSES`).
+    """
     urls = [
         'https://www.ebay.com/itm/314516664183?hash=item493aa76f77%3Ag%3ANHAAAOSwsF1kIszb&mkevt=1&mkcid=1&mkrid=711-53200-19255-0&campid=5337650957&customid=&toolid=10049',
         'https://www.ebay.com/itm/325612307278?hash=item4bd001834e%3Ag%3AcmgAAOSwZGtkNG2I&mkevt=1&mkcid=1&mkrid=711-53200-19255-0&campid=5337650957&customid=&toolid=10049',
         'https://www.ebay.com/itm/166026384440?hash=item26a7f19438%3Ag%3AslYAAOSwPCNkNIQ8&mkevt=1&mkcid=1&mkrid=711-53200-19255-0&campid=5337650957&customid=&toolid=10049',
     ]
 
-    long_breif = Page()
-    long_breif_styled = StyledPage()
-    long_breif_styled.h1('Flipper Search Results')
+    # every result is written to each report as soon as it is analyzed
+    sinks = MultiSink([
+        TextSink('long_breifing.txt'),
+        MarkdownSink('styled_breifing.md'),
+        JsonLinesSink('breifing.jsonl'),
+        CsvSink('breifing.csv'),
+    ])
+
+    # when only the best deals are wanted, hold back the listings and skip rendering until the ranking is done
+    ranker = DealRanker(top_n) if top_n else None
 
-    start = datetime.now()
-    for url in tqdm(urls):
-        #try:
-        result = analyze_car(url)
-        long_breif.press(result, end='\n\n')
-        long_breif_styled.add_raw_text(result, end='\n')
+    with sinks:
+        start = datetime.now()
+        results = analyze_many(urls, render=ranker is None, ordered=ordered, limits=limits, processes=processes)
+        for result in tqdm(results, total=len(urls)):
+            # a listing that fails is reported and the batch carries on
+            if not result.ok:
+                print(f'{result.item} failed in {result.stage}: {type(result.error).__name__}: {result.error}', file=sys.stderr)
+                continue
 
-        #except Exception as e:
-        #    print(e)
+            if ranker is None:
+                sinks.write(result.value)
+            else:
+                ranker.add(result.value)
 
-        long_breif.press('Preparing for next car...', end='\n\n')
+        if ranker is not None:
+            for record in render_winners(ranker.winners()):
+                sinks.write(record)
 
     time = datetime.now() - start
     avg = time/len(urls)
 
     print(f'average time: {avg}')
 
-    with open('long_breifing.txt' , 'w') as file:
-        file.write(long_breif.body)
-
-    with open('styled_breifing.md' , 'w') as file:
-        file.write(long_breif_styled.body)
+    # per-stage percentiles and a Chrome trace of the run when FLIPPER_TRACE is set
+    tracer = tracing.get_tracer()
+    if tracer is not None:
+        print(tracer.summary())
+        tracing.export()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,429 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+import tracing
+from browser_pool import _driver_path, get_pool
+from catalog import get_catalog
+from get_info import analyze_listing, analyze_many
+from kbb_scrape import get_kbb_cache
+from pipeline import PipelineStopped
+from vin_decoder import get_offline_index, get_pattern_cache
+
+
+class ServiceBusy(Exception):
+    """More listings are waiting for the service than `config.SERVICE_MAX_QUEUE` allows."""
+
+
+class BatchTooLarge(ValueError):
+    """A batch has more listings than may ever wait at once, so it could not be taken even by an idle service."""
+
+
+def record_to_json(record: dict) -> dict:
+    """
+    Returns an analyzed listing (see `get_info.analyze_listing`) as a dictionary that can be sent as JSON: the
+    fields of its valuation, its deal tier, its description and its briefing (None when it was not rendered).
+    """
+    valuation = record['valuation']
+    return {
+        'valuation': valuation.to_dict(),
+        'deal_tier': valuation.deal_tier,
+        'description': record['description'],
+        'briefing': record['briefing'],
+    }
+
+def error_to_json(error: Exception, stage: str = None) -> dict:
+    """Returns why a listing could not be analyzed as a dictionary that can be sent as JSON."""
+    return {'error': f'{type(error).__name__}: {error}', 'stage': stage}
+
+
+class FlipperService:
+    """
+    Analyzes listings for the HTTP API of `ServiceServer`, keeping everything an analysis needs warm between
+    requests: the browsers of the pool, the model catalog, the KBB and VIN caches and the chromedriver path.
+
+    Only `max_concurrency` listings are analyzed at once, the rest wait their turn in arrival order. Once
+    `max_queue` listings are waiting, new requests are turned away with ServiceBusy rather than piling up.
+
+    Methods:
+        warm(self, browsers=None)
+            Loads the catalog and caches, resolves the chromedriver path, and launches the browsers if asked to.
+
+        analyze(self, url, render=True)
+            Analyzes one listing.
+
+        batch(self, urls, render=True, ordered=False)
+            Analyzes many listings through the batch pipeline, yielding each one as it is done.
+
+        metrics(self)
+            Returns the queue depth, the counters of the service and the stats of the caches and browsers.
+    """
+
+    def __init__(self, max_concurrency: int = None, max_queue: int = None):
+        """
+        Initialize a FlipperService.
+
+        Parameters:
+        - max_concurrency (int): How many listings may be analyzed at once. Defaults to `config.SERVICE_MAX_CONCURRENCY`.
+        - max_queue (int): How many listings may wait for their turn. Defaults to `config.SERVICE_MAX_QUEUE`.
+        """
+        self.max_concurrency = max_concurrency or config.SERVICE_MAX_CONCURRENCY
+        self.max_queue = max_queue or config.SERVICE_MAX_QUEUE
+        self.started = time.time()
+
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+
+    def warm(self, browsers: bool = None) -> None:
+        """
+        Load what the first listing would otherwise wait for.
+
+        Parameters:
+        - browsers (bool): Also launch every browser of the pool. Defaults to `config.SERVICE_WARM_BROWSERS`.
+        """
+        get_catalog()
+        get_kbb_cache()
+        get_pattern_cache()
+        get_offline_index()
+
+        # resolving chromedriver can mean a download, which the first listing that needs a browser would wait for
+        try:
+            _driver_path()
+        except Exception as exc:
+            print(f'could not resolve chromedriver, browsers will try again when launched: {type(exc).__name__}: {exc}', file=sys.stderr)
+
+        if config.SERVICE_WARM_BROWSERS if browsers is None else browsers:
+            pool = get_pool()
+            launched = [pool.checkout() for _ in range(pool.size)]
+            for browser in launched:
+                pool.checkin(browser)
+
+    def _reserve(self, count: int) -> None:
+        # take places in the queue for `count` listings, or turn them all away
+        with self._lock:
+            if self.waiting + count > self.max_queue:
+                room = self.max_queue - self.waiting
+                raise ServiceBusy(f'{count} listings do not fit in the queue: {self.waiting} of {self.max_queue} places are taken, {room} are free')
+            self.waiting += count
+
+    def _unreserve(self, count: int) -> None:
+        with self._lock:
+            self.waiting -= count
+
+    def _start(self) -> None:
+        # wait for a turn, then move a reserved listing from the queue to the running ones
+        self._slots.acquire()
+        self._begin()
+
+    def _begin(self) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+
+    def _finish(self, ok: bool, cancelled: bool = False) -> None:
+        # a listing is done with its turn, `cancelled` ones were dropped because their client went away
+        with self._lock:
+            self.running -= 1
+            if ok: self.completed += 1
+            elif cancelled: self.cancelled += 1
+            else: self.failed += 1
+        self._slots.release()
+
+    def analyze(self, url: str, render: bool = True) -> dict:
+        """
+        Analyze one listing once it is its turn.
+
+        Args:
+        - url (str): The URL of the eBay listing.
+        - render (bool): Whether to render the briefing. Defaults to True.
+
+        Returns:
+        - dict: The record `get_info.analyze_listing` returns.
+
+        Raises:
+        - ServiceBusy: If the queue is full.
+        - Exception: Whatever stopped the analysis of the listing.
+        """
+        self._reserve(1)
+        self._start()
+
+        ok = False
+        try:
+            record = analyze_listing(url, render=render)
+            ok = True
+            return record
+        finally:
+            self._finish(ok)
+
+    def batch(self, urls: list, render: bool = True, ordered: bool = False):
+        """
+        Analyze many listings with `get_info.analyze_many`. The listings take their turns one by one along with
+        those of every other request, and the pipeline overlaps their downloads, browsers and parsing.
+
+        Args:
+        - urls (list): The URLs of the eBay listings.
+        - render (bool): Whether to render the briefings. Defaults to True.
+        - ordered (bool): Yield the listings in the order of `urls`. Defaults to False.
+
+        Returns:
+        - generator: A `pipeline.PipelineResult` per listing, as `get_info.analyze_many` yields them.
+
+        Raises:
+        - BatchTooLarge: If the batch has more listings than `max_queue`. Split it up instead.
+        - ServiceBusy: If the queue has no room for all of the listings right now. None of them is analyzed then.
+        """
+        urls = list(urls)
+        if len(urls) > self.max_queue:
+            raise BatchTooLarge(f'the batch has {len(urls)} listings, at most {self.max_queue} can be queued at once')
+        self._reserve(len(urls))
+
+        # step into the generator, so the reservation is given back even if it is closed before the first listing
+        results = self._batch(urls, render, ordered)
+        next(results)
+        return results
+
+    def _batch(self, urls: list, render: bool, ordered: bool):
+        # how many listings got a turn, and whether the caller is gone
+        state = {'started': 0, 'closed': False}
+        lock = threading.Lock()
+
+        def admitted():
+            # the pipeline takes a listing from here only once it has a turn
+            for url in urls:
+                self._slots.acquire()
+                with lock:
+                    if state['closed']:
+                        # the queue place was already given back, only the turn is left
+                        self._slots.release()
+                        return
+                    state['started'] += 1
+                    self._begin()
+                yield url
+
+        def done(result) -> None:
+            # the pipeline calls this once for every listing it took, when it has finished with it or dropped it,
+            # so a turn is only given back once its browsers and downloads are no longer in use
+            self._finish(result.ok, cancelled=isinstance(result.error, PipelineStopped))
+
+        results = None
+        try:
+            yield
+            results = analyze_many(admitted(), render=render, ordered=ordered, on_done=done)
+            yield from results
+
+        finally:
+            # stop taking listings, and give back the queue places of those that never got a turn
+            with lock:
+                state['closed'] = True
+                unstarted = len(urls) - state['started']
+            self._unreserve(unstarted)
+            if results is not None:
+                results.close()
+
+    def metrics(self) -> dict:
+        """
+        Returns the queue depth and counters of the service, the stats of the KBB and VIN caches and the browser
+        pool, and the per-stage percentiles when tracing is on (see `tracing.py`).
+        """
+        with self._lock:
+            metrics = {
+                'uptime': time.time() - self.started,
+                'queue_depth': self.waiting,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+            }
+
+        kbb_cache = get_kbb_cache()
+        metrics['caches'] = {
+            'kbb': kbb_cache.stats() if kbb_cache is not None else None,
+            'vin': get_pattern_cache().stats(),
+        }
+        metrics['browsers'] = get_pool().stats()
+
+        tracer = tracing.get_tracer()
+        metrics['spans'] = tracer.stats() if tracer is not None else None
+        return metrics
+
+
+class ServiceServer:
+    """
+    The local HTTP/JSON API of a FlipperService:
+
+        GET  /health     {"status": "ok"}
+        GET  /metrics    FlipperService.metrics
+        POST /analyze    {"url": ..., "render": true}, answered with the analyzed listing
+        POST /batch      {"urls": [...], "render": true, "ordered": false}, answered with one JSON line per
+                         listing (application/x-ndjson) as soon as each one is done
+
+    A full queue is answered with 503, a batch larger than the whole queue with 400, a listing that ran out of
+    time with 504 and one that could not be analyzed with 502.
+    """
+
+    def __init__(self, service: FlipperService, host: str = None, port: int = None):
+        self.service = service
+        self._server = ThreadingHTTPServer((host or config.SERVICE_HOST, config.SERVICE_PORT if port is None else port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _handler(self):
+        service = self.service
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send_json(self, status: int, body: dict) -> None:
+                content = json.dumps(body, default=str).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _read_json(self) -> dict:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(body, dict):
+                    raise ValueError('the body has to be a JSON object')
+                return body
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/health':
+                    self._send_json(200, {'status': 'ok'})
+                elif path == '/metrics':
+                    self._send_json(200, service.metrics())
+                else:
+                    self._send_json(404, {'error': f'no such endpoint: {path}'})
+
+            def do_POST(self):
+                path = self.path.split('?', 1)[0]
+                if path not in ('/analyze', '/batch'):
+                    self._send_json(404, {'error': f'no such endpoint: {path}'})
+                    return
+
+                try:
+                    body = self._read_json()
+                    if path == '/analyze':
+                        if not isinstance(body.get('url'), str):
+                            raise ValueError('"url" has to be the URL of a listing')
+                    elif not isinstance(body.get('urls'), list) or not all(isinstance(url, str) for url in body['urls']):
+                        raise ValueError('"urls" has to be a list of listing URLs')
+                except ValueError as exc:
+                    self._send_json(400, {'error': str(exc)})
+                    return
+
+                render = bool(body.get('render', True))
+                try:
+                    if path == '/analyze':
+                        self._analyze(body['url'], render)
+                    else:
+                        self._batch(body['urls'], render, bool(body.get('ordered', False)))
+                except BatchTooLarge as exc:
+                    self._send_json(400, {'error': str(exc)})
+                except ServiceBusy as exc:
+                    self._send_json(503, {'error': str(exc)})
+
+            def _analyze(self, url: str, render: bool) -> None:
+                try:
+                    record = service.analyze(url, render=render)
+                except ServiceBusy:
+                    raise
+                except TimeoutError as exc:
+                    self._send_json(504, {'url': url, 'ok': False, **error_to_json(exc)})
+                except Exception as exc:
+                    self._send_json(502, {'url': url, 'ok': False, **error_to_json(exc)})
+                else:
+                    self._send_json(200, {'url': url, 'ok': True, **record_to_json(record)})
+
+            def _batch(self, urls: list, render: bool, ordered: bool) -> None:
+                results = service.batch(urls, render=render, ordered=ordered)
+
+                # no length up front, the connection is closed after the last listing (HTTP/1.0)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+
+                try:
+                    for result in results:
+                        if result.ok:
+                            line = {'url': result.item, 'ok': True, **record_to_json(result.value)}
+                        else:
+                            line = {'url': result.item, 'ok': False, **error_to_json(result.error, result.stage)}
+                        self.wfile.write(json.dumps(line, default=str).encode() + b'\n')
+                        self.wfile.flush()
+                finally:
+                    # the client may be gone, stop the rest of its listings
+                    results.close()
+
+            def log_message(self, format, *args):
+                print(f'{self.address_string()} {format % args}', file=sys.stderr)
+
+        return Handler
+
+    def start(self) -> str:
+        """Starts serving in a background thread and returns the base URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def serve(host: str = None, port: int = None, warm_browsers: bool = None) -> None:
+    """
+    Warm a FlipperService up and serve its API until interrupted.
+
+    Args:
+    - host (str): The address to listen on. Defaults to `config.SERVICE_HOST`.
+    - port (int): The port to listen on. Defaults to `config.SERVICE_PORT`.
+    - warm_browsers (bool): Launch every browser of the pool before serving. Defaults to `config.SERVICE_WARM_BROWSERS`.
+    """
+    service = FlipperService()
+    service.warm(browsers=warm_browsers)
+
+    server = ServiceServer(service, host, port)
+    print(f'flipper service listening at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run flipper as a service that analyzes listings over a local HTTP/JSON API.')
+    parser.add_argument('--host', default=config.SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVICE_PORT)
+    parser.add_argument('--warm-browsers', action='store_true', default=None, help='launch every browser of the pool at startup')
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.warm_browsers)
@@ -0,0 +1,154 @@
+import math
+import re
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+_TOKEN = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    """Returns the lowercased words of a string, keeping hyphenated trims like 'ex-l' in one piece."""
+    return _TOKEN.findall(text.lower())
+
+
+def _features(token: str) -> set:
+    # the whole word plus its padded character trigrams, so 'sedan' still matches 'sedans' or 'sedan4d'
+    padded = f' {token} '
+    return {f'w:{token}'} | {f'c:{padded[i:i+3]}' for i in range(len(padded) - 2)}
+
+
+class StyleMatcher:
+    """
+    Picks the KBB style a listing description talks about.
+
+    The available styles are compiled once into TF-IDF weighted feature vectors (words and character trigrams).
+    A description is cut into sliding windows of about as many words as a style has, every window is turned into
+    a binary feature vector, and one matrix product scores every window against every style: the score is the
+    share of a style's TF-IDF weight found in the window. Features shared by every style (e.g. 'sedan' when all
+    styles are sedans) carry the least weight, so the distinguishing trim words decide.
+
+    Methods:
+        scores(self, description)
+            Returns the best window score of every style for a description.
+
+        match(self, description)
+            Returns the best matching style for a description.
+
+        match_many(self, descriptions)
+            Returns the best matching style for each of several descriptions.
+    """
+
+    def __init__(self, styles: List[str]):
+        """
+        Initialize a StyleMatcher.
+
+        Parameters:
+        - styles (List[str]): The available styles to choose from.
+        """
+        self.styles = list(styles)
+
+        # a window is about as long as the average style, like style_from_description always did
+        self.window = max(1, math.floor(np.mean([len(style.split(' ')) for style in self.styles])))
+
+        style_features = [set().union(*(_features(token) for token in tokenize(style))) for style in self.styles]
+        self.vocabulary = {feature: i for i, feature in enumerate(sorted(set().union(*style_features)))}
+
+        # smoothed inverse document frequency of every feature over the styles
+        presence = np.zeros((len(self.styles), len(self.vocabulary)))
+        for s, features in enumerate(style_features):
+            presence[s, [self.vocabulary[feature] for feature in features]] = 1.0
+        idf = np.log((1 + len(self.styles)) / (1 + presence.sum(axis=0))) + 1
+
+        # each column holds one style's feature weights, normalized so a window containing all of them scores 1
+        weights = presence * idf
+        totals = weights.sum(axis=1, keepdims=True)
+        self.weights = (weights / np.where(totals == 0, 1, totals)).T
+
+        self._word_features = {}
+
+    def _word_row(self, word: str) -> list:
+        # vocabulary indexes of a word's features, words repeat a lot in descriptions so keep them
+        row = self._word_features.get(word)
+        if row is None:
+            row = [self.vocabulary[feature] for feature in _features(word) if feature in self.vocabulary]
+            self._word_features[word] = row
+        return row
+
+    def _windows(self, description: str) -> np.ndarray:
+        # binary feature matrix of every sliding window of the description
+        words = tokenize(description or '')
+        if not words:
+            return np.zeros((0, len(self.vocabulary)), dtype=bool)
+
+        counts = np.zeros((len(words) + 1, len(self.vocabulary)), dtype=np.int32)
+        for i, word in enumerate(words):
+            counts[i + 1, self._word_row(word)] = 1
+        counts = np.cumsum(counts, axis=0)
+
+        # window i covers words i..i+window-1, short descriptions are one window
+        window = min(self.window, len(words))
+        return (counts[window:] - counts[:-window]) > 0
+
+    def scores(self, description: str) -> np.ndarray:
+        """
+        Score every style against a description.
+
+        Parameters:
+        - description (str): The listing description.
+
+        Returns:
+        - np.ndarray: The best window score of each style, in the order of `styles`. Empty if the description has no words.
+        """
+        windows = self._windows(description)
+        if not len(windows):
+            return np.zeros(0)
+        return (windows @ self.weights).max(axis=0)
+
+    def match(self, description: str) -> str:
+        """
+        Returns the style the description matches best, or None if the description has no words or shares no
+        feature with any style (every score is 0, so no style is better than another).
+        """
+        scores = self.scores(description)
+        if not len(scores) or scores.max() <= 0:
+            return None
+        return self.styles[int(scores.argmax())]
+
+    def match_many(self, descriptions: List[str]) -> List[str]:
+        """
+        Match several descriptions with a single matrix product over all of their windows.
+
+        Parameters:
+        - descriptions (List[str]): The listing descriptions.
+
+        Returns:
+        - List[str]: The best matching style of each description, None for descriptions without words or that
+          share no feature with any style.
+        """
+        windows = [self._windows(description) for description in descriptions]
+        sizes = [len(w) for w in windows]
+        if not sum(sizes):
+            return [None] * len(descriptions)
+
+        scores = np.vstack(windows) @ self.weights
+
+        # best window of each description, skipping the ones without windows
+        starts = np.cumsum([0] + sizes[:-1])
+        nonempty = [i for i, size in enumerate(sizes) if size]
+        best = np.maximum.reduceat(scores, starts[nonempty], axis=0)
+
+        matches = [None] * len(descriptions)
+        for row, i in enumerate(nonempty):
+            if best[row].max() > 0:
+                matches[i] = self.styles[int(best[row].argmax())]
+        return matches
+
+
+@lru_cache(maxsize=256)
+def get_style_matcher(styles: tuple) -> StyleMatcher:
+    """
+    Returns a compiled StyleMatcher for a tuple of styles, reusing it for listings of the same car.
+    """
+    return StyleMatcher(list(styles))
@@ -1,10 +1,229 @@
 import threading
-import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+
+class StageTimeout(TimeoutError):
+    """A piece of work took longer than its own timeout."""
+
+class DeadlineExceeded(TimeoutError):
+    """The work of a listing ran past the deadline of the listing."""
+
+class Cancelled(Exception):
+    """The work was cancelled because other work of the same group failed."""
+
+# the TaskGroup whose work the current thread is running, see `check_cancelled`
+_local = threading.local()
+
+def current_group():
+    """Returns the TaskGroup whose work is running on this thread, or None."""
+    return getattr(_local, 'group', None)
+
+def check_cancelled() -> None:
+    """
+    Raise Cancelled if the work running on this thread belongs to a TaskGroup that was cancelled. Long or scarce
+    steps (e.g. checking out a browser) call this first so cancelled work gives up before it starts.
+    """
+    group = current_group()
+    if group is not None:
+        group.check()
+
+def deadline_in(seconds: float) -> float:
+    """Returns the deadline `seconds` from now, for the `deadline` of a TaskGroup (None stays None)."""
+    return None if seconds is None else time.monotonic() + seconds
+
+
+class TaskGroup():
+    """
+    Runs related work on threads and hands back futures.
+
+    Unlike a bare thread, an exception raised by the work is re-raised in whoever waits for it. Waits can have a
+    timeout of their own and the whole group can have a deadline. By default the first failure cancels the group:
+    work that has not started yet never starts, and running work that calls `check_cancelled` stops at that point,
+    so a listing that cannot be analyzed stops taking up browsers.
+
+    Work is never stopped from outside: when a wait or the deadline times out, the work is abandoned and its thread
+    runs on until it returns or next calls `check_cancelled`, still holding any browser or connection it has. Work
+    that can block should have a timeout of its own, as every request through `transport.Transport` does.
+
+    Methods:
+        submit(self, fn, *args, **kwargs)
+            Starts `fn` on a thread and returns its Future.
+
+        wait(self, future, timeout=None)
+            Waits for a future and returns its result, raising what the work raised.
+
+        wait_any(self, futures, timeout=None)
+            Waits until at least one of the futures is done.
+
+        cancel(self, error=None)
+            Cancels the work of the group.
+    """
+
+    def __init__(self, deadline: float = None, max_workers: int = None, fail_fast: bool = True):
+        """
+        Initialize a TaskGroup.
+
+        Parameters:
+        - deadline (float): The `time.monotonic()` time by which all of the work has to be done (optional, see
+          `deadline_in`).
+        - max_workers (int): How many pieces of work may run at once (optional).
+        - fail_fast (bool): Cancel the group as soon as any of its work fails. Defaults to True.
+
+        A group created by work of another group is cancelled along with it and keeps to its deadline.
+        """
+        self.parent = current_group()
+        if self.parent is not None and self.parent.deadline is not None:
+            deadline = self.parent.deadline if deadline is None else min(deadline, self.parent.deadline)
+
+        self.deadline = deadline
+        self.fail_fast = fail_fast
+        self.error = None
+        self._cancelled = threading.Event()
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self) -> None:
+        """Raise the reason the group was cancelled, if it was."""
+        if self.parent is not None:
+            self.parent.check()
+        if self._cancelled.is_set():
+            raise Cancelled(f'cancelled after {type(self.error).__name__}: {self.error}') from self.error
+
+    def remaining(self) -> float:
+        """Seconds left until the deadline, or None without one."""
+        return None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Start `fn(*args, **kwargs)` on a thread of the group.
+
+        Returns:
+        - Future: The future of the work. Its result re-raises whatever `fn` raised.
+
+        Raises:
+        - Cancelled: If the group was already cancelled.
+        """
+        self.check()
+        future = self._executor.submit(self._run, fn, args, kwargs)
+        with self._lock:
+            self._futures.append(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _run(self, fn, args, kwargs):
+        self.check()
+        previous, _local.group = current_group(), self
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.group = previous
+
+    def _done(self, future: Future) -> None:
+        if future.cancelled() or not self.fail_fast:
+            return
+        exc = future.exception()
+        if exc is not None and not isinstance(exc, Cancelled):
+            self.cancel(exc)
+
+    def cancel(self, error: Exception = None) -> None:
+        """
+        Cancel the group: work that has not started is dropped and running work stops at its next
+        `check_cancelled`.
+
+        Parameters:
+        - error (Exception): Why the group was cancelled (optional). Only the first reason is kept.
+        """
+        with self._lock:
+            if self.error is None:
+                self.error = error or Cancelled('cancelled')
+            self._cancelled.set()
+            futures = list(self._futures)
+
+        for future in futures:
+            future.cancel()
+
+    def _limit(self, timeout: float):
+        # the shorter of the wait's own timeout and what is left until the deadline, and which of them it is
+        remaining = self.remaining()
+        if remaining is not None and (timeout is None or remaining <= timeout):
+            return remaining, DeadlineExceeded
+        return timeout, StageTimeout
+
+    def wait(self, future: Future, timeout: float = None):
+        """
+        Wait for a future of the group and return its result.
+
+        Parameters:
+        - future (Future): A future returned by `submit`.
+        - timeout (float): Seconds to wait (optional). The group's deadline applies either way.
+
+        Raises:
+        - StageTimeout: If the future is not done within `timeout`. The group is cancelled.
+        - DeadlineExceeded: If the deadline passes first. The group is cancelled.
+        - Exception: Whatever the work raised, or Cancelled if it was cancelled before it ran.
+        """
+        limit, timeout_error = self._limit(timeout)
+        try:
+            return future.result(limit)
+
+        except FutureTimeoutError:
+            error = timeout_error(f'gave up after {limit:.1f}s')
+            self.cancel(error)
+            raise error from None
+
+        except CancelledError:
+            self.check()
+            raise Cancelled('cancelled') from None
+
+    def wait_any(self, futures, timeout: float = None) -> set:
+        """
+        Wait until at least one of the futures is done, or the timeout or deadline passes.
+
+        Returns:
+        - set: The futures that are done (empty if the timeout passed first).
+
+        Raises:
+        - DeadlineExceeded: If the deadline passed before any of the futures was done. The group is cancelled.
+        """
+        limit, timeout_error = self._limit(timeout)
+        done, _ = wait(futures, timeout=limit, return_when=FIRST_COMPLETED)
+        if not done and timeout_error is DeadlineExceeded:
+            error = DeadlineExceeded('the deadline passed')
+            self.cancel(error)
+            raise error
+        return done
+
+    def close(self, wait: bool = True) -> None:
+        """Shut the threads of the group down. Work that has not started is dropped."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # on an error nobody is left to use the running work, so stop it and do not wait for it
+        if exc is not None:
+            self.cancel(exc)
+        self.close(wait=exc is None)
+
 
 class ReturnValueThread(threading.Thread):
+    """
+    A thread that keeps the return value of its target and hands it back from `join`. An exception raised by the
+    target is re-raised by `join` as well. New code should use a TaskGroup.
+    """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.result = None
+        self.exception = None
 
     def run(self):
         if self._target is None:
@@ -12,8 +231,10 @@ class ReturnValueThread(threading.Thread):
         try:
             self.result = self._target(*self._args, **self._kwargs)
         except Exception as exc:
-            print(f'{type(exc).__name__}: {exc}', file=sys.stderr)  # properly handle the exception
+            self.exception = exc
 
     def join(self, *args, **kwargs):
         super().join(*args, **kwargs)
-        return self.result
\ No newline at end of file
+        if self.exception is not None:
+            raise self.exception
+        return self.result
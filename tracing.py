@@ -0,0 +1,247 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+# the active tracer, None while tracing is off so every span is a single check of this name
+_tracer = None
+
+
+class _Durations():
+    # the durations of one span name: exact count, total and max, and a uniform sample of at most `size` of them
+    # (reservoir sampling) for the percentiles, so a long running process does not keep every duration
+
+    __slots__ = ('size', 'count', 'total', 'max', 'samples')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+        if len(self.samples) < self.size:
+            self.samples.append(duration)
+        else:
+            # keep the new duration with the probability every earlier one had of being kept
+            slot = random.randrange(self.count)
+            if slot < self.size:
+                self.samples[slot] = duration
+
+
+class Tracer():
+    """
+    Collects timed spans: one event per span for a Chrome trace, and the durations of every span name for its
+    percentiles.
+
+    Methods:
+        record(self, name, start, end, args=None)
+            Adds a finished span.
+
+        stats(self)
+            Returns the count, total and percentiles of each span name.
+
+        export_json(self, path)
+            Writes the stats to a JSON file.
+
+        export_chrome_trace(self, path)
+            Writes the spans to a file chrome://tracing and Perfetto can open.
+    """
+
+    def __init__(self, max_events: int = None, max_samples: int = None):
+        """
+        Initialize a Tracer.
+
+        Parameters:
+        - max_events (int): The most spans kept for the Chrome trace. Durations keep being counted for the stats
+          after that. Defaults to `config.TRACE_MAX_EVENTS`.
+        - max_samples (int): The most durations of each span name kept for its percentiles. The count, total, mean
+          and max stay exact. Defaults to `config.TRACE_MAX_SAMPLES`.
+        """
+        self.max_events = max_events or config.TRACE_MAX_EVENTS
+        self.max_samples = max_samples or config.TRACE_MAX_SAMPLES
+        self.origin = time.perf_counter()
+        self.events = []
+        self.durations = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float, args: dict = None) -> None:
+        """
+        Add a finished span.
+
+        Parameters:
+        - name (str): The name the span is aggregated under, e.g. `kbb.get_ranges`.
+        - start (float): The `time.perf_counter()` time the span started.
+        - end (float): The `time.perf_counter()` time the span ended.
+        - args (dict): Details shown with the span in the Chrome trace (optional).
+        """
+        event = (name, start, end, threading.get_ident(), args)
+        with self._lock:
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = _Durations(self.max_samples)
+            durations.add(end - start)
+            if len(self.events) < self.max_events:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the count, total, mean, p50, p95, p99 and max seconds of each span name, slowest total first. The
+        percentiles come from a sample of the durations once a name has more than `max_samples` of them.
+        """
+        import numpy as np
+
+        with self._lock:
+            durations = {name: (d.count, d.total, d.max, np.array(d.samples)) for name, d in self.durations.items()}
+
+        stats = {}
+        for name, (count, total, longest, samples) in sorted(durations.items(), key=lambda item: -item[1][1]):
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            stats[name] = {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'p50': float(p50),
+                'p95': float(p95),
+                'p99': float(p99),
+                'max': longest,
+            }
+        return stats
+
+    def summary(self) -> str:
+        """Returns the stats as a text table, total in seconds and percentiles in milliseconds."""
+        lines = [f"{'span':<32} {'count':>7} {'total s':>9} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}"]
+        for name, s in self.stats().items():
+            lines.append(f"{name:<32} {s['count']:>7} {s['total']:>9.3f} {s['p50'] * 1e3:>10.2f} {s['p95'] * 1e3:>10.2f} {s['p99'] * 1e3:>10.2f}")
+        return '\n'.join(lines)
+
+    def export_json(self, path: str) -> None:
+        """Write the stats of every span name to a JSON file."""
+        with open(path, 'w') as file:
+            json.dump({'spans': self.stats(), 'dropped_events': self.dropped}, file, indent=4)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Write every kept span as a complete event of the Chrome trace event format."""
+        with self._lock:
+            events = list(self.events)
+
+        pid = os.getpid()
+        trace = [{
+            'name': name,
+            'cat': name.split('.')[0],
+            'ph': 'X',
+            'ts': (start - self.origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': args or {},
+        } for name, start, end, tid, args in events]
+
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file, default=str)
+
+
+def enable(max_events: int = None) -> Tracer:
+    """Turn tracing on with a fresh Tracer and return it."""
+    global _tracer
+    _tracer = Tracer(max_events)
+    return _tracer
+
+def disable() -> Tracer:
+    """Turn tracing off and return the Tracer that was active, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def get_tracer() -> Tracer:
+    """Returns the active Tracer, or None while tracing is off."""
+    return _tracer
+
+
+@contextmanager
+def _span(tracer: Tracer, name: str, args: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, start, time.perf_counter(), args)
+
+class _NullSpan():
+    # stands in for a span while tracing is off
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, **args):
+    """
+    Time a block of code as a span:
+
+        with span('ebay.fetch', url=url):
+            ...
+
+    Args:
+    - name (str): The name the span is aggregated under.
+    - **args: Details shown with the span in the Chrome trace.
+
+    Returns:
+    - A context manager. While tracing is off it is a shared object that does nothing.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _span(tracer, name, args)
+
+def traced(name: str = None):
+    """
+    Decorator that times every call of a function as a span. While tracing is off the function is called directly.
+
+    Args:
+    - name (str): The name of the span. Defaults to the module and name of the function.
+    """
+    def decorator(func):
+        span_name = name or f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.record(span_name, start, time.perf_counter())
+
+        return wrapper
+    return decorator
+
+def export(stats_path: str = None, events_path: str = None) -> None:
+    """
+    Write the stats and the Chrome trace of the active Tracer, to `config.TRACE_STATS_PATH` and
+    `config.TRACE_EVENTS_PATH` by default. Does nothing while tracing is off.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+    tracer.export_json(stats_path or config.TRACE_STATS_PATH)
+    tracer.export_chrome_trace(events_path or config.TRACE_EVENTS_PATH)
+
+
+# FLIPPER_TRACE=1 turns tracing on for the whole run
+if config.TRACE:
+    enable()
@@ -0,0 +1,334 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+import requests
+
+import config
+
+# the method rendered browser pages are stored under, they are kept apart from plain downloads of the same URL
+BROWSER = 'BROWSER'
+
+MODES = ('live', 'record', 'replay')
+
+
+class ReplayMiss(requests.ConnectionError):
+    """A request was made in replay mode that was never recorded."""
+
+
+def request_key(method: str, url: str, data=None) -> str:
+    """
+    Returns the key a request is stored under: a hash of its method, URL and form data. Form fields are sorted, so
+    the same request always gets the same key.
+    """
+    if isinstance(data, dict):
+        data = urlencode(sorted(data.items()))
+    if isinstance(data, str):
+        data = data.encode()
+
+    digest = hashlib.sha256(f'{method.upper()} {url}\n'.encode())
+    digest.update(data or b'')
+    return digest.hexdigest()
+
+
+class ResponseStore:
+    """
+    A content-addressed store of recorded responses.
+
+    Every body is written once to `blobs/` under the SHA-256 of its content, so the same page recorded under many
+    requests takes the space of one. An SQLite index maps the key of each request (see `request_key`) to its status,
+    content type and body.
+
+    Methods:
+        put(self, method, url, data, status, content_type, content)
+            Records a response and returns its request key.
+
+        get(self, key)
+            Returns the status, content type and body recorded under a key, or None.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize a ResponseStore.
+
+        Parameters:
+        - path (str): The directory of the store. It is created if it does not exist.
+        """
+        self.path = path
+        os.makedirs(os.path.join(path, 'blobs'), exist_ok=True)
+
+        # one connection shared by every thread, guarded by a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, 'index.sqlite3'), timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            method TEXT NOT NULL,
+            url TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            content_type TEXT,
+            blob TEXT NOT NULL,
+            recorded REAL NOT NULL)''')
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.path, 'blobs', digest[:2], digest)
+
+    def put(self, method: str, url: str, data, status: int, content_type: str, content: bytes) -> str:
+        """
+        Record a response. A later recording of the same request replaces the earlier one.
+
+        Returns:
+        - str: The key of the request.
+        """
+        key = request_key(method, url, data)
+        digest = hashlib.sha256(content).hexdigest()
+
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary name first so a reader never sees half a body
+            partial = f'{path}.{threading.get_ident()}.partial'
+            with open(partial, 'wb') as file:
+                file.write(content)
+            os.replace(partial, path)
+
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)', (key, method.upper(), url, status, content_type, digest, time.time()))
+        return key
+
+    def get(self, key: str) -> tuple:
+        """
+        Look a recorded response up.
+
+        Returns:
+        - tuple: The status, content type and body of the response, or None if the request was not recorded.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT status, content_type, blob FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        status, content_type, digest = row
+        with open(self._blob_path(digest), 'rb') as file:
+            return status, content_type, file.read()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+class ReplayServer:
+    """
+    A local HTTP stand-in that serves the responses of a ResponseStore at `/r/<request key>`, with the status and
+    content type they were recorded with. Requests that were never recorded get a 404 with an `X-Replay-Miss`
+    header. Browsers load recorded pages from it the same way.
+    """
+
+    def __init__(self, store: ResponseStore, host: str = '127.0.0.1', port: int = 0):
+        self.store = store
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections open so replayed requests do not pay for a new connection each
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                recorded = server.store.get(self.path.rsplit('/', 1)[-1]) if self.path.startswith('/r/') else None
+                if recorded is None:
+                    self.send_response(404)
+                    self.send_header('X-Replay-Miss', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                status, content_type, content = recorded
+                self.send_response(status)
+                self.send_header('Content-Type', content_type or 'application/octet-stream')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        """Starts serving in a background thread and returns the base URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class Transport:
+    """
+    The one way the scrapers reach eBay, KBB and vPIC.
+
+    In 'live' mode requests go straight out. In 'record' mode they go out as well, and every response, along with
+    the page sources the scrapers read out of the browser, is saved to a ResponseStore. In 'replay' mode nothing
+    leaves the machine: requests and browser pages are served from the store by a ReplayServer, so a recorded run
+    can be repeated at full speed and parsed exactly as it was the first time.
+
+    Methods:
+        get(self, url, **kwargs)
+            Sends a GET request and returns the `requests.Response`.
+
+        post(self, url, data=None, **kwargs)
+            Sends a POST request and returns the `requests.Response`.
+
+        browser_url(self, url)
+            Returns the URL a browser should load for `url`.
+
+        save_page(self, browser, url)
+            Records the page a browser has loaded for `url`.
+    """
+
+    def __init__(self, mode: str = 'live', store: ResponseStore = None, replay_url: str = None):
+        """
+        Initialize a Transport.
+
+        Parameters:
+        - mode (str): 'live', 'record' or 'replay'. Defaults to 'live'.
+        - store (ResponseStore): Where responses are recorded and replayed from. Needed for 'record', and for
+          'replay' unless `replay_url` is given.
+        - replay_url (str): The base URL of a running ReplayServer to replay from (optional). One is started for
+          `store` when it is not given.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown transport mode {mode!r}, expected one of {', '.join(MODES)}")
+        if mode == 'record' and store is None:
+            raise ValueError('Recording needs a store')
+
+        self.mode = mode
+        self.store = store
+        self.server = None
+
+        if mode == 'replay' and replay_url is None:
+            if store is None:
+                raise ValueError('Replaying needs a store or the URL of a replay server')
+            self.server = ReplayServer(store)
+            replay_url = self.server.start()
+        self.replay_url = replay_url
+
+        # replayed requests all go to the same server, reuse its connections
+        self._session = requests.Session() if mode == 'replay' else None
+
+    def _replay_url(self, method: str, url: str, data=None) -> str:
+        return f'{self.replay_url}/r/{request_key(method, url, data)}'
+
+    def request(self, method: str, url: str, data=None, **kwargs) -> requests.Response:
+        """
+        Send a request through the transport. Without a `timeout` of its own it waits at most
+        `config.HTTP_STEP_TIMEOUT` seconds for the server, so a hung server does not hold a worker thread forever.
+
+        Raises:
+        - ReplayMiss: In replay mode, if the request was never recorded.
+        """
+        kwargs.setdefault('timeout', config.HTTP_STEP_TIMEOUT)
+
+        if self.mode == 'replay':
+            response = self._session.get(self._replay_url(method, url, data), timeout=kwargs.get('timeout'))
+            if response.headers.get('X-Replay-Miss'):
+                raise ReplayMiss(f'{method.upper()} {url} was not recorded')
+            response.url = url
+            return response
+
+        response = requests.request(method, url, data=data, **kwargs)
+        if self.mode == 'record':
+            self.store.put(method, url, data, response.status_code, response.headers.get('Content-Type'), response.content)
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, data=None, **kwargs) -> requests.Response:
+        return self.request('POST', url, data=data, **kwargs)
+
+    def browser_url(self, url: str) -> str:
+        """
+        Returns the URL a browser should load for `url`: the recorded page on the replay server in replay mode,
+        `url` itself otherwise.
+        """
+        if self.mode == 'replay':
+            return self._replay_url(BROWSER, url)
+        return url
+
+    def save_page(self, browser, url: str) -> None:
+        """
+        In record mode, save the source of the page the browser has loaded as the page of `url`. Call it once the
+        elements the scraper reads are on the page.
+        """
+        if self.mode == 'record':
+            self.store.put(BROWSER, url, None, 200, 'text/html; charset=utf-8', browser.page_source.encode())
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.stop()
+        if self._session is not None:
+            self._session.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport() -> Transport:
+    """
+    Returns the process wide Transport, set up from `config.TRANSPORT_MODE`, `config.TRANSPORT_STORE` and
+    `config.TRANSPORT_REPLAY_URL` on first use.
+    """
+    global _transport
+
+    with _transport_lock:
+        if _transport is None:
+            mode = config.TRANSPORT_MODE
+            store = ResponseStore(config.TRANSPORT_STORE) if mode != 'live' and config.TRANSPORT_STORE else None
+            _transport = Transport(mode, store, config.TRANSPORT_REPLAY_URL)
+
+    return _transport
+
+def set_transport(transport: Transport) -> Transport:
+    """Replace the process wide Transport, e.g. to replay a store in a benchmark. Returns the one it replaced."""
+    global _transport
+
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a recorded response store as a local replay server.')
+    parser.add_argument('store', nargs='?', default=config.TRANSPORT_STORE, help='directory of the response store')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    server = ReplayServer(ResponseStore(args.store), port=args.port)
+    print(f'replaying {len(server.store)} responses at {server.url} (set FLIPPER_TRANSPORT_MODE=replay and FLIPPER_TRANSPORT_REPLAY_URL={server.url})')
+    server._server.serve_forever()
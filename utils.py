@@ -1,6 +1,5 @@
 import re
 from difflib import SequenceMatcher
-import pandas as pd
 import json
 
 def dollar_to_int(str):
@@ -58,6 +57,9 @@ def calc_simalarity(a:str, b:str):
     return SequenceMatcher(None, a, b).ratio()
 
 def get_best_pair(a:list, b:list):
+    # pandas takes longer to import than most commands take to run, only load it here
+    import pandas as pd
+
     data = []
 
     for a_item in a:
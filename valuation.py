@@ -0,0 +1,170 @@
+from dataclasses import asdict, dataclass, field
+
+from utils import dollar_to_int
+
+# the KBB range fields and the profit metrics computed from them
+RANGE_FIELDS = ('trade_in_low', 'trade_in_high', 'trade_in_value', 'private_party_low', 'private_party_high', 'private_party_value')
+METRIC_FIELDS = ('best_delta', 'worst_delta', 'avg_delta', 'trade_in_spread', 'listing_best_delta', 'listing_worst_delta', 'listing_avg_delta', 'negotiation_amount')
+
+# deal tiers by `listing_worst_delta` (low private party value minus listing price), named after the advice the
+# styled briefing gives for each threshold
+DEAL_TIERS = (
+    (-300, 'priced low'),
+    (100, 'good price'),
+    (2000, 'negotiate'),
+    (float('inf'), 'overpriced'),
+)
+
+
+def _metrics(trade_in_low, trade_in_high, trade_in_value, private_party_low, private_party_high, private_party_value, listing_price) -> dict:
+    # plain arithmetic, so the same code works on single numbers and on whole NumPy columns
+    return {
+        # buying at trade-in and selling private party
+        'best_delta': private_party_high - trade_in_low,
+        'worst_delta': private_party_low - trade_in_high,
+        'avg_delta': private_party_value - trade_in_value,
+        'trade_in_spread': (trade_in_high - trade_in_low) / 2,
+
+        # buying at the listing price and selling private party
+        'listing_best_delta': private_party_high - listing_price,
+        'listing_worst_delta': private_party_low - listing_price,
+        'listing_avg_delta': private_party_value - listing_price,
+
+        # how far the price has to come down to buy at the low trade-in value
+        'negotiation_amount': listing_price - trade_in_low,
+    }
+
+
+@dataclass
+class ListingValuation:
+    """
+    The numbers behind a listing's briefing: what the car is, what it is listed at, its KBB ranges, and the profit
+    metrics computed from them once when the record is created.
+    """
+
+    url: str
+    year: str
+    make: str
+    model: str
+    style: str
+    mileage: int
+    listing_price: float
+
+    trade_in_low: float
+    trade_in_high: float
+    trade_in_value: float
+    private_party_low: float
+    private_party_high: float
+    private_party_value: float
+
+    best_delta: float = field(init=False)
+    worst_delta: float = field(init=False)
+    avg_delta: float = field(init=False)
+    trade_in_spread: float = field(init=False)
+    listing_best_delta: float = field(init=False)
+    listing_worst_delta: float = field(init=False)
+    listing_avg_delta: float = field(init=False)
+    negotiation_amount: float = field(init=False)
+
+    # ranges interpolated from a `kbb_scrape.MileageCurve` carry how far off the curve is at its nearest real anchor
+    trade_in_nearest_anchor: int = None
+    trade_in_anchor_error: float = None
+    private_party_nearest_anchor: int = None
+    private_party_anchor_error: float = None
+
+    def __post_init__(self):
+        metrics = _metrics(*(getattr(self, name) for name in RANGE_FIELDS), self.listing_price)
+        for name, value in metrics.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_ranges(cls, year, make: str, style: str, model: str, mileage: int, listing_price: float, listing_url: str, private_party_ranges: dict, trade_in_ranges: dict) -> 'ListingValuation':
+        """
+        Build a valuation from the dollar strings `kbb_scrape.get_ranges` returns, parsing each one exactly once.
+        The `nearest_anchor` and `anchor_error` of ranges interpolated from a mileage curve are kept as well.
+
+        Args:
+        - year (int): The year of the car.
+        - make (str): The make of the car.
+        - style (str): The style of the car.
+        - model (str): The model of the car.
+        - mileage (int): The mileage of the car.
+        - listing_price (int): The listing price of the car.
+        - listing_url (str): The URL of the listing.
+        - private_party_ranges (dict): A dictionary containing the private party price range for the car.
+        - trade_in_ranges (dict): A dictionary containing the trade-in price range for the car.
+
+        Returns:
+        - ListingValuation: The valuation with its profit metrics.
+        """
+        return cls(
+            url=listing_url,
+            year=year,
+            make=make,
+            model=model,
+            style=style,
+            mileage=mileage,
+            listing_price=listing_price,
+            trade_in_low=dollar_to_int(trade_in_ranges['low']),
+            trade_in_high=dollar_to_int(trade_in_ranges['high']),
+            trade_in_value=dollar_to_int(trade_in_ranges['value']),
+            private_party_low=dollar_to_int(private_party_ranges['low']),
+            private_party_high=dollar_to_int(private_party_ranges['high']),
+            private_party_value=dollar_to_int(private_party_ranges['value']),
+            trade_in_nearest_anchor=trade_in_ranges.get('nearest_anchor'),
+            trade_in_anchor_error=trade_in_ranges.get('anchor_error'),
+            private_party_nearest_anchor=private_party_ranges.get('nearest_anchor'),
+            private_party_anchor_error=private_party_ranges.get('anchor_error'),
+        )
+
+    @property
+    def deal_tier(self) -> str:
+        """The DEAL_TIERS name of the listing, from `listing_worst_delta`."""
+        return deal_tier(self.listing_worst_delta)
+
+    def to_dict(self) -> dict:
+        """Returns every field of the valuation as a flat dictionary."""
+        return asdict(self)
+
+
+def deal_tier(listing_worst_delta: float) -> str:
+    """
+    Returns the name of the DEAL_TIERS tier a listing falls in.
+    """
+    for threshold, name in DEAL_TIERS:
+        if listing_worst_delta <= threshold:
+            return name
+
+
+def profit_metrics(listings):
+    """
+    Compute the profit metrics of many listings at once with NumPy.
+
+    Args:
+    - listings: A pandas DataFrame, or a dictionary of equal length arrays, with the `RANGE_FIELDS` columns and
+      `listing_price`.
+
+    Returns:
+    - The DataFrame with the `METRIC_FIELDS` columns added when a DataFrame was given, otherwise a dictionary of
+      NumPy arrays with the `METRIC_FIELDS`.
+    """
+    import numpy as np
+
+    columns = [np.asarray(listings[name], dtype=float) for name in RANGE_FIELDS + ('listing_price',)]
+    metrics = _metrics(*columns)
+
+    if hasattr(listings, 'assign'):
+        return listings.assign(**metrics)
+    return metrics
+
+
+def valuations_to_arrays(valuations) -> dict:
+    """
+    Collect the numeric fields of many ListingValuation records into NumPy arrays, one per field, ready for
+    `profit_metrics` or vectorized ranking.
+    """
+    import numpy as np
+
+    valuations = list(valuations)
+    names = RANGE_FIELDS + METRIC_FIELDS + ('listing_price', 'mileage')
+    return {name: np.fromiter((getattr(valuation, name) for valuation in valuations), dtype=float, count=len(valuations)) for name in names}
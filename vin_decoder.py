@@ -1,26 +1,247 @@
-import requests
 import json
+import os
+import threading
+from collections import OrderedDict
+
+import config
+from cache import SQLiteCache
+from tracing import traced
+from vin_index import OfflineVinIndex
+
+# fields of a decode that depend on the whole VIN (serial number and check digit) and must never be shared
+# between VINs with the same pattern
+VIN_SPECIFIC_FIELDS = ('VIN', 'ErrorCode', 'ErrorText', 'AdditionalErrorText', 'SuggestedVIN', 'PossibleValues')
+
+
+class VinPatternCache:
+    """
+    A memo of vPIC decodes keyed by VIN pattern instead of the full VIN.
+
+    Every VIN with the same WMI and VDS (positions 1-8), model year and plant (positions 10-11) decodes to the same
+    make, model and body class, so one decode serves them all. Positions 12-14 are added for low volume
+    manufacturers whose WMI continues there. Only clean decodes are cached, without `VIN_SPECIFIC_FIELDS`.
+
+    Entries live in a small in-memory LRU in front of a SQLiteCache.
+
+    Methods:
+        get(self, VIN, year)
+            Returns the cached decode for the VIN's pattern, or None on a miss.
+
+        set(self, VIN, year, result)
+            Caches a decode under the VIN's pattern.
+    """
+
+    def __init__(self, path: str = None, ttl: float = None, max_entries: int = None, memory_entries: int = None):
+        """
+        Initialize a VinPatternCache.
+
+        Parameters:
+        - path (str): The SQLite file to store patterns in. Defaults to `config.VIN_CACHE_PATH`, an empty path keeps them in memory only.
+        - ttl (float): Seconds a decode stays valid. Defaults to `config.VIN_CACHE_TTL`.
+        - max_entries (int): The most patterns kept on disk. Defaults to `config.VIN_CACHE_MAX_ENTRIES`.
+        - memory_entries (int): The most patterns kept in memory. Defaults to `config.VIN_CACHE_MEMORY_ENTRIES`.
+        """
+        path = config.VIN_CACHE_PATH if path is None else path
+        self.memory_entries = memory_entries or config.VIN_CACHE_MEMORY_ENTRIES
+        self.disk = SQLiteCache(path or ':memory:', 'vin', ttl=ttl or config.VIN_CACHE_TTL, max_entries=max_entries or config.VIN_CACHE_MAX_ENTRIES)
+
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pattern(VIN: str, year) -> str:
+        """Returns the pattern key of a VIN, or None if it is not a full 17 character VIN."""
+        VIN = str(VIN).strip().upper()
+        if len(VIN) != 17:
+            return None
+
+        key = VIN[:8] + VIN[9:11]
+        if VIN[2] == '9': key += VIN[11:14]
+        return SQLiteCache.make_key(key, year)
+
+    def _remember(self, key: str, shared: dict) -> None:
+        with self._lock:
+            self._memory[key] = shared
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, VIN: str, year) -> dict:
+        key = self.pattern(VIN, year)
+        if key is None:
+            return None
+
+        with self._lock:
+            shared = self._memory.get(key)
+            if shared is not None: self._memory.move_to_end(key)
+
+        if shared is None:
+            shared = self.disk.get(key)
+            if shared is not None: self._remember(key, shared)
+
+        # the counters are read by the service's metrics while other threads decode, update them under the lock
+        with self._lock:
+            if shared is None: self.misses += 1
+            else: self.hits += 1
+
+        return None if shared is None else dict(shared, VIN=VIN)
+
+    def set(self, VIN: str, year, result: dict) -> None:
+        key = self.pattern(VIN, year)
+
+        # a decode with errors may be about this VIN's check digit or serial, keep it to itself
+        if key is None or result is None or str(result.get('ErrorCode', '0')) != '0':
+            return
+
+        shared = {field: value for field, value in result.items() if field not in VIN_SPECIFIC_FIELDS}
+        self._remember(key, shared)
+        self.disk.set(key, shared)
+
+    def stats(self) -> dict:
+        """Returns a dictionary with the `hits` and `misses` of the cache and the number of patterns in `memory`."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'memory': len(self._memory)}
+
+
+# requests is only loaded by the functions that go to vPIC, decodes served from the offline index or the pattern
+# cache start without it
 
 def get_models(make):
-    with requests.get(f'https://vpic.nhtsa.dot.gov/api/vehicles/getmodelsformake/{make}?format=json') as r:
+    from transport import get_transport
+    with get_transport().get(f'{config.VPIC_URL}/getmodelsformake/{make}?format=json') as r:
         blob = json.loads(r.text)
         return dict(blob['Results'])
 
 def get_all_makes():
-    with requests.get(f'https://vpic.nhtsa.dot.gov/api/vehicles/getallmakes?format=json') as r:
+    from transport import get_transport
+    with get_transport().get(f'{config.VPIC_URL}/getallmakes?format=json') as r:
         blob = json.loads(r.text)
         return dict(blob['Results'])
 
+@traced('vin.decode')
 def vin_decode(VIN, year):
-    with requests.get(f'https://vpic.nhtsa.dot.gov/api/vehicles/decodevinvaluesextended/{VIN}?format=json&modelyear={year}') as r:
+    from transport import get_transport
+    with get_transport().get(f'{config.VPIC_URL}/decodevinvaluesextended/{VIN}?format=json&modelyear={year}') as r:
         blob = json.loads(r.text)
         
         return blob['Results'][0]
 
+@traced('vin.decode_batch')
+def vin_decode_batch(pairs):
+    """
+    Decode many VINs with as few requests as possible through the vPIC DecodeVINValuesBatch endpoint.
+
+    Args:
+    - pairs (list): (VIN, year) pairs. The year may be '' when it is unknown.
+
+    Returns:
+    - list: The decoded results in the same order as `pairs`, as returned by `vin_decode`. VINs whose pattern is
+      already cached (see `VinPatternCache`) are not sent at all. VINs missing from a
+      batch response, or in a batch that failed, are decoded one at a time with `vin_decode`; a VIN that fails
+      that too gets None.
+    """
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+
+    # VINs whose pattern was decoded before are not sent again
+    cache = get_pattern_cache()
+    for i, (VIN, year) in enumerate(pairs):
+        results[i] = cache.get(VIN, year)
+    todo = [i for i, result in enumerate(results) if result is None]
+
+    import requests
+    from transport import get_transport
+
+    for start in range(0, len(todo), config.VPIC_BATCH_SIZE):
+        chunk = [pairs[i] for i in todo[start:start + config.VPIC_BATCH_SIZE]]
+        data = ';'.join(f'{VIN},{year}' for VIN, year in chunk)
+
+        # post the whole chunk and index the answers by VIN, a failed request leaves every VIN to the fallback
+        decoded = {}
+        try:
+            with get_transport().post(f'{config.VPIC_URL}/DecodeVINValuesBatch/', data={'format': 'json', 'data': data}) as r:
+                r.raise_for_status()
+                for result in json.loads(r.text)['Results']:
+                    decoded.setdefault(result['VIN'].upper(), result)
+
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+
+        for i, (VIN, year) in enumerate(chunk):
+            result = decoded.get(str(VIN).upper())
+            if result is None:
+                try:
+                    result = vin_decode(VIN, year)
+                except (requests.RequestException, ValueError, KeyError, IndexError):
+                    result = None
+
+            results[todo[start + i]] = result
+            cache.set(VIN, year, result)
+
+    return results
+
+_offline_index = None
+_pattern_cache = None
+_globals_lock = threading.Lock()
+
+def get_pattern_cache() -> VinPatternCache:
+    """
+    Returns the process wide VinPatternCache, creating it on first use.
+    """
+    global _pattern_cache
+
+    with _globals_lock:
+        if _pattern_cache is None:
+            _pattern_cache = VinPatternCache()
+
+    return _pattern_cache
+
+def get_offline_index():
+    """
+    Returns the offline VIN index at `config.VIN_INDEX_PATH`, or None if there is no index file.
+    """
+    global _offline_index
+
+    with _globals_lock:
+        if _offline_index is None and config.VIN_INDEX_PATH and os.path.exists(config.VIN_INDEX_PATH):
+            _offline_index = OfflineVinIndex(config.VIN_INDEX_PATH)
+
+    return _offline_index
+
+@traced('vin.lookup')
+def vin_lookup(VIN, year):
+    """
+    Decode a VIN from the offline index or the VIN pattern cache when possible and only call vPIC (`vin_decode`)
+    when neither knows it.
+
+    Args:
+    - VIN (str): The VIN to decode.
+    - year (int): The listing's year.
+
+    Returns:
+    - dict: The decoded result. Offline results only carry `VIN`, `Make`, `Model`, `BodyClass` and `ModelYear`.
+    """
+    index = get_offline_index()
+    if index is not None:
+        result = index.decode(VIN, year)
+        if result is not None:
+            return result
+
+    cache = get_pattern_cache()
+    result = cache.get(VIN, year)
+    if result is None:
+        result = vin_decode(VIN, year)
+        cache.set(VIN, year, result)
+
+    return result
+
 def get_vin_decode_info():
-    with requests.get(f'https://vpic.nhtsa.dot.gov/api/vehicles/getvehiclevariablelist?format=json') as r:
+    from transport import get_transport
+    with get_transport().get(f'{config.VPIC_URL}/getvehiclevariablelist?format=json') as r:
         blob = json.loads(r.text)
         return dict(blob['Results'])
 
 if __name__ == '__main__':
-    print(json.dumps(vin_decode('Wauvvafr3Ca007152', ''), indent=4))
\ No newline at end of file
+    print(json.dumps(vin_decode('Wauvvafr3Ca007152', ''), indent=4))
@@ -0,0 +1,208 @@
+import csv
+import os
+import re
+import sqlite3
+import threading
+
+# position 10 of a VIN encodes the model year, the same 30 characters repeat every 30 years starting in 1980
+YEAR_CODES = 'ABCDEFGHJKLMNPRSTVWXY123456789'
+
+
+def model_year(VIN: str, year_hint=None) -> int:
+    """
+    Decode the model year from position 10 of a VIN.
+
+    Args:
+    - VIN (str): The 17 character VIN.
+    - year_hint (int): A year the vehicle is believed to be from, e.g. the listing's year (optional). It decides
+      between the two 30 year cycles when it is given.
+
+    Returns:
+    - int: The model year, or None if position 10 is not a year code.
+    """
+    VIN = VIN.upper()
+    if len(VIN) < 10 or VIN[9] not in YEAR_CODES:
+        return None
+
+    first = 1980 + YEAR_CODES.index(VIN[9])
+    candidates = (first, first + 30)
+
+    try:
+        year_hint = int(year_hint)
+        return min(candidates, key=lambda year: abs(year - year_hint))
+
+    except (TypeError, ValueError):
+        # since 2010 passenger vehicles use a letter in position 7 and older ones a digit
+        return candidates[1] if VIN[6].isalpha() else candidates[0]
+
+
+def _pattern_regex(pattern: str):
+    # vPIC style VDS patterns: '*' matches any character and [..] matches one character of a set
+    return re.compile(''.join(
+        '.' if token == '*' else token if token.startswith('[') else re.escape(token)
+        for token in re.findall(r'\[[^\]]*\]|.', pattern.upper())
+    ))
+
+
+def _year(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _specificity(pattern: str) -> int:
+    return sum(1 for token in re.findall(r'\[[^\]]*\]|.', pattern) if token != '*')
+
+
+def build_index(path: str, wmis, patterns) -> None:
+    """
+    Write an offline VIN index file from a vPIC data snapshot.
+
+    Args:
+    - path (str): The SQLite file to write. An existing index is replaced.
+    - wmis (iterable): Rows with a `WMI` (3 or 6 characters) and the `Make` it belongs to.
+    - patterns (iterable): Rows with a `WMI`, a VDS `Pattern` for positions 4-8 (`*` and `[..]` allowed), an optional
+      `YearFrom`/`YearTo` range, and the `Model` and `BodyClass` it decodes to.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE wmi (wmi TEXT PRIMARY KEY, make TEXT NOT NULL) WITHOUT ROWID')
+        conn.execute('''CREATE TABLE pattern (
+            wmi TEXT NOT NULL, pattern TEXT NOT NULL, year_from INTEGER, year_to INTEGER,
+            model TEXT NOT NULL, body_class TEXT NOT NULL, specificity INTEGER NOT NULL)''')
+
+        conn.executemany('INSERT OR REPLACE INTO wmi VALUES (?, ?)', (
+            (row['WMI'].upper(), row['Make']) for row in wmis))
+
+        conn.executemany('INSERT INTO pattern VALUES (?, ?, ?, ?, ?, ?, ?)', (
+            (row['WMI'].upper(), row['Pattern'].upper(), _year(row.get('YearFrom')), _year(row.get('YearTo')),
+             row['Model'], row['BodyClass'], _specificity(row['Pattern']))
+            for row in patterns))
+
+        conn.execute('CREATE INDEX pattern_wmi ON pattern (wmi, specificity)')
+    conn.close()
+
+
+def snapshot_from_decoded(results) -> tuple:
+    """
+    Build snapshot rows for `build_index` out of results decoded by vPIC (e.g. from `vin_decode_batch`).
+
+    Every decoded VIN contributes its WMI and an exact pattern of its positions 4-8 limited to its model year.
+
+    Args:
+    - results (iterable): Decoded vPIC results with at least `VIN`, `Make`, `Model`, `BodyClass` and `ModelYear`.
+
+    Returns:
+    - tuple: The WMI rows and the pattern rows.
+    """
+    wmis = {}
+    patterns = {}
+    for result in results:
+        VIN = (result.get('VIN') or '').upper()
+        if len(VIN) != 17 or not result.get('Make') or not result.get('Model') or not result.get('BodyClass'):
+            continue
+
+        wmi = VIN[:3] + VIN[11:14] if VIN[2] == '9' else VIN[:3]
+        wmis[wmi] = {'WMI': wmi, 'Make': result['Make']}
+
+        year = result.get('ModelYear') or None
+        patterns[(wmi, VIN[3:8], year)] = {
+            'WMI': wmi, 'Pattern': VIN[3:8], 'YearFrom': year, 'YearTo': year,
+            'Model': result['Model'], 'BodyClass': result['BodyClass']}
+
+    return list(wmis.values()), list(patterns.values())
+
+
+class OfflineVinIndex:
+    """
+    Decodes the make, model, body class and model year of a VIN from a local index file without calling vPIC.
+
+    The index holds a WMI to make table and VDS pattern rules per WMI (see `build_index`). Rules are read from the
+    file once per WMI and kept in memory, so repeat decodes of the same manufacturer only cost a few regex matches.
+
+    Methods:
+        decode(self, VIN, year)
+            Returns a vPIC shaped result for the VIN, or None if the index cannot fully decode it.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize an OfflineVinIndex.
+
+        Parameters:
+        - path (str): The index file written by `build_index`.
+        """
+        self.path = path
+        self._conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._rules = {}
+
+    def _load(self, wmi: str):
+        # make and compiled pattern rules of one WMI, most specific pattern first
+        with self._lock:
+            if wmi not in self._rules:
+                make = self._conn.execute('SELECT make FROM wmi WHERE wmi = ?', (wmi,)).fetchone()
+                rows = self._conn.execute(
+                    'SELECT pattern, year_from, year_to, model, body_class FROM pattern WHERE wmi = ? ORDER BY specificity DESC',
+                    (wmi,)).fetchall()
+
+                self._rules[wmi] = (make[0] if make else None, [
+                    (_pattern_regex(pattern), year_from, year_to, model, body_class)
+                    for pattern, year_from, year_to, model, body_class in rows
+                ])
+
+        return self._rules[wmi]
+
+    def decode(self, VIN: str, year=None) -> dict:
+        """
+        Decode a VIN from the index.
+
+        Args:
+        - VIN (str): The 17 character VIN.
+        - year (int): The listing's year, used to pick the model year cycle (optional).
+
+        Returns:
+        - dict: A dictionary with the `VIN`, `Make`, `Model`, `BodyClass` and `ModelYear` keys vPIC uses, or None when
+          the VIN is not in the index or no pattern gives its model and body class.
+        """
+        VIN = VIN.strip().upper()
+        if len(VIN) != 17:
+            return None
+
+        # manufacturers building fewer than 1000 vehicles a year share a WMI ending in 9 and continue it in positions 12-14
+        wmis = [VIN[:3] + VIN[11:14], VIN[:3]] if VIN[2] == '9' else [VIN[:3]]
+        year_decoded = model_year(VIN, year)
+
+        for wmi in wmis:
+            make, rules = self._load(wmi)
+            if make is None:
+                continue
+
+            for regex, year_from, year_to, model, body_class in rules:
+                if year_decoded is not None:
+                    if year_from is not None and year_decoded < year_from: continue
+                    if year_to is not None and year_decoded > year_to: continue
+
+                if regex.fullmatch(VIN[3:8]):
+                    return {
+                        'VIN': VIN,
+                        'Make': make,
+                        'Model': model,
+                        'BodyClass': body_class,
+                        'ModelYear': str(year_decoded) if year_decoded else '',
+                    }
+
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the offline VIN index from a vPIC snapshot.')
+    parser.add_argument('wmi_csv', help='CSV with WMI and Make columns')
+    parser.add_argument('pattern_csv', help='CSV with WMI, Pattern, YearFrom, YearTo, Model and BodyClass columns')
+    parser.add_argument('--out', default='vin_index.sqlite3')
+    args = parser.parse_args()
+
+    with open(args.wmi_csv, newline='') as wmi_file, open(args.pattern_csv, newline='') as pattern_file:
+        build_index(args.out, csv.DictReader(wmi_file), csv.DictReader(pattern_file))
@@ -0,0 +1,114 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def _unknown(VIN: str) -> dict:
+    # the shape vPIC answers with when it cannot decode a VIN
+    return {'VIN': VIN, 'ErrorCode': '11', 'ErrorText': '11 - Incorrect Model Year, decoded data may not be accurate!', 'Make': '', 'Model': '', 'BodyClass': ''}
+
+
+class VpicStandIn:
+    """
+    A local stand-in for the NHTSA vPIC decode endpoints, answering from a fixed set of decoded records.
+
+    It serves `decodevinvaluesextended/<VIN>` and `DecodeVINValuesBatch/` under `/api/vehicles`, so pointing
+    `config.VPIC_URL` at `url` lets `vin_decode` and `vin_decode_batch` run without the network. The number of
+    requests served is counted in `requests`.
+
+    Methods:
+        start(self)
+            Starts serving in a background thread and returns the base URL.
+
+        stop(self)
+            Stops the server.
+    """
+
+    def __init__(self, records: dict, host: str = '127.0.0.1', port: int = 0):
+        """
+        Initialize a VpicStandIn.
+
+        Parameters:
+        - records (dict): A dictionary mapping VINs to the result vPIC would return for them.
+        - host (str): The interface to listen on. Defaults to localhost.
+        - port (int): The port to listen on. Defaults to any free port.
+        """
+        self.records = {VIN.upper(): record for VIN, record in records.items()}
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/vehicles'
+
+    def decode(self, VIN: str) -> dict:
+        return dict(self.records.get(VIN.strip().upper(), _unknown(VIN)), VIN=VIN)
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, results: list) -> None:
+                standin.requests += 1
+                body = json.dumps({'Count': len(results), 'Message': 'Results returned successfully', 'Results': results}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = urlparse(self.path).path.rstrip('/').split('/')
+                if len(path) > 1 and path[-2].lower() == 'decodevinvaluesextended':
+                    self._reply([standin.decode(unquote(path[-1]))])
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if urlparse(self.path).path.rstrip('/').split('/')[-1].lower() != 'decodevinvaluesbatch':
+                    self.send_error(404)
+                    return
+
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                pairs = [pair for pair in form.get('data', [''])[0].split(';') if pair]
+                self._reply([standin.decode(pair.split(',')[0]) for pair in pairs])
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve decoded VIN records as a local stand-in for the vPIC API.')
+    parser.add_argument('records', help='JSON file mapping VINs to decoded vPIC results')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on (default: any free port)')
+    args = parser.parse_args()
+
+    with open(args.records) as file:
+        standin = VpicStandIn(json.load(file), port=args.port)
+
+    print(f'serving vPIC stand-in at {standin.url}')
+    standin._server.serve_forever()